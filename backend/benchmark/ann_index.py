@@ -0,0 +1,139 @@
+'''
+Recall@k and latency of Milvus dense indexes on a synthetic corpus.
+
+    uv run python -m benchmark.ann_index --n 200000 --dim 512 --k 10
+    uv run python -m benchmark.ann_index --configs '[{"index_type": "HNSW", "M": 32, "ef": 128}]'
+
+Each config is built into a temporary collection of the server at MILVUS_URI,
+results are compared with brute force inner product search.
+'''
+import argparse
+import json
+import time
+from typing import List
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+from indexer.index_config import IndexConfig
+from indexer.milvus_backend import milvus_token, milvus_uri
+
+COLLECTION = "benchmark_ann_index"
+INSERT_BATCH = 10000
+
+DEFAULT_CONFIGS = [
+    {"index_type": "FLAT"},
+    {"index_type": "AUTOINDEX"},
+    {"index_type": "HNSW", "M": 16, "efConstruction": 200, "ef": 64},
+    {"index_type": "HNSW", "M": 32, "efConstruction": 360, "ef": 128},
+    {"index_type": "IVF_FLAT", "nlist": 1024, "nprobe": 16},
+    {"index_type": "IVF_SQ8", "nlist": 1024, "nprobe": 16},
+    {"index_type": "IVF_PQ", "nlist": 1024, "m": 32, "nbits": 8, "nprobe": 16},
+    {"index_type": "DISKANN", "search_list": 64},
+]
+
+def synthetic_corpus(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    '''unit vectors around random centers, embeddings of real images are clustered as well'''
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def brute_force(corpus: np.ndarray, queries: np.ndarray, k: int, chunk: int = 100000) -> np.ndarray:
+    '''exact top k ids by inner product'''
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(corpus), chunk):
+        scores = queries @ corpus[start:start + chunk].T
+        ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+
+        scores = np.concatenate([best_scores, scores], axis=1)
+        ids = np.concatenate([best_ids, ids], axis=1)
+        top = np.argsort(-scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+    return best_ids
+
+def create_collection(client: MilvusClient, dim: int, corpus: np.ndarray):
+    if client.has_collection(COLLECTION):
+        client.drop_collection(COLLECTION)
+
+    schema = MilvusClient.create_schema(auto_id=False)
+    schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+    schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dim)
+    client.create_collection(collection_name=COLLECTION, schema=schema)
+
+    for start in range(0, len(corpus), INSERT_BATCH):
+        batch = corpus[start:start + INSERT_BATCH]
+        client.insert(collection_name=COLLECTION, data=[
+            {"id": start + i, "vector": vector.tolist()} for i, vector in enumerate(batch)
+        ])
+    client.flush(collection_name=COLLECTION)
+
+def build_index(client: MilvusClient, config: IndexConfig) -> float:
+    '''return seconds to build and load the index'''
+    client.release_collection(collection_name=COLLECTION)
+    for name in client.list_indexes(collection_name=COLLECTION):
+        client.drop_index(collection_name=COLLECTION, index_name=name)
+
+    start = time.perf_counter()
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", index_name="vector_index", index_type=config.index_type,
+                           metric_type=config.metric_type, params=config.build)
+    client.create_index(collection_name=COLLECTION, index_params=index_params, sync=True)
+    client.load_collection(collection_name=COLLECTION)
+    return time.perf_counter() - start
+
+def run(client: MilvusClient, config: IndexConfig, queries: np.ndarray, exact: np.ndarray, k: int) -> dict:
+    build_seconds = build_index(client, config)
+
+    latencies: List[float] = []
+    recalls: List[float] = []
+    for query, truth in zip(queries, exact):
+        start = time.perf_counter()
+        hits = client.search(collection_name=COLLECTION, data=[query.tolist()], anns_field="vector",
+                             search_params={"metric_type": config.metric_type, "params": config.search_params(k)},
+                             limit=k, output_fields=[])[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len({hit["id"] for hit in hits} & set(truth.tolist())) / k)
+
+    return {
+        "index_type": config.index_type,
+        "build": config.build,
+        "search": config.search_params(k),
+        "build_s": round(build_seconds, 2),
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="corpus size")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--configs", type=str, default="", help="JSON list of index configs, see indexer/index_config.py")
+    args = parser.parse_args()
+
+    configs = [IndexConfig.parse(config) for config in (json.loads(args.configs) if args.configs else DEFAULT_CONFIGS)]
+
+    corpus = synthetic_corpus(args.n, args.dim, args.clusters)
+    # queries near corpus vectors, like text queries near the images they describe
+    rng = np.random.default_rng(1)
+    queries = corpus[rng.integers(0, args.n, args.queries)] + 0.3 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    exact = brute_force(corpus, queries, args.k)
+
+    client = MilvusClient(uri=milvus_uri, token=milvus_token)
+    try:
+        create_collection(client, args.dim, corpus)
+        for config in configs:
+            print(json.dumps(run(client, config, queries, exact, args.k)), flush=True)
+    finally:
+        client.drop_collection(COLLECTION)
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+'''
+Per-query BM25 work and stored text before and after routing captions by language.
+
+    uv run python -m benchmark.bm25_routing --n 20000 --cn-ratio 0.1
+
+Before, every caption was stored in both text fields and every query searched both sparse fields.
+Now only captions with chinese are stored for the chinese analyzer, and a query only searches
+the fields it can match. Captions are synthetic, searched with the embedded flat backend.
+'''
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from indexer.backend import SearchRequest
+from indexer.flat_backend import FlatBackend, TOKENIZERS
+from indexer.schema import *
+from indexer.text_route import bm25_fields, cn_text_of
+
+EN_WORDS = "husky dog sled snow winter robot metal eye blue flower white garden city night street river mountain cat".split()
+CN_WORDS = "白色 花 狗 雪 机器人 城市 夜晚 河流 山 猫 街道".split()
+
+QUERIES = ["husky in the snow", "robot", "white flower", "花", "城市 夜晚", "cat 猫", "blue eye robot", "山"]
+
+def synthetic_captions(n: int, cn_ratio: float, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    captions = []
+    for _ in range(n):
+        words = list(rng.choice(EN_WORDS, 12))
+        if rng.random() < cn_ratio:
+            words += list(rng.choice(CN_WORDS, 4))
+        captions.append(" ".join(words))
+    return captions
+
+def postings(captions: List[str], field: str) -> int:
+    '''distinct (document, token) pairs, the size of a sparse inverted index'''
+    return sum(len(set(TOKENIZERS[field](caption))) for caption in captions)
+
+def latency(backend: FlatBackend, collection: str, fields_of_query) -> dict:
+    times = []
+    for _ in range(20):
+        for query in QUERIES:
+            requests = [SearchRequest(field, query, limit=10) for field in fields_of_query(query)]
+            start = time.perf_counter()
+            backend.hybrid_search(collection, None, requests, 10)
+            times.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(float(np.percentile(times, 50)), 3), "p99_ms": round(float(np.percentile(times, 99)), 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--cn-ratio", type=float, default=0.1, help="fraction of captions with chinese words")
+    args = parser.parse_args()
+
+    captions = synthetic_captions(args.n, args.cn_ratio)
+    zeros = {field: np.zeros(dim).tolist() for field, dim in DENSE_FIELDS.items()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = FlatBackend((Path(tmp) / "vectors.db").as_posix())
+        for name, cn_text in [("before", lambda caption: caption), ("after", cn_text_of)]:
+            backend.create_collection(name)
+            backend.upsert(name, DEFAULT_PARTITION, [
+                {FIELD_ID: id, FIELD_TEXT: caption, FIELD_CN_TEXT: cn_text(caption), **zeros}
+                for id, caption in enumerate(captions)
+            ])
+
+        before_fields = lambda query: [FIELD_TEXT_SPARSE, FIELD_CN_TEXT_SPARSE]
+        for name, cn_text, fields_of_query in [("before", lambda caption: caption, before_fields), ("after", cn_text_of, bm25_fields)]:
+            cn_captions = [cn_text(caption) for caption in captions]
+            print(json.dumps({
+                "layout": name,
+                "sub_requests_per_query": round(float(np.mean([len(fields_of_query(query)) for query in QUERIES])), 2),
+                "stored_text_bytes": sum(len(caption.encode()) for caption in captions) + sum(len(text.encode()) for text in cn_captions),
+                "sparse_postings": postings(captions, FIELD_TEXT_SPARSE) + postings(cn_captions, FIELD_CN_TEXT_SPARSE),
+                **latency(backend, name, fields_of_query),
+            }), flush=True)
+        backend.close()
+
+if __name__ == "__main__":
+    main()
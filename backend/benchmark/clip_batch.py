@@ -0,0 +1,64 @@
+'''
+CLIP image embedding throughput at batch 1 vs micro-batches.
+
+    uv run python -m benchmark.clip_batch --images 256 --threads 8
+
+Images are synthetic, preprocessed once and excluded from the timing of the forward passes.
+`service` submits the images from `--threads` threads to `clip_embed.ImageEmbedder`, as the watcher
+workers do, and includes the preprocessing done by the submitting threads.
+'''
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from indexer import clip_embed
+
+def synthetic_images(n: int, size: int = 640, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)) for _ in range(n)]
+
+def forward(tensors: torch.Tensor, batch_size: int) -> float:
+    '''images/sec of embedding `tensors` in batches of `batch_size`'''
+    clip_embed.encode_images(tensors[:batch_size]) # warm up
+    start = time.perf_counter()
+    for offset in range(0, len(tensors), batch_size):
+        clip_embed.encode_images(tensors[offset:offset + batch_size])
+    return len(tensors) / (time.perf_counter() - start)
+
+def service(images, threads: int, batch_size: int, max_wait: float) -> float:
+    embedder = clip_embed.ImageEmbedder(batch_size, max_wait)
+    embedder.submit(images[0]).result() # warm up
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        futures = list(pool.map(embedder.submit, images))
+    for future in futures:
+        future.result()
+    return len(images) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=8, help="threads submitting to the service")
+    parser.add_argument("--max-wait", type=float, default=clip_embed.CLIP_BATCH_WAIT)
+    args = parser.parse_args()
+
+    images = synthetic_images(args.images)
+    _, preprocess, _ = clip_embed.getModel()
+    tensors = torch.stack([preprocess(image) for image in images])
+
+    for batch_size in (1, 32):
+        print(json.dumps({
+            "device": clip_embed.device,
+            "torch_threads": torch.get_num_threads(),
+            "batch_size": batch_size,
+            "forward_images_per_sec": round(forward(tensors, batch_size), 1),
+            "service_images_per_sec": round(service(images, args.threads, batch_size, args.max_wait), 1),
+        }), flush=True)
+
+if __name__ == "__main__":
+    main()
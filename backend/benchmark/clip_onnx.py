@@ -0,0 +1,98 @@
+'''
+Accuracy, throughput and memory of the CLIP backends on CPU.
+
+    uv run python -m benchmark.clip_onnx --images 128 --threads 8
+
+Compares the open_clip model (torch) with its ONNX export in float32 and dynamically quantized
+to int8. Accuracy is the cosine similarity of each embedding with the torch embedding of the same
+input, images are synthetic and captions are generated from a small vocabulary.
+'''
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import open_clip
+import torch
+
+from benchmark.clip_batch import synthetic_images
+from indexer import clip_embed, clip_onnx
+
+WORDS = "a photo of husky dog in the snow white flower robot with blue eyes city at night".split()
+
+def rss_mb() -> float:
+    '''resident memory of the process, 0 where /proc is not available'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return 0.0
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+
+def run(model, images: torch.Tensor, tokens: torch.Tensor, batch_size: int = 32):
+    def encode(fn, inputs):
+        outputs = [fn(inputs[:batch_size])] # warm up
+        start = time.perf_counter()
+        outputs = [fn(inputs[offset:offset + batch_size]) for offset in range(0, len(inputs), batch_size)]
+        return np.concatenate([output.numpy() for output in outputs]), len(inputs) / (time.perf_counter() - start)
+
+    with torch.inference_mode():
+        image_features, images_per_sec = encode(model.encode_image, images)
+        text_features, texts_per_sec = encode(model.encode_text, tokens)
+    return image_features, text_features, images_per_sec, texts_per_sec
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=128)
+    parser.add_argument("--threads", type=int, default=clip_onnx.CLIP_ONNX_THREADS, help="intra-op threads, 0 for one per core")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    name, pretrained = clip_embed.MODEL_NAME, clip_embed.PRETRAINED
+    rng = np.random.default_rng(0)
+    captions = [" ".join(rng.choice(WORDS, 8)) for _ in range(args.images)]
+
+    base = rss_mb()
+    model, _, preprocess = open_clip.create_model_and_transforms(name, pretrained=pretrained)
+    model.eval()
+    torch_memory = rss_mb() - base
+    tokenizer = open_clip.get_tokenizer(name)
+    images = torch.stack([preprocess(image) for image in synthetic_images(args.images)])
+    tokens = tokenizer(captions)
+
+    results = {"torch": (run(model, images, tokens), torch_memory)}
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path, text_path = clip_onnx.export(model, tokenizer, clip_embed.IMAGE_SIZE, Path(tmp))
+        del model
+        for quantization in ("none", "int8"):
+            paths = (image_path, text_path) if quantization == "none" else (clip_onnx.quantize(image_path), clip_onnx.quantize(text_path))
+            base = rss_mb()
+            onnx_model = clip_onnx.OnnxClip(*paths, threads=args.threads)
+            results[f"onnx_{quantization}"] = (run(onnx_model, images, tokens), rss_mb() - base,
+                                               sum(path.stat().st_size for path in paths) / 2**20)
+            del onnx_model
+
+    reference_images, reference_texts = results["torch"][0][:2]
+    for backend, (outputs, memory, *size) in results.items():
+        image_features, text_features, images_per_sec, texts_per_sec = outputs
+        image_cosine, text_cosine = cosine(image_features, reference_images), cosine(text_features, reference_texts)
+        print(json.dumps({
+            "backend": backend,
+            "images_per_sec": round(images_per_sec, 1),
+            "texts_per_sec": round(texts_per_sec, 1),
+            "image_cosine_mean": round(float(image_cosine.mean()), 5),
+            "image_cosine_min": round(float(image_cosine.min()), 5),
+            "text_cosine_mean": round(float(text_cosine.mean()), 5),
+            "text_cosine_min": round(float(text_cosine.min()), 5),
+            "rss_mb": round(memory, 1),
+            **({"model_file_mb": round(size[0], 1)} if size else {}),
+        }), flush=True)
+
+if __name__ == "__main__":
+    main()
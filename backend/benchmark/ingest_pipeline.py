@@ -0,0 +1,78 @@
+'''
+Decode and embed throughput of the ingestion, in one thread vs the staged pipeline.
+
+    uv run python -m benchmark.ingest_pipeline --images 256 --size 3000
+
+`serial` decodes, preprocesses and embeds each file on one thread as the ingestion did before.
+`pipeline` decodes and preprocesses in `indexer.preprocess_pool` worker processes and embeds
+in micro-batches by `clip_embed.image_embedder`, with `INFERENCE_THREADS` torch threads.
+Files are synthetic JPEGs written to a temporary directory.
+'''
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from indexer import clip_embed, preprocess_pool
+
+def write_images(directory: Path, n: int, size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # smooth noise compresses like a photo, pure noise would make decoding the bottleneck of the disk
+    base = rng.integers(0, 256, (size // 16, size // 16, 3), dtype=np.uint8)
+    paths = []
+    for i in range(n):
+        image = Image.fromarray(np.roll(base, i, axis=0)).resize((size, size * 3 // 4), Image.BILINEAR)
+        path = directory / f"{i:05d}.jpg"
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+def serial(paths) -> float:
+    start = time.perf_counter()
+    for path in paths:
+        with Image.open(path) as image:
+            clip_embed.get_image_embed(image)
+    return len(paths) / (time.perf_counter() - start)
+
+def pipeline(paths) -> float:
+    pool = preprocess_pool.get_pool()
+    for _, decoded in pool.imap(paths[:pool.slots]): # start the workers
+        decoded.result()
+
+    start = time.perf_counter()
+    futures = [clip_embed.image_embedder.submit_tensor(decoded.result().tensor) for _, decoded in pool.imap(paths)]
+    for future in futures:
+        future.result()
+    return len(paths) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--size", type=int, default=3000, help="width of the images")
+    args = parser.parse_args()
+
+    clip_embed.getModel()
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_images(Path(tmp), args.images, args.size)
+        clip_embed.get_image_embed(Image.open(paths[0])) # warm up
+
+        results = {"serial": serial(paths)}
+        results["pipeline"] = pipeline(paths)
+        preprocess_pool.close_pool()
+
+    for mode, images_per_sec in results.items():
+        print(json.dumps({
+            "mode": mode,
+            "cpu_count": preprocess_pool.CPU_COUNT,
+            "workers": preprocess_pool.PREPROCESS_WORKERS if mode == "pipeline" else 0,
+            "torch_threads": torch.get_num_threads(),
+            "images_per_sec": round(images_per_sec, 1),
+        }), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+'''
+Memory saved and recall lost by storing dense vectors as float16 or bfloat16.
+
+    uv run python -m benchmark.vector_dtype --n 200000 --collection-size 2000000
+
+Vectors are rounded through `indexer.vector_dtype` as they would be stored, searched
+exactly with float32 queries and compared with the float32 results, so the recall
+loss is the loss of precision alone. See benchmark.ann_index for the loss of the index.
+'''
+import argparse
+import json
+
+import numpy as np
+
+from benchmark.ann_index import brute_force, synthetic_corpus
+from indexer import vector_dtype
+from indexer.schema import DENSE_FIELDS
+
+BYTES_PER_VALUE = {"float32": 4, "float16": 2, "bfloat16": 2}
+
+def round_trip(vectors: np.ndarray, dtype: str) -> np.ndarray:
+    return np.array([vector_dtype.decode(vector_dtype.encode(vector, dtype), dtype) for vector in vectors], dtype=np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="corpus size of the recall test")
+    parser.add_argument("--collection-size", type=int, default=2000000, help="rows of the memory estimate")
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    for field, dim in DENSE_FIELDS.items():
+        corpus = synthetic_corpus(args.n, dim, args.clusters)
+        rng = np.random.default_rng(1)
+        queries = corpus[rng.integers(0, args.n, args.queries)] + 0.3 * rng.normal(size=(args.queries, dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        exact = brute_force(corpus, queries, args.k)
+
+        for dtype in vector_dtype.VECTOR_DTYPES:
+            stored = round_trip(corpus, dtype)
+            found = brute_force(stored, queries, args.k)
+            recall = np.mean([len(set(a.tolist()) & set(b.tolist())) / args.k for a, b in zip(found, exact)])
+            raw_bytes = args.collection_size * dim * BYTES_PER_VALUE[dtype]
+            print(json.dumps({
+                "field": field,
+                "dtype": dtype,
+                f"recall@{args.k}": round(float(recall), 4),
+                "max_abs_error": float(np.abs(stored - corpus).max()),
+                "raw_vector_mb": round(raw_bytes / 2**20, 1),
+                "saved_mb": round((args.collection_size * dim * 4 - raw_bytes) / 2**20, 1),
+            }), flush=True)
+
+if __name__ == "__main__":
+    main()
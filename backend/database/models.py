@@ -30,4 +30,25 @@ class Image(SQLModel, table=True):
     directory: Optional[Directory] = Relationship(back_populates="images")
 
     last_modified: Optional[datetime] = Field(default=None)
-    file_size: Optional[int] = Field(default=None)  # in bytes
\ No newline at end of file
+    file_size: Optional[int] = Field(default=None)  # in bytes
+
+class DuplicateImage(SQLModel, table=True):
+    '''membership of a near-duplicate cluster, a cluster is named by its smallest image id'''
+    scope: str = Field(primary_key=True)  # "global" or directory id of the scan
+    image_id: int = Field(primary_key=True)
+    cluster_id: int = Field(index=True)
+    similarity: float = Field(default=0.0)  # best cosine similarity to another member
+
+
+class DuplicateScan(SQLModel, table=True):
+    '''progress of the incremental near-duplicate scan of a scope'''
+    scope: str = Field(primary_key=True)
+    threshold: float
+    last_probed_id: int = Field(default=0)  # images with larger ids are probed by the next scan
+    last_scan: Optional[datetime] = Field(default=None)
+
+
+class ImageUpdate(SQLModel, table=True):
+    '''last time an existing image was modified and indexed again, the near-duplicate scans probe it again'''
+    image_id: int = Field(primary_key=True)
+    updated: datetime = Field(index=True)
@@ -1,7 +1,7 @@
-from typing import List
+from typing import List, Optional
 import database.database as db
-from sqlmodel import Session, select
-from database.models import Directory, Image
+from sqlmodel import Session, delete, func, select
+from database.models import Directory, DuplicateImage, DuplicateScan, Image, ImageUpdate
 from pathlib import Path
 
 def get_directory_id(path: str) -> int | None:
@@ -36,3 +36,35 @@ def get_all_listening_paths():
         return list(map(lambda x: x.path, results))
 
 
+
+def mark_images_unindexed(ids: List[int]):
+    '''clear last_modified of images failed to insert into vector db, so they are processed again on next scan'''
+    if len(ids) == 0:
+        return
+    with Session(db.engine) as session:
+        images = session.exec(select(Image).where(Image.id.in_(ids))).all()
+        for image in images:
+            image.last_modified = None
+        session.commit()
+
+def forget_deleted_images(session: Session, ids: Optional[List[int]] = None):
+    '''
+    remove the duplicate and update rows of deleted images, all of them and the scan state if `ids` is None.
+    Image ids are reused after the largest one is deleted, the scans probe ids above the largest remaining one again.
+    Run in the session deleting the images, before its commit.
+    '''
+    if ids is None:
+        session.exec(delete(DuplicateImage))
+        session.exec(delete(ImageUpdate))
+        session.exec(delete(DuplicateScan))
+        return
+    if len(ids) == 0:
+        return
+    session.exec(delete(DuplicateImage).where(DuplicateImage.image_id.in_(ids)))
+    session.exec(delete(ImageUpdate).where(ImageUpdate.image_id.in_(ids)))
+
+    session.flush()
+    last_id = session.exec(select(func.max(Image.id))).one() or 0
+    for state in session.exec(select(DuplicateScan).where(DuplicateScan.last_probed_id > last_id)).all():
+        state.last_probed_id = last_id
+        session.add(state)
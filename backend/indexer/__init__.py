@@ -1,9 +1,18 @@
-from indexer.vector_db import is_collection_exist, create_embed_db, COLLECTION_NAME
-from indexer.vector_db import delete_one, list_data, delete_by_list, get_images_by_ids
-from indexer.vector_db import insert_image, query_images_by_text, change_partition
+from indexer.vector_db import is_collection_exist, create_embed_db, COLLECTION_NAME, close_backend, close_backend_async
+from indexer.vector_db import delete_one, list_data, iter_data, delete_by_list, get_images_by_ids
+from indexer.vector_db import insert_image, query_images_by_text, change_partition, search_cache_stats, embed_cache_stats, content_store_stats
+from indexer.vector_db import embed_image, insert_images, insert_many, make_row, embed_decoded, insert_decoded
+from indexer.vector_db import caption_image, caption_decoded, embed_captioned
+from indexer.vector_db import load_partitions, drop_partition, truncate_collection, rebuild_indexes, migrate_collection, is_schema_current
+from indexer.vector_db import query_images_by_image_id, query_images_by_image, near_duplicate_pairs
+from indexer.vector_db import list_partitions, current_models, legacy_models, stale_rows, reembed_rows
+from indexer.vector_db import query_images_by_text_async, query_images_page, SEARCH_CANDIDATE_MULTIPLIER, MAX_SEARCH_CANDIDATES
+from indexer.vector_db import CursorExpired, CursorMismatch
+from indexer.batch_insert import BatchInserter
+from indexer.snapshot import export_snapshot, import_snapshot
 
 from indexer.vector_db import FIELD_ID, FIELD_TEXT
 
-from indexer import genai_api
+from indexer import genai_api, preprocess_pool
 
 genai_api.init()
\ No newline at end of file
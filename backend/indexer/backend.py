@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Iterator, List, Optional
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "milvus") # milvus | flat
+
+@dataclass
+class SearchRequest:
+    '''one sub search of a hybrid search'''
+    anns_field: str
+    data: Any # query vector, or query text for BM25 fields
+    limit: int = 10
+    param: dict = field(default_factory=dict)
+    filter: str = ""
+
+class VectorBackend:
+    '''
+    Storage of `indexer.vector_db`.
+    Rows are dicts keyed by the fields in `indexer.schema`, methods raise on failure.
+    '''
+    def has_collection(self, collection: str) -> bool:
+        raise NotImplementedError
+
+    def create_collection(self, collection: str):
+        '''create an empty collection, an existing one is dropped'''
+        raise NotImplementedError
+
+    def fields(self, collection: str) -> List[str]:
+        '''stored fields of an existing collection, collections created by older versions may miss some of `STORED_FIELDS`'''
+        raise NotImplementedError
+
+    def analyzers_current(self, collection: str) -> bool:
+        '''the text fields of an existing collection are analyzed like the ones of a new collection'''
+        raise NotImplementedError
+
+    def drop_collection(self, collection: str):
+        raise NotImplementedError
+
+    def rename_collection(self, collection: str, new_name: str):
+        raise NotImplementedError
+
+    def rebuild_indexes(self, collection: str):
+        '''rebuild the dense indexes of an existing collection with the configured index types'''
+        pass
+
+    def list_partitions(self, collection: str) -> List[str]:
+        raise NotImplementedError
+
+    def create_partition(self, collection: str, partition: str):
+        raise NotImplementedError
+
+    def drop_partition(self, collection: str, partition: str):
+        '''drop a partition with all its rows'''
+        raise NotImplementedError
+
+    def upsert(self, collection: str, partition: str, rows: List[dict]):
+        raise NotImplementedError
+
+    def delete(self, collection: str, ids: List[int]):
+        raise NotImplementedError
+
+    def get(self, collection: str, ids: List[int], output_fields: List[str]) -> List[dict]:
+        raise NotImplementedError
+
+    def iterate(self, collection: str, partitions: Optional[List[str]], output_fields: List[str],
+                batch_size: int, filter: str = "") -> Iterator[List[dict]]:
+        '''yield rows matching `filter` in batches, nothing is held between batches so callers may write meanwhile'''
+        raise NotImplementedError
+
+    def search(self, collection: str, partitions: Optional[List[str]], anns_field: str, vectors: List[list],
+               limit: int, param: dict, filter: str = "", output_fields: Optional[List[str]] = None) -> List[List[dict]]:
+        '''one dense search per vector, return [{"id":int, "distance":float, **output_fields}, ...] of each vector'''
+        raise NotImplementedError
+
+    def hybrid_search(self, collection: str, partitions: Optional[List[str]],
+                      requests: List[SearchRequest], limit: int) -> List[dict]:
+        '''run all requests and fuse them with RRF, return [{"id":int, "distance":float}, ...]'''
+        raise NotImplementedError
+
+    async def hybrid_search_async(self, collection: str, partitions: Optional[List[str]],
+                                  requests: List[SearchRequest], limit: int) -> List[dict]:
+        '''`hybrid_search` for the event loop, runs in a worker thread unless the backend has an async client'''
+        return await asyncio.to_thread(self.hybrid_search, collection, partitions, requests, limit)
+
+    def close(self):
+        pass
+
+    async def close_async(self):
+        '''`close` with the async clients of the running event loop'''
+        self.close()
+
+backend: Optional[VectorBackend] = None
+backend_lock = threading.Lock()
+
+def get_backend() -> VectorBackend:
+    '''create the backend selected by `VECTOR_BACKEND` on first use'''
+    global backend
+    if backend is None:
+        with backend_lock:
+            if backend is None:
+                if VECTOR_BACKEND == "milvus":
+                    from indexer.milvus_backend import MilvusBackend
+                    backend = MilvusBackend()
+                elif VECTOR_BACKEND == "flat":
+                    from indexer.flat_backend import FlatBackend
+                    backend = FlatBackend()
+                else:
+                    raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+    return backend
+
+def close_backend():
+    global backend
+    with backend_lock:
+        if backend is not None:
+            backend.close()
+            backend = None
+
+async def close_backend_async():
+    global backend
+    with backend_lock:
+        current, backend = backend, None
+    if current is not None:
+        await current.close_async()
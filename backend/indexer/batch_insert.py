@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from indexer import vector_db
+
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "64"))
+INSERT_BATCH_WAIT = float(os.getenv("INSERT_BATCH_WAIT", "2")) # seconds
+
+class BatchInserter:
+    '''
+    Accumulate rows built by `vector_db.make_row` and flush them with `vector_db.insert_many`
+    when `max_rows` rows are pending or the oldest row waited `max_wait` seconds.
+
+    `add` returns a Future resolved with the success flag of the row.
+    The time threshold is only checked by the background thread, call `start` to enable it.
+    '''
+    def __init__(self, max_rows: int = INSERT_BATCH_SIZE, max_wait: float = INSERT_BATCH_WAIT):
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+
+        # {collection: [(row, future), ...]}
+        self.pending: Dict[str, List[Tuple[dict, Future]]] = {}
+        self.n_pending = 0
+        self.first_add_time: Optional[float] = None
+
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock() # keep the order of flushed batches
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+
+    def add(self, collection: str, row: dict) -> Future:
+        future = Future()
+        with self.condition:
+            self.pending.setdefault(collection, []).append((row, future))
+            self.n_pending += 1
+            if self.first_add_time is None:
+                self.first_add_time = time.time()
+            full = self.n_pending >= self.max_rows
+            self.condition.notify()
+
+        if full:
+            self.flush()
+        return future
+
+    def _take(self):
+        with self.condition:
+            pending = self.pending
+            self.pending = {}
+            self.n_pending = 0
+            self.first_add_time = None
+        return pending
+
+    def flush(self):
+        '''insert all pending rows, block until done'''
+        with self.flush_lock:
+            pending = self._take()
+            for collection, items in pending.items():
+                try:
+                    results = vector_db.insert_many(collection, [row for row, _ in items])
+                except Exception as e:
+                    print(e)
+                    results = [False] * len(items)
+
+                for (_, future), successed in zip(items, results):
+                    future.set_result(successed)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and self.first_add_time is None:
+                    self.condition.wait()
+
+                if not self.running:
+                    break
+
+                timeout = self.first_add_time + self.max_wait - time.time()
+                if timeout > 0:
+                    self.condition.wait(timeout)
+                    continue
+
+            self.flush()
+
+        self.flush()
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''stop the background thread and flush remaining rows'''
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+CAPTION_CACHE_PATH = os.getenv("CAPTION_CACHE_PATH", "captions.db") # sqlite file, ":memory:" to keep it per process
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", "1024")) # captions kept in memory
+
+class CaptionCache:
+    '''
+    Thread safe cache of Gemini captions keyed by the content hash of the image file, see `content_store.content_hash`.
+    Captions imported from data.json or cached by older versions are keyed by file name,
+    the indexer reads them on a hash miss and caches them again under the hash.
+    Captions are written to a sqlite file, one transaction each, so a crash loses at most the caption being written
+    and never leaves a partial one. The most recently used `max_size` captions are also kept in memory.
+    '''
+    def __init__(self, path: str = CAPTION_CACHE_PATH, max_size: int = CAPTION_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[str, str]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS captions (id TEXT PRIMARY KEY, text TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY)")
+
+    def _put(self, id: str, text: str):
+        self.items[id] = text
+        self.items.move_to_end(id)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def get(self, id: str) -> Optional[str]:
+        with self.lock:
+            text = self.items.get(id)
+            if text is not None:
+                self.items.move_to_end(id)
+                self.memory_hits += 1
+                return text
+
+            row = self.conn.execute("SELECT text FROM captions WHERE id = ?", (id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put(id, row[0])
+            return row[0]
+
+    def put(self, id: str, text: str):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO captions (id, text) VALUES (?, ?)", (id, text))
+            self._put(id, text)
+
+    def import_json(self, path: str) -> int:
+        '''
+        import a {file name: caption} JSON file once, later calls with the same path do nothing.
+        Captions already cached are kept. return the number of captions imported
+        '''
+        path = os.path.abspath(path)
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM imports WHERE path = ?", (path,)).fetchone() is not None:
+                return 0
+            with open(path, "r") as f:
+                captions = json.load(f)
+
+            # one transaction, an interrupted import is done again on the next start
+            with self.conn:
+                before = self.conn.total_changes
+                self.conn.executemany("INSERT OR IGNORE INTO captions (id, text) VALUES (?, ?)", captions.items())
+                imported = self.conn.total_changes - before
+                self.conn.execute("INSERT INTO imports (path) VALUES (?)", (path,))
+            return imported
+
+    def stats(self) -> dict:
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total > 0 else 0.0,
+                "memory_size": len(self.items),
+                "max_size": self.max_size,
+                "size": self.conn.execute("SELECT COUNT(*) FROM captions").fetchone()[0],
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+caption_cache = CaptionCache()
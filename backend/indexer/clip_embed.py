@@ -1,41 +1,178 @@
+import os
 import threading
+import time
 import torch
+from concurrent.futures import Future
+from io import BytesIO
+from typing import List, Tuple
 from PIL import Image
 import open_clip
 import numpy as np
 
+from indexer import clip_onnx
+
 def to_np(arr: torch.Tensor) -> np.ndarray:
     return arr.detach().cpu().numpy()
 
-model = None
-preprocess = None
-tokenizer = None
+CLIP_MODEL = os.getenv("CLIP_MODEL", "ViT-B-32/laion2b_s34b_b79k") # "{model name}/{pretrained tag}" of open_clip
+MODEL_NAME, PRETRAINED = CLIP_MODEL.split("/", 1)
+IMAGE_SIZE = 224 # input resolution of the model
+
+CLIP_BACKENDS = ("torch", "onnx")
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "torch").lower() # "onnx" runs the model on ONNX Runtime, see clip_onnx
+
+if CLIP_BACKEND not in CLIP_BACKENDS:
+    raise ValueError(f"Unknown CLIP_BACKEND: {CLIP_BACKEND}, expected one of {CLIP_BACKENDS}")
+
+def embedding_model_id(model: str, backend: str = "torch", quantization: str = "none") -> str:
+    '''
+    id of the vectors embedded by an open_clip `model` on a backend, "{model}" with torch and
+    "{model}@onnx-{quantization}" with ONNX Runtime, whose embeddings differ from the torch ones
+    '''
+    return model if backend == "torch" else f"{model}@{backend}-{quantization}"
+
+def parse_model_id(model_id: str) -> Tuple[str, str, str, str]:
+    '''return (model name, pretrained tag, backend, quantization) of an id built by `embedding_model_id`'''
+    model, _, runtime = model_id.partition("@")
+    name, pretrained = model.split("/", 1)
+    backend, _, quantization = runtime.partition("-") if runtime != "" else ("torch", "", "none")
+    return name, pretrained, backend, quantization
+
+MODEL_ID = embedding_model_id(CLIP_MODEL, CLIP_BACKEND, clip_onnx.CLIP_ONNX_QUANTIZE)
+
+def eval_transform(name: str, pretrained: str):
+    '''the preprocess of `open_clip.create_model_and_transforms(name, pretrained)` without loading the weights'''
+    config = open_clip.get_model_config(name)
+    # the pretrained weights override the preprocess of the architecture
+    cfg = {**config.get("preprocess_cfg", {}), **open_clip.get_pretrained_cfg(name, pretrained)}
+    image_size = config["vision_cfg"]["image_size"]
+    return open_clip.image_transform(image_size, is_train=False, mean=cfg.get("mean"), std=cfg.get("std"),
+                                     resize_mode=cfg.get("resize_mode"), interpolation=cfg.get("interpolation"))
+
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "32")) # images per forward pass
+CLIP_BATCH_WAIT = float(os.getenv("CLIP_BATCH_WAIT", "0.005")) # seconds to wait for more images after the first one
+
+# {model id: (model, preprocess, tokenizer)}, more than one while stored vectors are re-embedded
+models = {}
 device = "cuda" if torch.cuda.is_available() else "cpu"
 model_lock = threading.Lock()
 
-def getModel():
-    global model, preprocess, tokenizer
-    if model is None:
+def getModel(model_id: str = MODEL_ID):
+    if model_id not in models:
         with model_lock:
-            if model is None:
-                print("Loading model : ", device)
-                model, _, preprocess = open_clip.create_model_and_transforms('ViT-B-32', pretrained='laion2b_s34b_b79k')
-                model.eval().to(device)  # model in train mode by default, impacts some models with BatchNorm or stochastic depth active
-                tokenizer = open_clip.get_tokenizer('ViT-B-32')
-    return model, preprocess, tokenizer
+            if model_id not in models:
+                print("Loading model : ", model_id, device)
+                # the backend of the id, vectors of a previous backend are embedded by it while they are migrated
+                name, pretrained, backend, quantization = parse_model_id(model_id)
+                tokenizer = open_clip.get_tokenizer(name)
+                if backend == "onnx":
+                    # the pretrained weights are only loaded to export the model the first time
+                    preprocess = eval_transform(name, pretrained)
+                    model = clip_onnx.load(f"{name}/{pretrained}", lambda: open_clip.create_model(name, pretrained=pretrained), tokenizer,
+                                           IMAGE_SIZE, quantization)
+                else:
+                    model, _, preprocess = open_clip.create_model_and_transforms(name, pretrained=pretrained)
+                    model.eval().to(device)  # model in train mode by default, impacts some models with BatchNorm or stochastic depth active
+                models[model_id] = (model, preprocess, tokenizer)
+    return models[model_id]
+
 
+def encode_images(images: torch.Tensor, model_id: str = MODEL_ID) -> np.ndarray:
+    '''embed a batch of preprocessed images'''
+    model, _, _ = getModel(model_id)
+    with torch.inference_mode():
+        return to_np(model.encode_image(images.to(device)))
 
-def get_image_embed(image):
-    model, preprocess, _ = getModel()
-    image_proc = preprocess(image).unsqueeze(0).to(device)
-    image_features = model.encode_image(image_proc)
+class ImageEmbedder:
+    '''
+    Micro-batches the images embedded by all threads.
+    Images are preprocessed by the submitting thread, a background thread stacks up to `max_batch` of them
+    (waiting at most `max_wait` seconds after the first one) and runs one forward pass per batch.
+    '''
+    def __init__(self, max_batch: int = CLIP_BATCH_SIZE, max_wait: float = CLIP_BATCH_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: List[Tuple[str, torch.Tensor, Future]] = []
+        self.condition = threading.Condition()
+        self.thread = None
 
-    return to_np(image_features[0]).tolist()
+    def submit(self, image, model_id: str = MODEL_ID) -> Future:
+        '''return a Future resolved with the embedding of `image`'''
+        _, preprocess, _ = getModel(model_id)
+        return self.submit_tensor(preprocess(image), model_id)
 
-def get_text_embed(text):
-    model, _, tokenizer = getModel()
+    def submit_tensor(self, tensor: torch.Tensor, model_id: str = MODEL_ID) -> Future:
+        '''`submit` an image preprocessed for the model, e.g. by `preprocess_pool`'''
+        future = Future()
+        with self.condition:
+            self.queue.append((model_id, tensor, future))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return future
+
+    def _take(self) -> List[Tuple[str, torch.Tensor, Future]]:
+        '''wait for the next batch, the images of one model in submission order'''
+        with self.condition:
+            while len(self.queue) == 0:
+                self.condition.wait()
+
+            deadline = time.monotonic() + self.max_wait
+            while len(self.queue) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.condition.wait(timeout)
+
+            model_id = self.queue[0][0]
+            batch, rest = [], []
+            for item in self.queue:
+                (batch if item[0] == model_id and len(batch) < self.max_batch else rest).append(item)
+            self.queue = rest
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            try:
+                vectors = encode_images(torch.stack([tensor for _, tensor, _ in batch]), batch[0][0])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, _, future), vector in zip(batch, vectors):
+                future.set_result(vector.tolist())
+
+image_embedder = ImageEmbedder()
+
+def get_image_embed(image, model_id: str = MODEL_ID):
+    '''embed one image, batched with the images of other threads'''
+    return image_embedder.submit(image, model_id).result()
+
+def get_text_embed(text, model_id: str = MODEL_ID):
+    model, _, tokenizer = getModel(model_id)
     
     text_tok = tokenizer([text]).to(device)
-    text_features = model.encode_text(text_tok)
+    with torch.inference_mode():
+        text_features = model.encode_text(text_tok)
 
     return to_np(text_features[0]).tolist()
+
+def open_reduced(data: bytes, size: int = IMAGE_SIZE) -> Image.Image:
+    '''
+    decode an image no larger than needed by the model,
+    JPEG is decoded at a reduced scale by the decoder (draft mode) instead of resized after a full decode
+    raise OSError if the data is not an image or is truncated
+    '''
+    image = Image.open(BytesIO(data))
+    # the smallest scale keeping both sides, so the short side, at least `size`
+    image.draft("RGB", (size, size))
+    image = image.convert("RGB")
+    # preprocess resizes the short side to `size` then crops the center, the long side is kept whatever the aspect ratio
+    scale = size / min(image.size)
+    if scale < 1:
+        image = image.resize((max(size, round(image.width * scale)), max(size, round(image.height * scale))),
+                             Image.Resampling.BICUBIC)
+    return image
@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import torch
+
+CLIP_ONNX_DIR = os.getenv("CLIP_ONNX_DIR", "onnx_models") # exported towers, one directory per model
+CLIP_ONNX_QUANTIZE = os.getenv("CLIP_ONNX_QUANTIZE", "int8").lower() # "int8" for dynamic quantization, "none" for float32
+CLIP_ONNX_THREADS = int(os.getenv("CLIP_ONNX_THREADS", "0")) # intra-op threads of a session, 0 for one per core
+ONNX_OPSET = 17
+
+def onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("CLIP_BACKEND=onnx requires the onnxruntime and onnx packages") from e
+    return onnxruntime
+
+class ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.encode_image(images)
+
+class TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+def model_dir(model_id: str) -> Path:
+    return Path(CLIP_ONNX_DIR) / model_id.replace("/", "--")
+
+def export(model, tokenizer, image_size: int, directory: Path) -> Tuple[Path, Path]:
+    '''export the image and text towers of an open_clip model with a dynamic batch axis'''
+    directory.mkdir(parents=True, exist_ok=True)
+    image_path, text_path = directory / "image.onnx", directory / "text.onnx"
+    model = model.eval()
+    device = next(model.parameters()).device
+    with torch.no_grad():
+        torch.onnx.export(ImageTower(model), torch.zeros(1, 3, image_size, image_size, device=device), image_path.as_posix(),
+                          input_names=["images"], output_names=["features"], opset_version=ONNX_OPSET,
+                          dynamic_axes={"images": {0: "batch"}, "features": {0: "batch"}})
+        torch.onnx.export(TextTower(model), tokenizer(["a photo"]).to(device), text_path.as_posix(),
+                          input_names=["tokens"], output_names=["features"], opset_version=ONNX_OPSET,
+                          dynamic_axes={"tokens": {0: "batch"}, "features": {0: "batch"}})
+    return image_path, text_path
+
+def quantize(path: Path) -> Path:
+    '''dynamic int8 quantization of the weights, activations are quantized at run time'''
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized = path.with_suffix(".int8.onnx")
+    if not quantized.exists():
+        quantize_dynamic(path.as_posix(), quantized.as_posix(), weight_type=QuantType.QInt8)
+    return quantized
+
+def session(path: Path, threads: int = CLIP_ONNX_THREADS):
+    ort = onnxruntime()
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = threads
+    return ort.InferenceSession(path.as_posix(), options, providers=["CPUExecutionProvider"])
+
+class OnnxClip:
+    '''
+    The image and text towers of a CLIP model run by ONNX Runtime on CPU.
+    `encode_image` and `encode_text` take and return torch tensors like the open_clip model they replace.
+    '''
+    def __init__(self, image_path: Path, text_path: Path, threads: int = CLIP_ONNX_THREADS):
+        self.image_session = session(image_path, threads)
+        self.text_session = session(text_path, threads)
+
+    def encode_image(self, images: torch.Tensor) -> torch.Tensor:
+        features = self.image_session.run(None, {"images": images.cpu().numpy().astype(np.float32)})[0]
+        return torch.from_numpy(features)
+
+    def encode_text(self, tokens: torch.Tensor) -> torch.Tensor:
+        features = self.text_session.run(None, {"tokens": tokens.cpu().numpy().astype(np.int64)})[0]
+        return torch.from_numpy(features)
+
+def load(model_id: str, create_model, tokenizer, image_size: int,
+         quantization: str = CLIP_ONNX_QUANTIZE, threads: int = CLIP_ONNX_THREADS) -> OnnxClip:
+    '''
+    load the towers exported to `CLIP_ONNX_DIR`, `create_model()` is only called to export them the first time
+    raise ImportError if onnxruntime is not installed
+    '''
+    onnxruntime()
+    directory = model_dir(model_id)
+    image_path, text_path = directory / "image.onnx", directory / "text.onnx"
+    if not image_path.exists() or not text_path.exists():
+        print("Exporting model to ONNX : ", model_id)
+        image_path, text_path = export(create_model(), tokenizer, image_size, directory)
+
+    if quantization == "int8":
+        image_path, text_path = quantize(image_path), quantize(text_path)
+    elif quantization != "none":
+        raise ValueError(f"Unknown CLIP_ONNX_QUANTIZE: {quantization}, expected int8 or none")
+    return OnnxClip(image_path, text_path, threads)
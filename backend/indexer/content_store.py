@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from indexer.schema import FIELD_IMAGE_DENSE, FIELD_TEXT_DENSE
+# files are hashed by the preprocess workers too
+from preprocess_worker import content_hash
+
+CONTENT_STORE_PATH = os.getenv("CONTENT_STORE_PATH", "content_store.db") # sqlite file, ":memory:" to keep it per process
+
+class StoredContent:
+    '''caption and {dense field: vector} of an image file with {dense field: model id}, a vector is None if not embedded'''
+    def __init__(self, text: str, vectors: Dict[str, Optional[np.ndarray]], models: Dict[str, str]):
+        self.text = text
+        self.vectors = vectors
+        self.models = models
+
+def to_blob(vector) -> Optional[bytes]:
+    return np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else None
+
+def from_blob(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    return np.frombuffer(blob, dtype=np.float32) if blob is not None else None
+
+class ContentStore:
+    '''
+    Thread safe sqlite store of captions and embeddings keyed by the hash of the file bytes,
+    so a file seen before under any name or folder is indexed without captioning or embedding it again.
+    Vectors are stored with the id of their model, callers check it against the current model.
+    '''
+    def __init__(self, path: str = CONTENT_STORE_PATH):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS contents (digest TEXT PRIMARY KEY, text TEXT, "
+            "text_model TEXT, text_dense BLOB, image_model TEXT, image_dense BLOB)"
+        )
+        self.conn.commit()
+
+    def get(self, digest: str) -> Optional[StoredContent]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT text, text_model, text_dense, image_model, image_dense FROM contents WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        text, text_model, text_dense, image_model, image_dense = row
+        return StoredContent(text, {FIELD_TEXT_DENSE: from_blob(text_dense), FIELD_IMAGE_DENSE: from_blob(image_dense)},
+                             {FIELD_TEXT_DENSE: text_model, FIELD_IMAGE_DENSE: image_model})
+
+    def put(self, digest: str, content: StoredContent):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO contents (digest, text, text_model, text_dense, image_model, image_dense) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, content.text, content.models[FIELD_TEXT_DENSE], to_blob(content.vectors[FIELD_TEXT_DENSE]),
+                 content.models[FIELD_IMAGE_DENSE], to_blob(content.vectors[FIELD_IMAGE_DENSE]))
+            )
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            size = self.conn.execute("SELECT COUNT(*) FROM contents").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "size": size,
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+content_store = ContentStore()
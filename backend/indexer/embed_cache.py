@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from indexer.search_cache import normalize_text
+
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "4096"))
+QUERY_EMBED_CACHE_PATH = os.getenv("QUERY_EMBED_CACHE_PATH", "") # sqlite file to keep embeddings across restarts, empty to disable
+
+class EmbeddingMemo:
+    '''
+    Thread safe memo of query embeddings keyed by (model id, normalized text).
+    Bounded LRU in memory, optionally backed by a sqlite file.
+    '''
+    def __init__(self, max_size: int = QUERY_EMBED_CACHE_SIZE, path: str = QUERY_EMBED_CACHE_PATH):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn: Optional[sqlite3.Connection] = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, text TEXT, vector BLOB, PRIMARY KEY (model, text))"
+            )
+            self.conn.commit()
+
+    def _load(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        if self.conn is None:
+            return None
+        row = self.conn.execute("SELECT vector FROM embeddings WHERE model = ? AND text = ?", key).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32).tolist() if row is not None else None
+
+    def _store(self, key: Tuple[str, str], vector: List[float]):
+        if self.conn is None:
+            return
+        self.conn.execute("INSERT OR REPLACE INTO embeddings (model, text, vector) VALUES (?, ?, ?)",
+                          (*key, np.asarray(vector, dtype=np.float32).tobytes()))
+        self.conn.commit()
+
+    def _put(self, key: Tuple[str, str], vector: List[float]):
+        self.items[key] = vector
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def get(self, model_id: str, text: str, embed: Callable[[str], List[float]]) -> List[float]:
+        '''return the embedding of `text`, call `embed` on the normalized text if not cached'''
+        text = normalize_text(text)
+        key = (model_id, text)
+
+        with self.lock:
+            vector = self.items.get(key)
+            if vector is None:
+                vector = self._load(key)
+                if vector is not None:
+                    self._put(key, vector)
+            else:
+                self.items.move_to_end(key)
+
+            if vector is not None:
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        # encode outside the lock, concurrent misses of the same text may encode twice
+        vector = embed(text)
+        if isinstance(vector, np.ndarray):
+            vector = vector.tolist()
+
+        with self.lock:
+            self._put(key, vector)
+            self._store(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "size": len(self.items),
+                "max_size": self.max_size,
+                "persistent": self.conn is not None,
+            }
+
+query_embed_memo = EmbeddingMemo()
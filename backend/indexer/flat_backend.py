@@ -0,0 +1,550 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from indexer.backend import SearchRequest, VectorBackend
+from indexer.schema import *
+
+VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", "vectors.db")
+
+RRF_K = 60
+
+ENGLISH_STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with",
+}
+
+VOWELS = set("aeiouy")
+
+def stem_english(token: str) -> str:
+    '''the plural, -ed, -ing and final y rules of the snowball english stemmer, a stand-in of the Milvus stemmer filter'''
+    if token.endswith("sses"):
+        token = token[:-2]
+    elif token.endswith("ies") and len(token) > 4:
+        token = token[:-2]
+    elif token.endswith("s") and not token.endswith(("ss", "us")) and len(token) > 3 and VOWELS & set(token[:-2]):
+        token = token[:-1]
+
+    for suffix in ("ingly", "edly", "ing", "ed"):
+        if token.endswith(suffix) and VOWELS & set(token[:-len(suffix)]):
+            token = token[:-len(suffix)]
+            if len(token) > 2 and token[-1] == token[-2] and token[-1] in "bdfgmnprt":
+                token = token[:-1]
+            break
+
+    if len(token) > 2 and token.endswith("y") and token[-2] not in VOWELS:
+        token = token[:-1] + "i"
+    return token
+
+def tokenize_english(text: str) -> List[str]:
+    return [stem_english(token) for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in ENGLISH_STOP_WORDS]
+
+def tokenize_chinese(text: str) -> List[str]:
+    '''alphanumeric words plus CJK unigrams and bigrams, a dictionary free stand-in of jieba'''
+    tokens = tokenize_english(text)
+    for run in re.findall(r"[一-鿿]+", text):
+        tokens += list(run)
+        tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+    return tokens
+
+# {BM25 sparse field: tokenizer of its raw text field}
+TOKENIZERS: Dict[str, Callable[[str], List[str]]] = {
+    FIELD_TEXT_SPARSE: tokenize_english,
+    FIELD_CN_TEXT_SPARSE: tokenize_chinese,
+}
+
+class BM25Index:
+    '''BM25 over the rows of a `CollectionIndex`, documents are set and removed by row index'''
+    def __init__(self, docs: List[List[str]] = [], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[int, Counter] = {} # {row index: term frequencies}
+        self.lengths: Dict[int, int] = {} # {row index: number of tokens}
+        self.total_len = 0
+        # {token: {row index: term frequency}}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # {token: (row indices, term frequencies, document lengths)} of the postings, dropped when they change
+        self.arrays: Dict[str, tuple] = {}
+        for idx, doc in enumerate(docs):
+            self.set(idx, doc)
+
+    def set(self, idx: int, doc: List[str]):
+        self.remove(idx)
+        terms = Counter(doc)
+        self.terms[idx] = terms
+        self.lengths[idx] = len(doc)
+        self.total_len += len(doc)
+        for token, tf in terms.items():
+            self.postings.setdefault(token, {})[idx] = tf
+            self.arrays.pop(token, None)
+
+    def remove(self, idx: int):
+        terms = self.terms.pop(idx, None)
+        if terms is None:
+            return
+        self.total_len -= self.lengths.pop(idx)
+        for token in terms:
+            docs = self.postings[token]
+            del docs[idx]
+            if len(docs) == 0:
+                del self.postings[token]
+            self.arrays.pop(token, None)
+
+    def _arrays(self, token: str) -> tuple:
+        if token not in self.arrays:
+            docs = self.postings[token]
+            self.arrays[token] = (
+                np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)),
+                np.fromiter(docs.values(), dtype=np.float32, count=len(docs)),
+                np.array([self.lengths[idx] for idx in docs], dtype=np.float32),
+            )
+        return self.arrays[token]
+
+    def score(self, query: List[str], size: int) -> np.ndarray:
+        '''scores of the row indices below `size`'''
+        scores = np.zeros(size, dtype=np.float32)
+        n_docs = len(self.terms)
+        if self.total_len == 0:
+            return scores
+        avg_len = self.total_len / n_docs
+
+        for token in set(query):
+            if token not in self.postings:
+                continue
+            docs, tf, doc_len = self._arrays(token)
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_len / avg_len)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+# string literals are matched first so quoted "and", "True" or operators are kept as values
+FILTER_TOKEN = re.compile(r"""\s*(?:(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|(?P<op>==|!=|>=|<=|>|<|\[|\]|,)|(?P<word>[\w.+-]+))""")
+FILTER_OPS = {"==", "!=", ">=", "<=", ">", "<", "in"}
+
+COMPARISONS = {
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+}
+
+def tokenize_filter(expr: str) -> List[tuple]:
+    '''split a filter into (kind, text) tokens, kind is "string", "op" or "word"'''
+    tokens = []
+    expr = expr.rstrip()
+    pos = 0
+    while pos < len(expr):
+        matched = FILTER_TOKEN.match(expr, pos)
+        if matched is None:
+            raise ValueError(f"Unsupported filter: {expr}")
+        tokens.append((matched.lastgroup, matched.group(matched.lastgroup)))
+        pos = matched.end()
+    return tokens
+
+def parse_value(kind: str, text: str):
+    if kind == "string":
+        if text.startswith("'"):
+            # a JSON string of the single quoted literal
+            text = '"' + re.sub(r"\\'|\"", lambda m: "'" if m.group() == "\\'" else '\\"', text[1:-1]) + '"'
+        return json.loads(text)
+    if kind == "word" and text in ("true", "True", "false", "False"):
+        return text.lower() == "true"
+    if kind == "word":
+        return json.loads(text) # numbers
+    raise ValueError(f"Unsupported value: {text}")
+
+def compile_filter(expr: str) -> Optional[Callable[[dict], bool]]:
+    '''
+    support the subset of Milvus boolean expressions used by vector_db:
+    terms of `field == value`, `field != value`, comparisons, `field in [values]` joined by `and`
+    '''
+    if expr is None or expr.strip() == "":
+        return None
+
+    tokens = tokenize_filter(expr)
+    pos = 0
+
+    def take() -> tuple:
+        nonlocal pos
+        if pos >= len(tokens):
+            raise ValueError(f"Unsupported filter: {expr}")
+        pos += 1
+        return tokens[pos - 1]
+
+    terms = []
+    while True:
+        (kind, field), (_, op) = take(), take()
+        if kind != "word" or op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter: {expr}")
+        if op == "in":
+            if take() != ("op", "["):
+                raise ValueError(f"Unsupported filter: {expr}")
+            value = set()
+            while tokens[pos:pos + 1] != [("op", "]")]:
+                value.add(parse_value(*take()))
+                if tokens[pos:pos + 1] == [("op", ",")]:
+                    pos += 1
+            take()
+        else:
+            value = parse_value(*take())
+        terms.append((field, op, value))
+
+        if pos == len(tokens):
+            break
+        if take() != ("word", "and"):
+            raise ValueError(f"Unsupported filter: {expr}")
+
+    def match(row: dict) -> bool:
+        for field, op, value in terms:
+            actual = row.get(field)
+            if op == "==" and actual != value:
+                return False
+            if op == "!=" and actual == value:
+                return False
+            if op == "in" and actual not in value:
+                return False
+            if op in COMPARISONS and (actual is None or not COMPARISONS[op](actual, value)):
+                return False
+        return True
+    return match
+
+class CollectionIndex:
+    '''
+    in-memory copy of a collection used for brute force search, updated in place by the writes.
+    Arrays grow by doubling, deleted rows leave empty slots until the backend compacts the index.
+    '''
+    def __init__(self, rows: List[dict]):
+        self.size = 0 # used slots, deleted ones included
+        self.slots: Dict[int, int] = {} # {id: row index}
+        self.rows: List[Optional[dict]] = []
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.partitions = np.zeros(0, dtype=object)
+        self.live = np.zeros(0, dtype=bool)
+        self.dense = {field: np.zeros((0, dim), dtype=np.float32) for field, dim in DENSE_FIELDS.items()}
+        self.bm25 = {field: BM25Index() for field in TOKENIZERS}
+        self.upsert(rows)
+
+    def _reserve(self, size: int):
+        capacity = len(self.ids)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 64)
+
+        def grow(array: np.ndarray) -> np.ndarray:
+            grown = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self.ids = grow(self.ids)
+        self.partitions = grow(self.partitions)
+        self.live = grow(self.live)
+        self.dense = {field: grow(array) for field, array in self.dense.items()}
+        self.rows += [None] * (capacity - len(self.rows))
+
+    def upsert(self, rows: List[dict]):
+        '''rows decoded like `FlatBackend._decode`, existing ids are replaced in their slot'''
+        self._reserve(self.size + sum(row[FIELD_ID] not in self.slots for row in rows))
+        for row in rows:
+            idx = self.slots.get(row[FIELD_ID])
+            if idx is None:
+                idx = self.size
+                self.size += 1
+                self.slots[row[FIELD_ID]] = idx
+            self.rows[idx] = row
+            self.ids[idx] = row[FIELD_ID]
+            self.partitions[idx] = row[FIELD_PARTITION]
+            self.live[idx] = True
+            for field, array in self.dense.items():
+                array[idx] = row[field]
+            for field, bm25 in self.bm25.items():
+                bm25.set(idx, TOKENIZERS[field](row.get(SPARSE_FIELDS[field], "")))
+
+    def delete(self, ids: List[int]):
+        for id in ids:
+            idx = self.slots.pop(id, None)
+            if idx is None:
+                continue
+            self.rows[idx] = None
+            self.live[idx] = False
+            for bm25 in self.bm25.values():
+                bm25.remove(idx)
+
+    def partition_ids(self, partition: str) -> List[int]:
+        return self.ids[self.live & (self.partitions == partition)].tolist()
+
+    def live_rows(self) -> List[dict]:
+        return [row for row in self.rows if row is not None]
+
+    def empty_slots(self) -> int:
+        return self.size - len(self.slots)
+
+    def mask(self, partitions: Optional[List[str]], filter: str) -> np.ndarray:
+        mask = self.live.copy()
+        if partitions is not None:
+            mask &= np.isin(self.partitions, partitions)
+        match = compile_filter(filter)
+        if match is not None:
+            mask &= np.array([row is not None and match(row) for row in self.rows], dtype=bool)
+        return mask
+
+    def scores(self, request: SearchRequest) -> np.ndarray:
+        return self.dense[request.anns_field] @ np.asarray(request.data, dtype=np.float32)
+
+    def search(self, request: SearchRequest, mask: np.ndarray) -> np.ndarray:
+        '''return row indices of the best `request.limit` hits'''
+        if request.anns_field in self.dense:
+            scores = self.scores(request)
+        elif request.anns_field in self.bm25:
+            scores = self.bm25[request.anns_field].score(TOKENIZERS[request.anns_field](request.data), len(self.ids))
+            mask = mask & (scores > 0) # like Milvus, documents without query terms are not returned
+        else:
+            raise ValueError(f"Unknown search field: {request.anns_field}")
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > request.limit:
+            top = np.argpartition(-scores[candidates], request.limit - 1)[:request.limit]
+            candidates = candidates[top]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+class FlatBackend(VectorBackend):
+    '''
+    Embedded backend for single node and offline use, no server required.
+    Rows are persisted in a SQLite file, search is brute force over an in-memory copy
+    of the collection with numpy for dense fields and a local BM25 for sparse fields.
+    Suitable for collections up to a few hundred thousand rows.
+    Vectors are always kept as float32, `VECTOR_DTYPE` only applies to Milvus.
+    '''
+    def __init__(self, path: str = VECTOR_DB_PATH):
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS partitions (collection TEXT, name TEXT, PRIMARY KEY (collection, name))")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (collection TEXT, id INTEGER, partition TEXT, fields TEXT, dense BLOB, "
+            "PRIMARY KEY (collection, id))"
+        )
+        self.conn.commit()
+
+        # {collection: CollectionIndex}, loaded by the first search and updated by the writes
+        self.indexes: Dict[str, CollectionIndex] = {}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _encode(self, row: dict):
+        fields = {k: v for k, v in row.items() if k not in DENSE_FIELDS and k not in (FIELD_ID, FIELD_PARTITION)}
+        dense = np.concatenate([np.asarray(row[field], dtype=np.float32).reshape(dim) for field, dim in DENSE_FIELDS.items()])
+        return json.dumps(fields), dense.tobytes()
+
+    def _decode(self, id: int, partition: str, fields: str, dense: bytes) -> dict:
+        row = json.loads(fields)
+        row[FIELD_ID] = id
+        row[FIELD_PARTITION] = partition
+        vectors = np.frombuffer(dense, dtype=np.float32)
+        offset = 0
+        for field, dim in DENSE_FIELDS.items():
+            row[field] = vectors[offset:offset + dim]
+            offset += dim
+        for field, flag in PRESENCE_FIELDS.items():
+            # rows written before the presence flags
+            row.setdefault(flag, bool(np.any(row[field])))
+        for field, model_field in MODEL_FIELDS.items():
+            # rows written before the model fields
+            row.setdefault(model_field, LEGACY_MODELS[field] if row[PRESENCE_FIELDS[field]] else "")
+        return row
+
+    def _output(self, row: dict, output_fields: List[str]) -> dict:
+        result = {FIELD_ID: row[FIELD_ID]}
+        for field in output_fields:
+            if field in row:
+                value = row[field]
+                result[field] = value.tolist() if isinstance(value, np.ndarray) else value
+        return result
+
+    def _check_collection(self, collection: str):
+        if not self.has_collection(collection):
+            raise ValueError(f"Collection not found: {collection}")
+
+    def _changed(self, collection: str):
+        self.indexes.pop(collection, None)
+
+    def _deleted(self, collection: str, ids: List[int]):
+        index = self.indexes.get(collection)
+        if index is None:
+            return
+        index.delete(ids)
+        if index.empty_slots() > len(index.slots):
+            # compact once most slots are empty
+            self.indexes[collection] = CollectionIndex(index.live_rows())
+
+    def has_collection(self, collection: str) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM collections WHERE name = ?", (collection,)).fetchone() is not None
+
+    def create_collection(self, collection: str):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM rows WHERE collection = ?", (collection,))
+            self.conn.execute("DELETE FROM partitions WHERE collection = ?", (collection,))
+            self.conn.execute("INSERT OR IGNORE INTO collections (name) VALUES (?)", (collection,))
+            self.conn.execute("INSERT INTO partitions (collection, name) VALUES (?, ?)", (collection, DEFAULT_PARTITION))
+            self._changed(collection)
+
+    def fields(self, collection: str) -> List[str]:
+        # rows are schemaless, missing flags and models are filled by _decode
+        self._check_collection(collection)
+        return list(STORED_FIELDS)
+
+    def analyzers_current(self, collection: str) -> bool:
+        # the raw text is tokenized when the collection is loaded
+        self._check_collection(collection)
+        return True
+
+    def drop_collection(self, collection: str):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM rows WHERE collection = ?", (collection,))
+            self.conn.execute("DELETE FROM partitions WHERE collection = ?", (collection,))
+            self.conn.execute("DELETE FROM collections WHERE name = ?", (collection,))
+            self._changed(collection)
+
+    def rename_collection(self, collection: str, new_name: str):
+        with self.lock, self.conn:
+            self._check_collection(collection)
+            if self.has_collection(new_name):
+                raise ValueError(f"Collection already exists: {new_name}")
+            self.conn.execute("UPDATE rows SET collection = ? WHERE collection = ?", (new_name, collection))
+            self.conn.execute("UPDATE partitions SET collection = ? WHERE collection = ?", (new_name, collection))
+            self.conn.execute("UPDATE collections SET name = ? WHERE name = ?", (new_name, collection))
+            self._changed(new_name)
+            if collection in self.indexes:
+                self.indexes[new_name] = self.indexes.pop(collection)
+
+    def list_partitions(self, collection: str) -> List[str]:
+        with self.lock:
+            self._check_collection(collection)
+            return [name for (name,) in self.conn.execute("SELECT name FROM partitions WHERE collection = ?", (collection,))]
+
+    def create_partition(self, collection: str, partition: str):
+        with self.lock, self.conn:
+            self._check_collection(collection)
+            self.conn.execute("INSERT OR IGNORE INTO partitions (collection, name) VALUES (?, ?)", (collection, partition))
+
+    def drop_partition(self, collection: str, partition: str):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM rows WHERE collection = ? AND partition = ?", (collection, partition))
+            self.conn.execute("DELETE FROM partitions WHERE collection = ? AND name = ?", (collection, partition))
+            if collection in self.indexes:
+                self._deleted(collection, self.indexes[collection].partition_ids(partition))
+
+    def upsert(self, collection: str, partition: str, rows: List[dict]):
+        with self.lock, self.conn:
+            if partition not in self.list_partitions(collection):
+                raise ValueError(f"Partition not found: {partition}")
+            encoded = [(row[FIELD_ID], partition, *self._encode(row)) for row in rows]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rows (collection, id, partition, fields, dense) VALUES (?, ?, ?, ?, ?)",
+                [(collection, *row) for row in encoded]
+            )
+            if collection in self.indexes:
+                # decoded like the rows loaded by _index
+                self.indexes[collection].upsert([self._decode(*row) for row in encoded])
+
+    def delete(self, collection: str, ids: List[int]):
+        with self.lock, self.conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                self.conn.execute(
+                    f"DELETE FROM rows WHERE collection = ? AND id IN ({','.join('?' * len(chunk))})",
+                    (collection, *chunk)
+                )
+            self._deleted(collection, ids)
+
+    def get(self, collection: str, ids: List[int], output_fields: List[str]) -> List[dict]:
+        if not isinstance(ids, list):
+            ids = [ids]
+        results = []
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                cursor = self.conn.execute(
+                    f"SELECT id, partition, fields, dense FROM rows WHERE collection = ? AND id IN ({','.join('?' * len(chunk))})",
+                    (collection, *chunk)
+                )
+                results += [self._output(self._decode(*row), output_fields) for row in cursor]
+        return results
+
+    def iterate(self, collection: str, partitions: Optional[List[str]], output_fields: List[str],
+                batch_size: int, filter: str = "") -> Iterator[List[dict]]:
+        match = compile_filter(filter)
+        last_id = None
+        while True:
+            sql = "SELECT id, partition, fields, dense FROM rows WHERE collection = ?"
+            params = [collection]
+            if last_id is not None:
+                sql += " AND id > ?"
+                params.append(last_id)
+            if partitions is not None:
+                sql += f" AND partition IN ({','.join('?' * len(partitions))})"
+                params += partitions
+            sql += " ORDER BY id LIMIT ?"
+            params.append(batch_size)
+
+            with self.lock:
+                rows = [self._decode(*row) for row in self.conn.execute(sql, params)]
+            if len(rows) == 0:
+                break
+            last_id = rows[-1][FIELD_ID]
+
+            batch = [self._output(row, output_fields) for row in rows if match is None or match(row)]
+            if len(batch) != 0:
+                yield batch
+
+    def _index(self, collection: str) -> CollectionIndex:
+        with self.lock:
+            if collection not in self.indexes:
+                rows = [self._decode(*row) for row in self.conn.execute(
+                    "SELECT id, partition, fields, dense FROM rows WHERE collection = ? ORDER BY id", (collection,))]
+                self.indexes[collection] = CollectionIndex(rows)
+            return self.indexes[collection]
+
+    def search(self, collection: str, partitions: Optional[List[str]], anns_field: str, vectors: List[list],
+               limit: int, param: dict, filter: str = "", output_fields: Optional[List[str]] = None) -> List[List[dict]]:
+        self._check_collection(collection)
+        # the index is updated in place by the writes
+        with self.lock:
+            index = self._index(collection)
+            mask = index.mask(partitions, filter)
+
+            results = []
+            for vector in vectors:
+                request = SearchRequest(anns_field, vector, limit, param, filter)
+                scores = index.scores(request)
+                results.append([{**self._output(index.rows[idx], output_fields or []), "distance": float(scores[idx])}
+                                for idx in index.search(request, mask)])
+        return results
+
+    def hybrid_search(self, collection: str, partitions: Optional[List[str]],
+                      requests: List[SearchRequest], limit: int) -> List[dict]:
+        self._check_collection(collection)
+
+        # reciprocal rank fusion, same as RRFRanker(60)
+        scores: Dict[int, float] = {}
+        with self.lock:
+            index = self._index(collection)
+            for request in requests:
+                hits = index.search(request, index.mask(partitions, request.filter))
+                for rank, idx in enumerate(hits, start=1):
+                    id = int(index.ids[idx])
+                    scores[id] = scores.get(id, 0.0) + 1.0 / (RRF_K + rank)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{FIELD_ID: id, "distance": score} for id, score in ranked]
@@ -1,12 +1,12 @@
 from io import BytesIO
-import json
 import os
 import pathlib
 from google import genai
-import threading
-import time
 import re
+from typing import Optional
 from dotenv import load_dotenv
+from indexer.caption_cache import caption_cache
+from indexer.limiter import RateLimiter
 
 load_dotenv()
 genai_api_key = os.getenv("GENAI_API_KEY")
@@ -15,24 +15,34 @@ if genai_api_key is None:
     raise Exception("GENAI_API_KEY is not set, please set it in .env file or environment variable")
 
 
+GENAI_MODEL = os.getenv("GENAI_MODEL", "gemini-2.0-flash")
+GENAI_BASE_URL = os.getenv("GENAI_BASE_URL", "") # e.g. a local fake of the API for tests, empty for Google
+GENAI_RPM = float(os.getenv("GENAI_RPM", "15")) # requests per minute, <= 0 for no limit
+GENAI_TPM = float(os.getenv("GENAI_TPM", "1000000")) # tokens per minute, <= 0 for no limit
+GENAI_CONCURRENCY = int(os.getenv("GENAI_CONCURRENCY", "4")) # caption requests in flight
+# reserved for a request until its response reports the tokens used: an image, the prompt and the caption
+GENAI_REQUEST_TOKENS = int(os.getenv("GENAI_REQUEST_TOKENS", "1500"))
+
 prompt_string = "Caption this image."
-CACHE_TEXT = {}
 
-last_explanation_time = 0
-COOLDOWN_PERIOD = 10  # seconds
-explain_image_lock = threading.Lock()
+# shared by the watcher, folder scans and caption regeneration, requests are served in arrival order
+rate_limiter = RateLimiter(GENAI_RPM, GENAI_TPM, GENAI_CONCURRENCY)
+
+def get_client() -> genai.Client:
+    http_options = {"base_url": GENAI_BASE_URL} if GENAI_BASE_URL else None
+    return genai.Client(api_key=genai_api_key, http_options=http_options)
 
 def init():
-    '''load cache text and prompt string'''
-    global CACHE_TEXT, prompt_string
+    '''import the captions of data.json into the caption cache once, load prompt string'''
+    global prompt_string
     file_root = pathlib.Path(__file__).parent.resolve()
 
     try:
-        with open(file_root / "data.json", "r") as f:
-            CACHE_TEXT = json.load(f)
+        imported = caption_cache.import_json(file_root / "data.json")
+        if imported != 0:
+            print(f"Imported {imported} captions from data.json")
     except Exception as e:
         print("Error", e)
-        CACHE_TEXT = {}
 
     try:
         with open(file_root / "genai_prompt.txt", "r", encoding="utf-8") as f:
@@ -40,18 +50,7 @@ def init():
     except Exception as e:
         print(e)
         prompt_string = "Caption this image."
-    
-def store_cache():
-    global CACHE_TEXT
-    file_root = pathlib.Path(__file__).parent.resolve()
-
-    try:
-        with open(file_root / "data.json", "w") as f:
-            json.dump(CACHE_TEXT, f, indent=4)  # optional: indent for readability
-    except:
-        pass
 
-    
 def sanitize_string(s):
     s = s.lower()
     s = re.sub(r'[^a-z0-9\-]', '-', s)[-40:] # limit to 40 char
@@ -59,33 +58,36 @@ def sanitize_string(s):
         s = s.replace("-", "a", 1)
     return s
 
-def explainImage(id:str, image_format, image_data: BytesIO, use_cache: bool = True):
-    global last_explanation_time, explain_image_lock, prompt_string, COOLDOWN_PERIOD, CACHE_TEXT
+def explainImage(id:str, image_format, image_data: BytesIO, use_cache: bool = True, filename: Optional[str] = None):
+    '''
+    caption an image, `id` is the key of the caption cache and the name of the uploaded file, the hash of the file for the indexer.
+    On a miss the caption cached under `filename` by the data.json import or older versions is used and cached under `id`.
+    '''
+    global prompt_string
+
+    if use_cache:
+        text = caption_cache.get(id)
+        if text is None and filename is not None:
+            text = caption_cache.get(filename)
+            if text is not None:
+                caption_cache.put(id, text)
+        if text is not None:
+            return text
 
-    if use_cache and (id in CACHE_TEXT):
-        return CACHE_TEXT[id]
-        
-    client = genai.Client(api_key=genai_api_key)
+    client = get_client()
 
     file_id = sanitize_string(id)
 
     try:
-        print(f"[GET file] {file_id}")
-        my_file = client.files.get(name=file_id)
-    except Exception as e:
-        print("Load error: ", e)
-        my_file = None
-    
-    with explain_image_lock:
-        current_time = time.time()
-        time_since_last_call = current_time - last_explanation_time
-        
-        if time_since_last_call < COOLDOWN_PERIOD:
-            sleep_duration = COOLDOWN_PERIOD - time_since_last_call
-            print(f"Cooldown active. Thread will sleep for {sleep_duration:.1f} seconds.")
-            time.sleep(sleep_duration)
-        
-        try:
+        # the lookup of an uploaded file counts against the request limits too
+        with rate_limiter.request(GENAI_REQUEST_TOKENS) as usage:
+            try:
+                print(f"[GET file] {file_id}")
+                my_file = client.files.get(name=file_id)
+            except Exception as e:
+                print("Load error: ", e)
+                my_file = None
+
             if my_file is None:
                 # Ensure image_data is at the beginning if it was read before
                 image_data.seek(0)
@@ -94,32 +96,37 @@ def explainImage(id:str, image_format, image_data: BytesIO, use_cache: bool = Tr
                     "name": file_id
                 })
 
-
             response = client.models.generate_content(
-                model="gemini-2.0-flash", # Consider making the model name a configurable parameter
+                model=GENAI_MODEL,
                 contents=[my_file, prompt_string],
             )
-            last_explanation_time = time.time() # Update last execution time only on success
-        except Exception as e:
-            print("Gen error: ", e)
-            return "" # Or raise the exception, or return a more specific error message
+            if response.usage_metadata is not None:
+                usage["tokens"] = response.usage_metadata.total_token_count
+    except Exception as e:
+        print("Gen error: ", e)
+        return "" # Or raise the exception, or return a more specific error message
 
     response = response.text if response.text is not None else ""
 
-    if use_cache:
-        CACHE_TEXT[id] = response
-        #store_cache()
+    if use_cache and response != "":
+        caption_cache.put(id, response)
     return response
 
+def caption_cache_stats():
+    return caption_cache.stats()
+
+def rate_limiter_stats():
+    return rate_limiter.stats()
+
 
 def list_uploaded_files():
-    client = genai.Client(api_key=genai_api_key)
+    client = get_client()
     print('My files:')
     for f in client.files.list():
         print(f.name)
 
 def delete_uploaded_file(file_id: str):
-    client = genai.Client(api_key=genai_api_key)
+    client = get_client()
     try:
         file_id = sanitize_string(file_id)
         my_file = client.files.get(name=file_id)
@@ -129,7 +136,7 @@ def delete_uploaded_file(file_id: str):
     return True
 
 def delete_uploaded_files():
-    client = genai.Client(api_key=genai_api_key)
+    client = get_client()
     for f in client.files.list():
         client.files.delete(name=f.name)
 
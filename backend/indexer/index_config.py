@@ -0,0 +1,87 @@
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict
+
+from indexer.schema import *
+
+# JSON, or a path to a JSON file, of {dense field: {"index_type": ..., build and search params}}, e.g.
+# {"image_dense": {"index_type": "HNSW", "M": 16, "efConstruction": 200, "ef": 64}}
+VECTOR_INDEX_CONFIG = os.getenv("VECTOR_INDEX_CONFIG", "")
+
+# {index type: {build param: default}}
+BUILD_PARAMS = {
+    "AUTOINDEX": {},
+    "FLAT": {},
+    "HNSW": {"M": 16, "efConstruction": 200},
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_SQ8": {"nlist": 1024},
+    "IVF_PQ": {"nlist": 1024, "m": 16, "nbits": 8},
+    "DISKANN": {},
+}
+
+# {index type: {search param: default}}
+SEARCH_PARAMS = {
+    "AUTOINDEX": {},
+    "FLAT": {},
+    "HNSW": {"ef": 64},
+    "IVF_FLAT": {"nprobe": 16},
+    "IVF_SQ8": {"nprobe": 16},
+    "IVF_PQ": {"nprobe": 16},
+    "DISKANN": {"search_list": 64},
+}
+
+# search params that must not be smaller than the number of results
+LIMIT_BOUND_PARAMS = {"ef", "search_list"}
+
+@dataclass
+class IndexConfig:
+    '''index of one dense field'''
+    index_type: str = "AUTOINDEX"
+    metric_type: str = "IP"
+    build: dict = field(default_factory=dict)
+    search: dict = field(default_factory=dict)
+
+    @staticmethod
+    def parse(config: dict) -> "IndexConfig":
+        '''{"index_type": ..., "metric_type": ..., params...}, params not given use the defaults'''
+        config = dict(config)
+        index_type = config.pop("index_type", "AUTOINDEX").upper()
+        metric_type = config.pop("metric_type", "IP")
+        if index_type not in BUILD_PARAMS:
+            raise ValueError(f"Unknown index type: {index_type}")
+
+        build = dict(BUILD_PARAMS[index_type])
+        search = dict(SEARCH_PARAMS[index_type])
+        for key, value in config.items():
+            if key in build:
+                build[key] = value
+            elif key in search:
+                search[key] = value
+            else:
+                raise ValueError(f"Unknown parameter of {index_type}: {key}")
+        return IndexConfig(index_type, metric_type, build, search)
+
+    def search_params(self, limit: int) -> dict:
+        params = dict(self.search)
+        for key in LIMIT_BOUND_PARAMS & params.keys():
+            params[key] = max(params[key], limit)
+        return params
+
+def load_index_configs(config: str = VECTOR_INDEX_CONFIG) -> Dict[str, IndexConfig]:
+    '''return {dense field: IndexConfig}, fields not configured use AUTOINDEX'''
+    if config and not config.lstrip().startswith("{"):
+        with open(config, encoding="utf-8") as f:
+            config = f.read()
+    fields = json.loads(config) if config else {}
+
+    unknown = fields.keys() - DENSE_FIELDS.keys()
+    if unknown:
+        raise ValueError(f"Unknown dense fields: {sorted(unknown)}")
+    return {name: IndexConfig.parse(fields.get(name, {})) for name in DENSE_FIELDS}
+
+index_configs = load_index_configs()
+
+def search_params(anns_field: str, limit: int) -> dict:
+    '''search params of the configured index of `anns_field`'''
+    return index_configs[anns_field].search_params(limit)
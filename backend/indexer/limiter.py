@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+class LoopSemaphore:
+    '''
+    asyncio.Semaphore of each event loop.
+    asyncio primitives are bound to one loop, the test client runs each request in a new loop.
+    '''
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            semaphore = self.semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.limit)
+                self.semaphores[loop] = semaphore
+        return semaphore
+
+class RateLimiter:
+    '''
+    Thread safe limiter of requests per minute, tokens per minute and requests in flight.
+    Both rates are token buckets refilled continuously, holding up to one minute of budget.
+    Waiting callers are served in arrival order, a request needing many tokens is not passed by smaller ones.
+    A rate <= 0 is not limited.
+    raise ValueError if `max_in_flight` < 1, no request could ever start
+    '''
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_in_flight: int, clock=time.monotonic):
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}")
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        self.clock = clock
+
+        self.condition = threading.Condition()
+        self.waiters = deque()
+        self.request_budget = float(requests_per_minute)
+        self.token_budget = float(tokens_per_minute)
+        self.updated = clock()
+        self.in_flight = 0
+
+        self.granted = 0
+        self.tokens_used = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.requests_per_minute > 0:
+            self.request_budget = min(self.requests_per_minute, self.request_budget + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute > 0:
+            self.token_budget = min(self.tokens_per_minute, self.token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def _delay(self, tokens: int) -> float:
+        '''seconds until both buckets hold a request of `tokens`'''
+        delay = 0.0
+        if self.requests_per_minute > 0:
+            delay = max(delay, (1 - self.request_budget) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute > 0:
+            delay = max(delay, (tokens - self.token_budget) * 60 / self.tokens_per_minute)
+        return delay
+
+    def acquire(self, tokens: int = 0) -> float:
+        '''
+        wait for the turn of a request estimated to use `tokens`, return the seconds waited.
+        Every `acquire` must be followed by `release`.
+        '''
+        if self.tokens_per_minute > 0:
+            tokens = min(tokens, self.tokens_per_minute) # larger requests would never fit
+        ticket = object()
+        with self.condition:
+            start = self.clock()
+            self.waiters.append(ticket)
+            try:
+                while True:
+                    if self.waiters[0] is ticket and self.in_flight < self.max_in_flight:
+                        self._refill()
+                        delay = self._delay(tokens)
+                        if delay <= 0:
+                            break
+                        self.condition.wait(delay)
+                    else:
+                        self.condition.wait()
+            except BaseException:
+                self.waiters.remove(ticket)
+                self.condition.notify_all()
+                raise
+
+            self.waiters.popleft()
+            self.request_budget -= 1
+            self.token_budget -= tokens
+            self.in_flight += 1
+
+            waited = self.clock() - start
+            self.granted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.condition.notify_all() # the next waiter may be served now
+        return waited
+
+    def release(self, reserved: int = 0, used: Optional[int] = None):
+        '''end a request, `used` tokens reported by the response replace the `reserved` estimate'''
+        with self.condition:
+            self.in_flight -= 1
+            if used is not None:
+                self.token_budget -= used - reserved
+            self.tokens_used += used if used is not None else reserved
+            self.condition.notify_all()
+
+    @contextmanager
+    def request(self, tokens: int = 0):
+        '''`acquire` and `release` around a request, set `usage["tokens"]` to report the tokens it used'''
+        self.acquire(tokens)
+        usage = {"tokens": None}
+        try:
+            yield usage
+        finally:
+            self.release(tokens, usage["tokens"])
+
+    def stats(self) -> dict:
+        with self.condition:
+            self._refill()
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queued": len(self.waiters),
+                "requests": self.granted,
+                "tokens_used": self.tokens_used,
+                "average_wait": self.total_wait / self.granted if self.granted > 0 else 0.0,
+                "max_wait": self.max_wait,
+                "request_budget": self.request_budget,
+                "token_budget": self.token_budget,
+            }
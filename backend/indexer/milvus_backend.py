@@ -0,0 +1,415 @@
+import asyncio
+import json
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from pymilvus import (
+    MilvusClient, AsyncMilvusClient, DataType, Function, FunctionType
+)
+from pymilvus import AnnSearchRequest
+from pymilvus import RRFRanker
+
+from indexer.backend import SearchRequest, VectorBackend
+from indexer.index_config import index_configs
+from indexer import vector_dtype
+from indexer.vector_dtype import VECTOR_DTYPE
+from indexer.milvus_pool import MilvusClientPool
+from indexer.schema import *
+
+milvus_token = os.getenv("MILVUS_TOKEN", "root:Milvus")
+milvus_uri = os.getenv("MILVUS_URI", "http://localhost:19530")
+
+MILVUS_POOL_SIZE = int(os.getenv("MILVUS_POOL_SIZE", "4"))
+MILVUS_HEALTH_CHECK_INTERVAL = float(os.getenv("MILVUS_HEALTH_CHECK_INTERVAL", "30")) # seconds
+MILVUS_POOL_TIMEOUT = float(os.getenv("MILVUS_POOL_TIMEOUT", "60")) # seconds waiting for a client before TimeoutError
+
+# every caption is stored in FIELD_TEXT, english captions are only searched there so it is stemmed too
+EN_ANALYZER_PARAMS = {
+    "tokenizer": "standard",
+    "filter": [
+        "lowercase",
+        {
+            "type": "stop",
+            "stop_words": ["_english_"],
+        },
+        {
+            "type": "stemmer",
+            "language": "english"
+        },
+    ]
+}
+
+CN_ANALYZER_PARAMS = {
+    "tokenizer": "jieba",
+    "filter": [
+        "cnalphanumonly",
+        "lowercase",
+        {
+            "type": "stemmer",
+            "language": "english"
+        },
+        {
+            "type": "stop", # Specifies the filter type as stop
+            "stop_words": ["_english_"], # Defines custom stop words and includes the English stop word list
+        }
+    ]
+}
+
+VECTOR_DATA_TYPES = {
+    "float32": DataType.FLOAT_VECTOR,
+    "float16": DataType.FLOAT16_VECTOR,
+    "bfloat16": DataType.BFLOAT16_VECTOR,
+}
+
+class MilvusBackend(VectorBackend):
+    '''Milvus standalone server, see Docker-compose.yml'''
+    def __init__(self, uri: str = milvus_uri, token: str = milvus_token,
+                 pool_size: int = MILVUS_POOL_SIZE, health_check_interval: float = MILVUS_HEALTH_CHECK_INTERVAL,
+                 pool_timeout: float = MILVUS_POOL_TIMEOUT):
+        self.uri = uri
+        self.token = token
+        self.client_pool = MilvusClientPool(uri, token, pool_size, health_check_interval, pool_timeout)
+        # an AsyncMilvusClient is bound to the event loop it was created in
+        self.async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncMilvusClient]" = weakref.WeakKeyDictionary()
+        self.async_lock = threading.Lock()
+        # {collection: {dense field: dtype}}, collections created before a change of VECTOR_DTYPE keep their types
+        self.dtypes: Dict[str, Dict[str, str]] = {}
+        self.dtypes_lock = threading.Lock()
+
+    @contextmanager
+    def getClient(self):
+        """
+        Borrow a Milvus client from the process wide pool.
+        """
+        client = self.client_pool.acquire()
+        broken = False
+        try:
+            yield client
+        except Exception:
+            # request errors keep the channel, only drop the client if the server is unreachable
+            broken = not self.client_pool.is_healthy(client)
+            raise
+        finally:
+            self.client_pool.release(client, broken)
+
+    def getAsyncClient(self) -> AsyncMilvusClient:
+        """
+        Async client of the running event loop, created on first use.
+        """
+        loop = asyncio.get_running_loop()
+        with self.async_lock:
+            client = self.async_clients.get(loop)
+            if client is None:
+                client = AsyncMilvusClient(uri=self.uri, token=self.token)
+                self.async_clients[loop] = client
+        return client
+
+    def close(self):
+        self.client_pool.close()
+        with self.async_lock:
+            self.async_clients.clear()
+
+    async def close_async(self):
+        with self.async_lock:
+            client = self.async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+        self.close()
+
+    def has_collection(self, collection: str) -> bool:
+        with self.getClient() as client:
+            return client.has_collection(collection_name=collection)
+
+    def create_collection(self, collection: str):
+        schema = MilvusClient.create_schema(auto_id=False)
+
+        schema.add_field(field_name=FIELD_ID, datatype=DataType.INT64, is_primary=True, description="product id")
+
+        schema.add_field(field_name=FIELD_TEXT, datatype=DataType.VARCHAR, max_length=2048, enable_analyzer=True, analyzer_params=EN_ANALYZER_PARAMS,
+                        description="raw text of product description")
+
+        schema.add_field(field_name=FIELD_TEXT_DENSE, datatype=VECTOR_DATA_TYPES[VECTOR_DTYPE], dim=TEXT_FEATURE_DIM, description="text dense embedding")
+
+        schema.add_field(field_name=FIELD_TEXT_SPARSE, datatype=DataType.SPARSE_FLOAT_VECTOR,
+                        description="text sparse embedding auto-generated by the built-in BM25 function")
+
+        schema.add_field(field_name=FIELD_IMAGE_DENSE, datatype=VECTOR_DATA_TYPES[VECTOR_DTYPE], dim=IMAGE_FEATURE_DIM, description="image dense embedding")
+
+        schema.add_field(field_name=FIELD_HAS_TEXT, datatype=DataType.BOOL, description="text dense embedding is present")
+
+        schema.add_field(field_name=FIELD_HAS_IMAGE, datatype=DataType.BOOL, description="image dense embedding is present")
+
+        schema.add_field(field_name=FIELD_TEXT_MODEL, datatype=DataType.VARCHAR, max_length=MODEL_ID_MAX_LENGTH,
+                        description="model of the text dense embedding")
+
+        schema.add_field(field_name=FIELD_IMAGE_MODEL, datatype=DataType.VARCHAR, max_length=MODEL_ID_MAX_LENGTH,
+                        description="model of the image dense embedding")
+
+        schema.add_field(field_name=FIELD_CN_TEXT, datatype=DataType.VARCHAR, max_length=2048, enable_analyzer=True, analyzer_params=CN_ANALYZER_PARAMS,
+                        description="raw text of product description for chinese analyzer")
+
+        schema.add_field(field_name=FIELD_CN_TEXT_SPARSE, datatype=DataType.SPARSE_FLOAT_VECTOR,
+                        description="text sparse embedding auto-generated by the built-in BM25 function for chinese tokens")
+
+        bm25_function = Function(
+            name="text_bm25_emb",
+            input_field_names=[FIELD_TEXT],
+            output_field_names=[FIELD_TEXT_SPARSE],
+            function_type=FunctionType.BM25,
+        )
+        schema.add_function(bm25_function)
+
+        cn_bm25_function = Function(
+            name="cm_text_bm25_emb",
+            input_field_names=[FIELD_CN_TEXT],
+            output_field_names=[FIELD_CN_TEXT_SPARSE],
+            function_type=FunctionType.BM25,
+        )
+        schema.add_function(cn_bm25_function)
+
+        with self.getClient() as client:
+            index_params = client.prepare_index_params()
+
+            self.addDenseIndexes(index_params)
+
+            index_params.add_index(
+                field_name=FIELD_TEXT_SPARSE,
+                index_name=FIELD_TEXT_SPARSE + "_index",
+                index_type="SPARSE_INVERTED_INDEX",
+                metric_type="BM25",
+                params={"inverted_index_algo": "DAAT_MAXSCORE"}, # or "DAAT_WAND" or "TAAT_NAIVE"
+            )
+            index_params.add_index(
+                field_name=FIELD_CN_TEXT_SPARSE,
+                index_name=FIELD_CN_TEXT_SPARSE + "_index",
+                index_type="SPARSE_INVERTED_INDEX",
+                metric_type="BM25",
+                params={"inverted_index_algo": "DAAT_MAXSCORE"}, # or "DAAT_WAND" or "TAAT_NAIVE"
+            )
+
+            if client.has_collection(collection_name=collection):
+                client.drop_collection(collection_name=collection)
+
+            client.create_collection(
+                collection_name=collection,
+                schema=schema,
+                index_params=index_params
+            )
+        self.forgetDtypes(collection)
+
+    def fields(self, collection: str) -> List[str]:
+        with self.getClient() as client:
+            return [field["name"] for field in client.describe_collection(collection_name=collection)["fields"]]
+
+    def analyzers_current(self, collection: str) -> bool:
+        with self.getClient() as client:
+            fields = client.describe_collection(collection_name=collection)["fields"]
+        for field in fields:
+            if field["name"] == FIELD_TEXT:
+                params = field["params"].get("analyzer_params")
+                # collections created before EN_ANALYZER_PARAMS use the default analyzer
+                return (json.loads(params) if isinstance(params, str) else params) == EN_ANALYZER_PARAMS
+        return False
+
+    def drop_collection(self, collection: str):
+        with self.getClient() as client:
+            client.drop_collection(collection_name=collection)
+        self.forgetDtypes(collection)
+
+    def rename_collection(self, collection: str, new_name: str):
+        with self.getClient() as client:
+            client.rename_collection(old_name=collection, new_name=new_name)
+        self.forgetDtypes(collection, new_name)
+
+    def vectorDtypes(self, collection: str) -> Dict[str, str]:
+        """
+        Storage type of each dense field of `collection`.
+        """
+        with self.dtypes_lock:
+            if collection in self.dtypes:
+                return self.dtypes[collection]
+
+        with self.getClient() as client:
+            fields = client.describe_collection(collection_name=collection)["fields"]
+        names = {data_type: name for name, data_type in VECTOR_DATA_TYPES.items()}
+        dtypes = {field["name"]: names[field["type"]] for field in fields if field["name"] in DENSE_FIELDS}
+
+        with self.dtypes_lock:
+            self.dtypes[collection] = dtypes
+        return dtypes
+
+    def forgetDtypes(self, *collections: str):
+        with self.dtypes_lock:
+            for collection in collections:
+                self.dtypes.pop(collection, None)
+
+    def encodeRows(self, collection: str, rows: List[dict]) -> List[dict]:
+        dtypes = {field: dtype for field, dtype in self.vectorDtypes(collection).items() if dtype != "float32"}
+        if len(dtypes) == 0:
+            return rows
+        return [{**row, **{field: vector_dtype.encode(row[field], dtype) for field, dtype in dtypes.items() if field in row}}
+                for row in rows]
+
+    def decodeRows(self, collection: str, rows: List[dict]) -> List[dict]:
+        dtypes = {field: dtype for field, dtype in self.vectorDtypes(collection).items() if dtype != "float32"}
+        if len(dtypes) == 0:
+            return rows
+        return [{**row, **{field: vector_dtype.decode(row[field], dtype) for field, dtype in dtypes.items() if field in row}}
+                for row in rows]
+
+    @staticmethod
+    def addDenseIndexes(index_params):
+        for name, config in index_configs.items():
+            index_params.add_index(
+                field_name=name,
+                index_name=name + "_index",
+                index_type=config.index_type,
+                metric_type=config.metric_type,
+                params=config.build
+            )
+
+    def rebuild_indexes(self, collection: str):
+        with self.getClient() as client:
+            client.release_collection(collection_name=collection)
+            for name in index_configs:
+                client.drop_index(collection_name=collection, index_name=name + "_index")
+
+            index_params = client.prepare_index_params()
+            self.addDenseIndexes(index_params)
+            client.create_index(collection_name=collection, index_params=index_params)
+            client.load_collection(collection_name=collection)
+
+    def list_partitions(self, collection: str) -> List[str]:
+        with self.getClient() as client:
+            return client.list_partitions(collection_name=collection)
+
+    def create_partition(self, collection: str, partition: str):
+        with self.getClient() as client:
+            client.create_partition(
+                collection_name = collection,
+                partition_name = partition
+            )
+
+    def drop_partition(self, collection: str, partition: str):
+        with self.getClient() as client:
+            client.release_partitions(collection_name=collection, partition_names=[partition])
+            client.drop_partition(collection_name=collection, partition_name=partition)
+
+    def upsert(self, collection: str, partition: str, rows: List[dict]):
+        with self.getClient() as client:
+            client.upsert(
+                collection_name=collection,
+                partition_name=partition,
+                data=self.encodeRows(collection, rows)
+            )
+
+    def delete(self, collection: str, ids: List[int]):
+        with self.getClient() as client:
+            client.delete(
+                collection_name=collection,
+                ids=ids
+            )
+
+    def get(self, collection: str, ids: List[int], output_fields: List[str]) -> List[dict]:
+        with self.getClient() as client:
+            rows = client.get(
+                collection_name=collection,
+                ids=ids,
+                output_fields=output_fields
+            )
+        return self.decodeRows(collection, rows)
+
+    def iterate(self, collection: str, partitions: Optional[List[str]], output_fields: List[str],
+                batch_size: int, filter: str = "") -> Iterator[List[dict]]:
+        # a pooled client is only held while a batch is read, so callers may use the backend between batches.
+        # Each batch opens an iterator after the last id read, the iterators return rows in id order
+        last_id = None
+        while True:
+            batch_filter = filter
+            if last_id is not None:
+                batch_filter = f"({filter}) and {FIELD_ID} > {last_id}" if filter else f"{FIELD_ID} > {last_id}"
+
+            with self.getClient() as client:
+                iterator = client.query_iterator(
+                    collection_name=collection,
+                    batch_size=batch_size,
+                    filter=batch_filter,
+                    output_fields=output_fields,
+                    partition_names=partitions
+                )
+                try:
+                    batch = iterator.next()
+                finally:
+                    iterator.close()
+
+            if len(batch) == 0:
+                break
+            last_id = max(row[FIELD_ID] for row in batch)
+            yield self.decodeRows(collection, batch)
+
+    def search(self, collection: str, partitions: Optional[List[str]], anns_field: str, vectors: List[list],
+               limit: int, param: dict, filter: str = "", output_fields: Optional[List[str]] = None) -> List[List[dict]]:
+        dtype = self.vectorDtypes(collection)[anns_field]
+        with self.getClient() as client:
+            res = client.search(
+                collection_name=collection,
+                partition_names=partitions,
+                data=[vector_dtype.encode_query(vector, dtype) for vector in vectors],
+                anns_field=anns_field,
+                search_params={"metric_type": index_configs[anns_field].metric_type, "params": param},
+                limit=limit,
+                filter=filter,
+                output_fields=output_fields or []
+            )
+
+        return [self.decodeRows(collection, [{FIELD_ID: hit[FIELD_ID], "distance": hit["distance"], **hit["entity"]} for hit in hits])
+                for hits in res]
+
+    def toAnnSearchRequests(self, collection: str, requests: List[SearchRequest]) -> List[AnnSearchRequest]:
+        dtypes = self.vectorDtypes(collection)
+        return [AnnSearchRequest(
+                    data=[vector_dtype.encode_query(request.data, dtypes[request.anns_field])
+                          if request.anns_field in dtypes else request.data],
+                    anns_field=request.anns_field,
+                    param=request.param,
+                    limit=request.limit,
+                    expr=request.filter if request.filter else None
+                ) for request in requests]
+
+    def hybrid_search(self, collection: str, partitions: Optional[List[str]],
+                      requests: List[SearchRequest], limit: int) -> List[dict]:
+        reqs = self.toAnnSearchRequests(collection, requests)
+
+        with self.getClient() as client:
+            ranker = RRFRanker(60)
+            res = client.hybrid_search(
+                collection_name=collection,
+                partition_names=partitions,
+                reqs=reqs,
+                ranker=ranker,
+                output_fields=[],
+                limit=limit
+            )[0]
+
+        return [{FIELD_ID: hit[FIELD_ID], "distance": hit["distance"]}
+                for hit in res]
+
+    async def hybrid_search_async(self, collection: str, partitions: Optional[List[str]],
+                                  requests: List[SearchRequest], limit: int) -> List[dict]:
+        reqs = self.toAnnSearchRequests(collection, requests)
+
+        client = self.getAsyncClient()
+        res = (await client.hybrid_search(
+            collection_name=collection,
+            partition_names=partitions,
+            reqs=reqs,
+            ranker=RRFRanker(60),
+            output_fields=[],
+            limit=limit
+        ))[0]
+
+        return [{FIELD_ID: hit[FIELD_ID], "distance": hit["distance"]}
+                for hit in res]
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+from typing import Optional
+
+from pymilvus import MilvusClient
+
+class MilvusClientPool:
+    '''
+    Process wide pool of `MilvusClient`, every client owns one gRPC channel.
+
+    The pool holds `size` slots, a client is created lazily when an empty slot is acquired,
+    `acquire` blocks when all clients are in use, at most `timeout` seconds.
+    A client idle for more than `health_check_interval` seconds is pinged before reuse
+    and reconnected if the server does not answer.
+    '''
+    def __init__(self, uri: str, token: str, size: int = 4, health_check_interval: float = 30, timeout: Optional[float] = None):
+        self.uri = uri
+        self.token = token
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+
+        # (client or None for an empty slot, last used time)
+        # LIFO so the most recently used client is reused first and empty slots last
+        self.idle: queue.LifoQueue = queue.LifoQueue()
+        for _ in range(size):
+            self.idle.put((None, 0))
+
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _connect(self) -> MilvusClient:
+        return MilvusClient(uri=self.uri, token=self.token)
+
+    def _close_client(self, client: Optional[MilvusClient]):
+        if client is None:
+            return
+        try:
+            client.close()
+        except Exception as e:
+            print(e)
+
+    def is_healthy(self, client: MilvusClient) -> bool:
+        try:
+            client.get_server_version()
+            return True
+        except Exception as e:
+            print("Milvus client unhealthy: ", e)
+            return False
+
+    def acquire(self) -> MilvusClient:
+        if self.closed:
+            raise RuntimeError("Milvus client pool is closed")
+
+        try:
+            client, last_used = self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No Milvus client released in {self.timeout} seconds, {self.size} clients in use")
+
+        try:
+            if client is None:
+                client = self._connect()
+            elif time.time() - last_used > self.health_check_interval and not self.is_healthy(client):
+                self._close_client(client)
+                client = self._connect()
+        except Exception:
+            # give the slot back, the next acquire retries to connect
+            self.idle.put((None, 0))
+            raise
+
+        return client
+
+    def release(self, client: MilvusClient, broken: bool = False):
+        '''return a client to the pool, a broken client is closed and its slot is emptied'''
+        if self.closed:
+            self._close_client(client)
+            return
+
+        if broken:
+            self._close_client(client)
+            self.idle.put((None, 0))
+        else:
+            self.idle.put((client, time.time()))
+
+    def close(self):
+        '''close idle clients, clients still in use are closed when released'''
+        with self.lock:
+            self.closed = True
+            while True:
+                try:
+                    client, _ = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._close_client(client)
@@ -0,0 +1,119 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+from indexer import clip_embed
+# the workers only import this module, see its docstring
+from preprocess_worker import decode, init_worker, tensor_bytes
+
+CPU_COUNT = os.cpu_count() or 1
+# torch intra-op threads of the inference stage in this process, the other cores decode images
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or max(1, CPU_COUNT // 4)
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "0")) or max(1, CPU_COUNT - INFERENCE_THREADS)
+PREVIEW_SIZE = 512 # decoded images are reduced to fit it, enough for thumbnails
+# JPEG files are decoded at the smallest scale keeping the short side above both outputs
+DRAFT_SIZE = max(PREVIEW_SIZE, 2 * clip_embed.IMAGE_SIZE)
+
+TENSOR_SHAPE = (3, clip_embed.IMAGE_SIZE, clip_embed.IMAGE_SIZE)
+TENSOR_BYTES = tensor_bytes(TENSOR_SHAPE)
+
+class DecodedImage:
+    '''an image file decoded by a worker of `PreprocessPool`'''
+    def __init__(self, width: int, height: int, format: str, preview: Image.Image, tensor: torch.Tensor, digest: str):
+        self.width = width # of the file
+        self.height = height
+        self.format = format
+        self.preview = preview # reduced to fit PREVIEW_SIZE
+        self.tensor = tensor # preprocessed for `clip_embed.MODEL_ID`
+        self.digest = digest # `content_hash` of the file
+
+class PreprocessPool:
+    '''
+    Decode and preprocess stage of the ingestion, decoupled from the model.
+    Worker processes decode image files and write the model inputs into slots of a shared memory block,
+    which saves pickling the tensors through a pipe. The tensors are copied out as soon as a worker is done,
+    the forward passes run in this process by `clip_embed.image_embedder`.
+    '''
+    def __init__(self, workers: int = PREPROCESS_WORKERS):
+        self.slots = 2 * workers # decoded ahead while the workers are busy
+        self.memory = SharedMemory(create=True, size=self.slots * TENSOR_BYTES)
+        self.free = queue.Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+
+        _, preprocess, _ = clip_embed.getModel()
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=init_worker,
+                                            initargs=(self.memory.name, preprocess, TENSOR_SHAPE, DRAFT_SIZE, PREVIEW_SIZE))
+
+    def slot(self, slot: int) -> np.ndarray:
+        return np.ndarray(TENSOR_SHAPE, dtype=np.float32, buffer=self.memory.buf, offset=slot * TENSOR_BYTES)
+
+    def submit(self, path: str) -> Future:
+        '''return a Future of the `DecodedImage` of a file, block while every slot is in use'''
+        slot = self.free.get()
+        result = Future()
+
+        def done(decoded: Future):
+            try:
+                width, height, format, preview, digest = decoded.result()
+                tensor = torch.from_numpy(self.slot(slot).copy())
+                result.set_result(DecodedImage(width, height, format, preview, tensor, digest))
+            except Exception as e:
+                result.set_exception(e)
+            finally:
+                self.free.put(slot)
+
+        try:
+            self.executor.submit(decode, str(path), slot).add_done_callback(done)
+        except Exception:
+            self.free.put(slot)
+            raise
+        return result
+
+    def imap(self, paths: Iterable) -> Iterator[Tuple[object, Future]]:
+        '''yield (path, Future of `DecodedImage`) in order, files are decoded ahead by all workers'''
+        window = deque()
+        for path in paths:
+            window.append((path, self.submit(path)))
+            if len(window) >= self.slots:
+                yield window.popleft()
+        while len(window) != 0:
+            yield window.popleft()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.memory.close()
+        self.memory.unlink()
+
+pool: Optional[PreprocessPool] = None
+pool_lock = threading.Lock()
+
+def get_pool() -> PreprocessPool:
+    '''the pool of this process, started on first use along with the thread partitioning of torch'''
+    global pool
+    if pool is None:
+        with pool_lock:
+            if pool is None:
+                torch.set_num_threads(INFERENCE_THREADS)
+                pool = PreprocessPool()
+                atexit.register(close_pool)
+    return pool
+
+def close_pool():
+    '''stop the workers and free the shared memory'''
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.close()
+            pool = None
@@ -0,0 +1,58 @@
+TEXT_FEATURE_DIM = 256
+IMAGE_FEATURE_DIM = 512
+
+FIELD_ID = "id"
+FIELD_TEXT = "text" # raw text
+FIELD_TEXT_SPARSE = "text_sparse" # BM 25
+
+FIELD_TEXT_DENSE = "text_dense" # text 2 vec
+FIELD_IMAGE_DENSE = "image_dense" # clip embedding
+
+FIELD_CN_TEXT = "cn_text" # raw text for chinese analyzer
+FIELD_CN_TEXT_SPARSE = "cn_text_sparse" # BM 25
+
+FIELD_HAS_TEXT = "has_text" # text_dense holds the embedding of a caption
+FIELD_HAS_IMAGE = "has_image" # image_dense holds the embedding of the image
+
+FIELD_TEXT_MODEL = "text_model" # model id of text_dense, "" without embedding
+FIELD_IMAGE_MODEL = "image_model" # model id of image_dense, "" without embedding
+MODEL_ID_MAX_LENGTH = 128
+
+FIELD_PARTITION = "partition" # only used in rows of insert_many, not stored
+
+# {dense vector field: dimension}
+DENSE_FIELDS = {
+    FIELD_TEXT_DENSE: TEXT_FEATURE_DIM,
+    FIELD_IMAGE_DENSE: IMAGE_FEATURE_DIM,
+}
+
+# {dense field: flag of rows having it}, Milvus 2.5 has no nullable vectors,
+# rows without an embedding store zeros and are filtered out of the searches of that field
+PRESENCE_FIELDS = {
+    FIELD_TEXT_DENSE: FIELD_HAS_TEXT,
+    FIELD_IMAGE_DENSE: FIELD_HAS_IMAGE,
+}
+
+# {dense field: id of the model its vectors are embedded with}, vectors of different models are not comparable
+MODEL_FIELDS = {
+    FIELD_TEXT_DENSE: FIELD_TEXT_MODEL,
+    FIELD_IMAGE_DENSE: FIELD_IMAGE_MODEL,
+}
+
+# {dense field: model of the vectors stored before the model fields}
+LEGACY_MODELS = {
+    FIELD_TEXT_DENSE: "minishlab/potion-base-8M",
+    FIELD_IMAGE_DENSE: "ViT-B-32/laion2b_s34b_b79k",
+}
+
+# {BM25 sparse field: raw text field it is generated from}
+SPARSE_FIELDS = {
+    FIELD_TEXT_SPARSE: FIELD_TEXT,
+    FIELD_CN_TEXT_SPARSE: FIELD_CN_TEXT,
+}
+
+# fields written by inserts, the sparse fields are generated from the raw text
+STORED_FIELDS = [FIELD_ID, FIELD_TEXT, FIELD_CN_TEXT, FIELD_TEXT_DENSE, FIELD_IMAGE_DENSE, FIELD_HAS_TEXT, FIELD_HAS_IMAGE,
+                 FIELD_TEXT_MODEL, FIELD_IMAGE_MODEL]
+
+DEFAULT_PARTITION = "_default"
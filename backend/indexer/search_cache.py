@@ -0,0 +1,98 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024")) # 0 disables the cache
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300")) # seconds
+# results searched right after a write may not see it yet (Milvus bounded consistency), do not cache them
+SEARCH_CACHE_SETTLE = float(os.getenv("SEARCH_CACHE_SETTLE", "1")) # seconds
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+class WriteGenerations:
+    '''
+    Write counters of each collection and partition.
+    A cached result is keyed by the counters it depends on, so a write makes it unreachable.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.partitions: Dict[Tuple[str, str], int] = {}
+        self.collection_total: Dict[str, int] = {} # bumped by every write
+        self.collection_wide: Dict[str, int] = {} # bumped by writes of unknown partitions
+        self.last_write = 0.0
+
+    def bump(self, collection: str, partitions: Optional[List[str]] = None):
+        '''record a write to `partitions`, None if the partitions are unknown'''
+        with self.lock:
+            self.last_write = time.time()
+            self.collection_total[collection] = self.collection_total.get(collection, 0) + 1
+            if partitions is None:
+                self.collection_wide[collection] = self.collection_wide.get(collection, 0) + 1
+                return
+            for partition in partitions:
+                key = (collection, partition)
+                self.partitions[key] = self.partitions.get(key, 0) + 1
+
+    def settled(self, seconds: float = SEARCH_CACHE_SETTLE) -> bool:
+        '''no write in the last `seconds`'''
+        return time.time() - self.last_write > seconds
+
+    def snapshot(self, collection: str, partitions: Optional[List[str]] = None) -> tuple:
+        '''generation of data visible to a search over `partitions`, None for all partitions'''
+        with self.lock:
+            if partitions is None:
+                return (self.collection_total.get(collection, 0),)
+            return (self.collection_wide.get(collection, 0),) + \
+                tuple(self.partitions.get((collection, partition), 0) for partition in sorted(partitions))
+
+class SearchCache:
+    '''thread safe LRU cache with TTL, counts hits and misses'''
+    def __init__(self, max_size: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self.items[key]
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.items[key] = (time.time() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "size": len(self.items),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
@@ -0,0 +1,139 @@
+'''
+Snapshot of a collection with its vectors, restored without captioning or embedding again.
+
+    uv run python -m indexer.snapshot export snapshot.npz
+    uv run python -m indexer.snapshot import snapshot.npz
+
+A snapshot is an uncompressed npz (a zip of .npy arrays) written chunk by chunk, so neither side
+holds more than one chunk in memory. Each chunk holds the rows of one partition:
+
+    {chunk}/id             int64 (n,)
+    {chunk}/text           uint8, utf-8 captions concatenated
+    {chunk}/text_offsets   int64 (n + 1,), caption i is text[offsets[i]:offsets[i + 1]]
+    {chunk}/{dense field}  float32 (n, dim)
+    {chunk}/{presence flag} bool (n,)
+    {chunk}/{model field}  int32 (n,), index into the model list of the manifest, -1 without embedding
+
+`manifest` is a JSON string of the format version, dimensions, model ids and chunks written last.
+Ids are the image ids of the SQLite database, copy it along with the snapshot.
+'''
+import argparse
+import json
+import zipfile
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from indexer import vector_db
+from indexer.schema import *
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK_SIZE = 10000
+
+def write_array(archive: zipfile.ZipFile, name: str, array: np.ndarray):
+    with archive.open(name + ".npy", "w", force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+def encode_texts(texts: List[str]):
+    data = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in data])
+    return np.frombuffer(b"".join(data), dtype=np.uint8), offsets
+
+def decode_texts(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    raw = data.tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+def export_snapshot(collection: str, path: str, batch_size: int = SNAPSHOT_CHUNK_SIZE) -> int:
+    '''write all rows of a collection to `path`, return the number of rows'''
+    models: Dict[str, int] = {}
+    chunks = []
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for partition in vector_db.list_partitions(collection):
+            for batch in vector_db.iter_data(collection, [partition], STORED_FIELDS, batch_size):
+                chunk = f"{len(chunks):06d}"
+                text, offsets = encode_texts([row[FIELD_TEXT] for row in batch])
+                write_array(archive, f"{chunk}/{FIELD_ID}", np.array([row[FIELD_ID] for row in batch], dtype=np.int64))
+                write_array(archive, f"{chunk}/{FIELD_TEXT}", text)
+                write_array(archive, f"{chunk}/text_offsets", offsets)
+                for field, dim in DENSE_FIELDS.items():
+                    flag, model_field = PRESENCE_FIELDS[field], MODEL_FIELDS[field]
+                    write_array(archive, f"{chunk}/{field}",
+                                np.array([row[field] for row in batch], dtype=np.float32).reshape(len(batch), dim))
+                    write_array(archive, f"{chunk}/{flag}", np.array([row[flag] for row in batch], dtype=bool))
+                    write_array(archive, f"{chunk}/{model_field}", np.array(
+                        [models.setdefault(row[model_field], len(models)) if row[flag] else -1 for row in batch], dtype=np.int32))
+                chunks.append({"name": chunk, "partition": partition, "rows": len(batch)})
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "collection": collection,
+            "dims": DENSE_FIELDS,
+            "models": sorted(models, key=models.get),
+            "chunks": chunks,
+        }
+        write_array(archive, "manifest", np.array(json.dumps(manifest)))
+
+    return sum(chunk["rows"] for chunk in chunks)
+
+def read_manifest(snapshot) -> dict:
+    manifest = json.loads(str(snapshot["manifest"]))
+    if manifest["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest['version']}")
+    if manifest["dims"] != DENSE_FIELDS:
+        raise ValueError(f"Snapshot dimensions {manifest['dims']} do not match {DENSE_FIELDS}")
+    return manifest
+
+def read_snapshot(path: str) -> Iterator[List[dict]]:
+    '''yield the rows of each chunk built by `vector_db.make_row`, raise ValueError for an incompatible snapshot'''
+    with np.load(path) as snapshot:
+        manifest = read_manifest(snapshot)
+        models = manifest["models"]
+        for chunk in manifest["chunks"]:
+            name = chunk["name"]
+            ids = snapshot[f"{name}/{FIELD_ID}"]
+            texts = decode_texts(snapshot[f"{name}/{FIELD_TEXT}"], snapshot[f"{name}/text_offsets"])
+            columns = {}
+            for field in DENSE_FIELDS:
+                vectors = snapshot[f"{name}/{field}"]
+                flags = snapshot[f"{name}/{PRESENCE_FIELDS[field]}"]
+                model_indices = snapshot[f"{name}/{MODEL_FIELDS[field]}"]
+                columns[field] = [(vector if flag else None, models[index] if flag else None)
+                                  for vector, flag, index in zip(vectors, flags, model_indices)]
+
+            yield [vector_db.make_row(int(id), text, text_dense, image_dense, chunk["partition"], text_model, image_model)
+                   for id, text, (text_dense, text_model), (image_dense, image_model)
+                   in zip(ids, texts, columns[FIELD_TEXT_DENSE], columns[FIELD_IMAGE_DENSE])]
+
+def import_snapshot(collection: str, path: str, batch_size: int = vector_db.LIST_BATCH_SIZE) -> int:
+    '''
+    upsert the rows of a snapshot into a collection, created if missing, and their partitions.
+    return the number of rows inserted, raise ValueError for an incompatible snapshot
+    '''
+    if vector_db.is_collection_exist(collection) == False:
+        vector_db.create_embed_db(collection)
+
+    inserted = 0
+    for rows in read_snapshot(path):
+        for start in range(0, len(rows), batch_size):
+            inserted += sum(vector_db.insert_many(collection, rows[start:start + batch_size]))
+
+    # rows may be embedded by models other than the current ones
+    vector_db.model_versions.invalidate(collection)
+    return inserted
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path")
+    parser.add_argument("--collection", default=vector_db.COLLECTION_NAME)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Exported {export_snapshot(args.collection, args.path)} rows")
+    else:
+        print(f"Imported {import_snapshot(args.collection, args.path)} rows")
+    vector_db.close_backend()
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,41 @@
+import os
 import threading
+from typing import List
+
+import numpy as np
 from pymilvus import model
 
-model2vec_ef = None
+from indexer.schema import TEXT_FEATURE_DIM
+
+MODEL_SOURCE = os.getenv("TEXT_EMBED_MODEL", 'minishlab/potion-base-8M') # or local directory
+MODEL_ID = MODEL_SOURCE
+
+# {model id: embedding function}, more than one while stored vectors are re-embedded
+models = {}
 model_lock = threading.Lock()
 
-def getModel():
-    global model2vec_ef
-    if model2vec_ef is None:
+def getModel(model_id: str = MODEL_ID):
+    if model_id not in models:
         with model_lock:
-            model2vec_ef = model.dense.Model2VecEmbeddingFunction(
-                model_source='minishlab/potion-base-8M', # or local directory
-            )
+            if model_id not in models:
+                models[model_id] = model.dense.Model2VecEmbeddingFunction(
+                    model_source=model_id,
+                )
 
-    return model2vec_ef
+    return models[model_id]
 
-def get_text_embed_doc(text):
-    model2vec_ef = getModel()
-    docs_embeddings = model2vec_ef.encode_documents([text])
-    return docs_embeddings[0]
+def get_text_embed_docs(texts: List[str], model_id: str = MODEL_ID) -> np.ndarray:
+    '''embed a batch of captions in one call, return a (len(texts), dim) float32 array'''
+    if len(texts) == 0:
+        return np.zeros((0, TEXT_FEATURE_DIM), dtype=np.float32)
+    model2vec_ef = getModel(model_id)
+    docs_embeddings = model2vec_ef.encode_documents(texts)
+    return np.asarray(docs_embeddings, dtype=np.float32)
+
+def get_text_embed_doc(text, model_id: str = MODEL_ID):
+    return get_text_embed_docs([text], model_id)[0]
 
-def get_text_embed_query(text):
-    model2vec_ef = getModel()
+def get_text_embed_query(text, model_id: str = MODEL_ID):
+    model2vec_ef = getModel(model_id)
     docs_embeddings = model2vec_ef.encode_queries([text])
-    return docs_embeddings[0]
\ No newline at end of file
+    return docs_embeddings[0]
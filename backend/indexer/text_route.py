@@ -0,0 +1,28 @@
+import re
+from typing import List
+
+from indexer.schema import FIELD_CN_TEXT_SPARSE, FIELD_TEXT_SPARSE
+
+# CJK unified ideographs, the tokens only the chinese analyzer splits into words
+CJK = re.compile(r"[㐀-䶿一-鿿豈-﫿]")
+LATIN = re.compile(r"[A-Za-z0-9]")
+
+def contains_cjk(text: str) -> bool:
+    return CJK.search(text) is not None
+
+def cn_text_of(caption: str) -> str:
+    '''
+    value of `FIELD_CN_TEXT` of a caption.
+    Every caption is stored in `FIELD_TEXT`, only captions with chinese are stored again for the chinese analyzer.
+    '''
+    return caption if contains_cjk(caption) else ""
+
+def bm25_fields(query: str) -> List[str]:
+    '''sparse fields a query can match, `FIELD_CN_TEXT_SPARSE` only holds captions with chinese'''
+    cjk = contains_cjk(query)
+    fields = []
+    if not cjk or LATIN.search(query) is not None:
+        fields.append(FIELD_TEXT_SPARSE)
+    if cjk:
+        fields.append(FIELD_CN_TEXT_SPARSE)
+    return fields
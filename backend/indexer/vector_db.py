@@ -1,414 +1,559 @@
+import asyncio
+import hashlib
 import json
+import logging
 import os
 import pathlib
-from typing import List, Optional
-from pymilvus import MilvusClient
-from pymilvus import (
-    MilvusClient, DataType, Function, FunctionType
-)
-from pymilvus import Collection, connections
-from pymilvus import AnnSearchRequest
-from pymilvus import RRFRanker, WeightedRanker
+import threading
+import uuid
+from concurrent.futures import Future
+from itertools import chain
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 import numpy as np
 from indexer import genai_api, text_embed, clip_embed
+from indexer.backend import SearchRequest, get_backend, close_backend, close_backend_async
+from indexer.index_config import search_params
+from indexer.text_route import bm25_fields, cn_text_of
+from indexer.schema import *
+from indexer.search_cache import SearchCache, WriteGenerations, normalize_text
+from indexer.limiter import LoopSemaphore
+from indexer.embed_cache import query_embed_memo
+from indexer.preprocess_pool import DecodedImage
+from indexer.content_store import StoredContent, content_store, content_hash
 
 from PIL.ImageFile import ImageFile
 from io import BytesIO
-from contextlib import contextmanager
 
-TEXT_FEATURE_DIM = 256
-IMAGE_FEATURE_DIM = 512
+COLLECTION_NAME = "my_collection"
 
+logger = logging.getLogger(__name__)
 
-milvus_host = os.getenv("MILVUS_HOST", "localhost")
-mulvus_port = os.getenv("MILVUS_PORT", "19530")
-milvus_token = os.getenv("MILVUS_TOKEN", "root:Milvus")
-milvus_uri = os.getenv("MILVUS_URI", "http://localhost:19530")
+LIST_BATCH_SIZE = int(os.getenv("LIST_BATCH_SIZE", "1000"))
 
-COLLECTION_NAME = "my_collection"
+# search results are cached until a write to the searched partitions
+write_generations = WriteGenerations()
+search_cache = SearchCache()
 
-FIELD_ID = "id"
-FIELD_TEXT = "text" # raw text
-FIELD_TEXT_SPARSE = "text_sparse" # BM 25
+SEARCH_CANDIDATE_MULTIPLIER = int(os.getenv("SEARCH_CANDIDATE_MULTIPLIER", "2"))
+MAX_SEARCH_CANDIDATES = 16384 # Milvus limit of topk
+# fused candidate lists of paginated searches, {cursor: (query key, candidate limit, candidates)}
+search_cursors = SearchCache(int(os.getenv("SEARCH_CURSOR_SIZE", "256")), float(os.getenv("SEARCH_CURSOR_TTL", "600")))
 
-FIELD_TEXT_DENSE = "text_dense" # text 2 vec
-FIELD_IMAGE_DENSE = "image_dense" # clip embedding
+class CursorExpired(Exception):
+    '''the cursor of a paginated search is evicted or was never returned'''
 
-FIELD_CN_TEXT = "cn_text" # raw text for chinese analyzer
-FIELD_CN_TEXT_SPARSE = "cn_text_sparse" # BM 25
+class CursorMismatch(Exception):
+    '''the cursor of a paginated search was returned for another query'''
 
-@contextmanager
-def getClient():
-    """
-    Get a Milvus client instance.
-    """
-    try:
-        client = MilvusClient(uri=milvus_uri, token=milvus_token)
-        yield client
-    finally:
-        #client.close()
-        pass
-
-    
-    
+QUERY_EMBED_CONCURRENCY = int(os.getenv("QUERY_EMBED_CONCURRENCY", "4")) # queries encoding at once
+query_embed_limiter = LoopSemaphore(QUERY_EMBED_CONCURRENCY)
 
 def is_collection_exist(collection: str):
-    with getClient() as client:
-        result = client.has_collection(collection_name=collection)
+    return get_backend().has_collection(collection)
 
-    return result
+class PartitionRegistry:
+    '''
+    In-process cache of partition names of each collection.
+    Loaded from the backend once per collection and kept in sync by `create_partition`, 
+    `invalidate` it when the collection is recreated or an insert fails.
+    '''
+    def __init__(self):
+        self.partitions: Dict[str, Set[str]] = {}
+        self.lock = threading.RLock()
+
+    def get(self, collection: str) -> Set[str]:
+        with self.lock:
+            if collection not in self.partitions:
+                self.partitions[collection] = set(get_backend().list_partitions(collection))
+            return self.partitions[collection]
+
+    def add(self, collection: str, partition: str):
+        with self.lock:
+            if collection in self.partitions:
+                self.partitions[collection].add(partition)
+
+    def remove(self, collection: str, partition: str):
+        with self.lock:
+            if collection in self.partitions:
+                self.partitions[collection].discard(partition)
+
+    def invalidate(self, collection: Optional[str] = None):
+        with self.lock:
+            if collection is None:
+                self.partitions.clear()
+            else:
+                self.partitions.pop(collection, None)
+
+partition_registry = PartitionRegistry()
+
+def load_partitions(collection: str):
+    '''(re)load partition names of a collection into the registry'''
+    partition_registry.invalidate(collection)
+    partition_registry.get(collection)
+
+def list_partitions(collection: str) -> List[str]:
+    return sorted(partition_registry.get(collection))
+
+def existing_partitions(collection: str, partitions: Optional[List[str]]) -> Optional[List[str]]:
+    '''drop partitions not in the collection, None means all partitions'''
+    if partitions is None:
+        return None
+    existing = partition_registry.get(collection)
+    return [partition for partition in partitions if partition in existing]
 
 def is_partition_exist(collection:str, partition_name: str):
-    with getClient() as client:
-        result = client.has_partition(
-            collection_name=collection,
-            partition_name=partition_name
-        )
-
-    return result
+    return partition_name in partition_registry.get(collection)
     
 def create_partition(collection:str,  new_partition_name: str):
     if is_partition_exist(collection, new_partition_name):
         return
     
-    with getClient() as client:
-        client.create_partition(
-            collection_name = collection,
-            partition_name = new_partition_name
-        )
+    with partition_registry.lock:
+        # other thread may create it while waiting for the lock
+        if is_partition_exist(collection, new_partition_name):
+            return
+
+        get_backend().create_partition(collection, new_partition_name)
+        partition_registry.add(collection, new_partition_name)
+
+def current_models() -> Dict[str, str]:
+    '''{dense field: id of the model new vectors are embedded with}'''
+    return {FIELD_TEXT_DENSE: text_embed.MODEL_ID, FIELD_IMAGE_DENSE: clip_embed.MODEL_ID}
+
+def model_filter(field: str, model: str) -> str:
+    return f"{MODEL_FIELDS[field]} == {json.dumps(model)}"
+
+def detect_models(collection: str, field: str, batch_size: int = LIST_BATCH_SIZE) -> List[str]:
+    '''models of the vectors stored in a dense field, the current model first'''
+    models = [current_models()[field]]
+    while True:
+        # one query per model found, each excluding the models already known
+        filter = " and ".join([present(field)] + [f"{MODEL_FIELDS[field]} != {json.dumps(model)}" for model in models])
+        batches = get_backend().iterate(collection, None, [FIELD_ID, MODEL_FIELDS[field]], batch_size, filter)
+        batch = next(batches, [])
+        batches.close()
+        if len(batch) == 0:
+            return models
+        models += sorted({row[MODEL_FIELDS[field]] for row in batch})
+
+class ModelVersions:
+    '''
+    In-process cache of the models stored in each dense field of a collection, see `detect_models`.
+    A field holds more than one model while `reembed_rows` migrates it to the current model,
+    searches of the field then embed the query with each model and search the rows of each model apart.
+    `invalidate` it when a migration completes or the collection is recreated.
+    '''
+    def __init__(self):
+        self.models: Dict[str, Dict[str, List[str]]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, collection: str, field: str) -> List[str]:
+        with self.lock:
+            if collection not in self.models:
+                self.models[collection] = {field: detect_models(collection, field) for field in DENSE_FIELDS}
+            return self.models[collection][field]
+
+    def invalidate(self, collection: Optional[str] = None):
+        with self.lock:
+            if collection is None:
+                self.models.clear()
+            else:
+                self.models.pop(collection, None)
+
+model_versions = ModelVersions()
+
+def legacy_models(collection: str) -> Dict[str, List[str]]:
+    '''{dense field: models other than the current one still stored}, re-detected from the collection'''
+    model_versions.invalidate(collection)
+    return {field: model_versions.get(collection, field)[1:] for field in DENSE_FIELDS
+            if len(model_versions.get(collection, field)) > 1}
 
 def create_embed_db(collection: str):
-    schema = MilvusClient.create_schema(auto_id=False)
-
-    cn_analyzer_params = {
-        "tokenizer": "jieba",
-        "filter": [
-            "cnalphanumonly",
-            "lowercase",
-            {
-                "type": "stemmer",
-                "language": "english"
-            },
-            {
-                "type": "stop", # Specifies the filter type as stop
-                "stop_words": ["_english_"], # Defines custom stop words and includes the English stop word list
-            }
-        ]
-    }
-
-    schema.add_field(field_name=FIELD_ID, datatype=DataType.INT64, is_primary=True, description="product id")
-    
-    schema.add_field(field_name=FIELD_TEXT, datatype=DataType.VARCHAR, max_length=2048, enable_analyzer=True,
-                      description="raw text of product description")
-    
-    schema.add_field(field_name=FIELD_TEXT_DENSE, datatype=DataType.FLOAT_VECTOR, dim=TEXT_FEATURE_DIM, description="text dense embedding")
-    
-    schema.add_field(field_name=FIELD_TEXT_SPARSE, datatype=DataType.SPARSE_FLOAT_VECTOR, 
-                     description="text sparse embedding auto-generated by the built-in BM25 function")
-
-    schema.add_field(field_name=FIELD_IMAGE_DENSE, datatype=DataType.FLOAT_VECTOR, dim=IMAGE_FEATURE_DIM, description="image dense embedding")
-
-    schema.add_field(field_name=FIELD_CN_TEXT, datatype=DataType.VARCHAR, max_length=2048, enable_analyzer=True, analyzer_params=cn_analyzer_params, 
-                      description="raw text of product description for chinese analyzer")
-        
-    schema.add_field(field_name=FIELD_CN_TEXT_SPARSE, datatype=DataType.SPARSE_FLOAT_VECTOR, 
-                     description="text sparse embedding auto-generated by the built-in BM25 function for chinese tokens")
-
-    bm25_function = Function(
-        name="text_bm25_emb",
-        input_field_names=[FIELD_TEXT],
-        output_field_names=[FIELD_TEXT_SPARSE],
-        function_type=FunctionType.BM25,
-    )
-    schema.add_function(bm25_function)
-
-    cn_bm25_function = Function(
-        name="cm_text_bm25_emb",
-        input_field_names=[FIELD_CN_TEXT],
-        output_field_names=[FIELD_CN_TEXT_SPARSE],
-        function_type=FunctionType.BM25,
-    )
-    schema.add_function(cn_bm25_function)
+    '''create an empty collection, drop the existing one'''
+    get_backend().create_collection(collection)
+    partition_registry.invalidate(collection)
+    model_versions.invalidate(collection)
+    write_generations.bump(collection)
 
-    with getClient() as client:
-        index_params = client.prepare_index_params()
-
-        index_params.add_index(
-            field_name=FIELD_TEXT_DENSE,
-            index_name=FIELD_TEXT_DENSE + "_index",
-            index_type="AUTOINDEX",
-            metric_type="IP"
-        )
-
-        index_params.add_index(
-            field_name=FIELD_TEXT_SPARSE,
-            index_name=FIELD_TEXT_SPARSE + "_index",
-            index_type="SPARSE_INVERTED_INDEX",
-            metric_type="BM25",
-            params={"inverted_index_algo": "DAAT_MAXSCORE"}, # or "DAAT_WAND" or "TAAT_NAIVE"
-        )
-        index_params.add_index(
-            field_name=FIELD_CN_TEXT_SPARSE,
-            index_name=FIELD_CN_TEXT_SPARSE + "_index",
-            index_type="SPARSE_INVERTED_INDEX",
-            metric_type="BM25",
-            params={"inverted_index_algo": "DAAT_MAXSCORE"}, # or "DAAT_WAND" or "TAAT_NAIVE"
-        )
-
-        index_params.add_index(
-            field_name=FIELD_IMAGE_DENSE,
-            index_name=FIELD_IMAGE_DENSE + "_index",
-            index_type="AUTOINDEX",
-            metric_type="IP"
-        )
-
-        if client.has_collection(collection_name=collection):
-            client.drop_collection(collection_name=collection)
-
-        client.create_collection(
-            collection_name=collection,
-            schema=schema,
-            index_params=index_params
-        )
+def rebuild_indexes(collection: str):
+    '''apply `VECTOR_INDEX_CONFIG` to an existing collection, it is released while the indexes are built'''
+    get_backend().rebuild_indexes(collection)
 
 def delete_empty_data(collection: str):
-    connections.connect(alias="default", host=milvus_host, port=mulvus_port)
-
-    # Step 2: Load the collection
-    collection = Collection(collection)
-    collection.load()
-    results = collection.query(
-        expr="",  # empty expr returns all data
-        output_fields=[FIELD_ID, FIELD_TEXT],  # list all text fields you want to extract
-        limit=100
-    )
-
-    ids = [result[FIELD_ID] for result in results if len(result[FIELD_TEXT]) == 0]
-    if len(ids) == 0:
-        return
-    
-    with getClient() as client:
-        res = client.delete(
-            collection_name=collection,
-            # highlight-next-line
-            ids=ids
-        )
+    '''delete rows without caption'''
+    for batch in iter_data(collection, output_fields=[FIELD_ID], filter=f'{FIELD_TEXT} == ""'):
+        delete_by_list(collection, [row[FIELD_ID] for row in batch])
 
 
+def present(field: str) -> str:
+    '''filter of rows having an embedding in the dense `field`'''
+    return f"{PRESENCE_FIELDS[field]} == true"
 
-def query(collection: str, partitions:Optional[List[str]] ,top_k:int = 10, query_text: str = "", query_text_embed = None, query_clip_text_embed =  None, query_clip_image_embed =  None, 
+def dense_requests(field: str, query_embed, top_k: int) -> List[SearchRequest]:
+    '''
+    `query_embed` is an embedding of the current model, or {model id: embedding} while `field` holds
+    more than one model, then one request per model searches only the rows embedded with it
+    '''
+    embeds = query_embed.items() if isinstance(query_embed, dict) else [(None, query_embed)]
+    return [SearchRequest(
+        data=embed,
+        anns_field=field,
+        param=search_params(field, top_k),
+        limit=top_k,
+        filter=present(field) if model is None else f"{present(field)} and {model_filter(field, model)}"
+    ) for model, embed in embeds]
+
+def search_requests(top_k:int = 10, query_text: str = "", query_text_embed = None, query_clip_text_embed =  None, query_clip_image_embed =  None, 
                   use_text_embed = True, use_bm25 = True, use_joint_embed = True, use_image_embed = False
-                  ):
+                  ) -> List[SearchRequest]:
     '''
     - use_text_embed : text2vector
     - use_bm25 : BM25 exact match
     - use_joint_embed : given clip text embedding query image embedding in dataset
     - use_image_embed : given image embedding query image embedding in dataset
+
+    dense embeddings are given as accepted by `dense_requests`
+    each sub search returns `top_k` candidates before fusion
     '''
 
     reqs = []
-    weight = []
 
     if use_text_embed and query_text_embed is not None:
-        search_param = {
-            "data": [query_text_embed],
-            "anns_field": FIELD_TEXT_DENSE,
-            "param": {"nprobe": 10},
-            "limit": 10
-        }
-        req = AnnSearchRequest(**search_param)
-        reqs.append(req)
-        weight.append(1.0)
+        reqs += dense_requests(FIELD_TEXT_DENSE, query_text_embed, top_k)
 
     if use_bm25:
-        search_param = {
-            "data": [query_text],
-            "anns_field": FIELD_TEXT_SPARSE,
-            "param": {"drop_ratio_search": 0.0},
-            "limit": 10
-        }
-        req1 = AnnSearchRequest(**search_param)
-
-        search_param = {
-            "data": [query_text],
-            "anns_field": FIELD_CN_TEXT_SPARSE,
-            "param": {"drop_ratio_search": 0.0},
-            "limit": 10
-        }
-        req2 = AnnSearchRequest(**search_param)
-
-        reqs += [req1, req2]
-        weight += [1.0, 1.0]
+        for anns_field in bm25_fields(query_text):
+            reqs.append(SearchRequest(
+                data=query_text,
+                anns_field=anns_field,
+                param={"drop_ratio_search": 0.0},
+                limit=top_k
+            ))
 
     if use_joint_embed and query_clip_text_embed is not None:
         # query joint embedding
-        search_param = {
-            "data": [query_clip_text_embed],
-            "anns_field": FIELD_IMAGE_DENSE,
-            "param": {"nprobe": 10},
-            "limit": 10
-        }
-        req = AnnSearchRequest(**search_param)
-        reqs.append(req)
-        weight.append(1.0)
+        reqs += dense_requests(FIELD_IMAGE_DENSE, query_clip_text_embed, top_k)
 
     if use_image_embed and query_clip_image_embed is not None:
         # query joint embedding
-        search_param = {
-            "data": [query_clip_image_embed],
-            "anns_field": FIELD_IMAGE_DENSE,
-            "param": {"nprobe": 10},
-            "limit": 10
-        }
-        req = AnnSearchRequest(**search_param)
-        reqs.append(req)
-        weight.append(1.0)
+        reqs += dense_requests(FIELD_IMAGE_DENSE, query_clip_image_embed, top_k)
 
+    return reqs
+
+def query(collection: str, partitions:Optional[List[str]] ,top_k:int = 10, query_text: str = "", query_text_embed = None, query_clip_text_embed =  None, query_clip_image_embed =  None, 
+                  use_text_embed = True, use_bm25 = True, use_joint_embed = True, use_image_embed = False
+                  ):
+    '''hybrid search, see `search_requests`'''
+    reqs = search_requests(top_k, query_text, query_text_embed, query_clip_text_embed, query_clip_image_embed,
+                           use_text_embed, use_bm25, use_joint_embed, use_image_embed)
     if len(reqs) == 0:
         return []
-    
-    with getClient() as client:
-        ranker = RRFRanker(60)
-        res = client.hybrid_search(
-            collection_name=collection,
-            partition_names=partitions,
-            reqs=reqs,
-            ranker=ranker,
-            output_fields=[],
-            limit=top_k
-        )[0]
-
-    return [{FIELD_ID: hit[FIELD_ID], "distance": hit["distance"]} 
-            for hit in res]
 
-def insert_one(collection: str, partition:str, id = None, text= None, text_dense= None, image_dense= None) -> bool:
+    partitions = existing_partitions(collection, partitions)
+    if partitions is not None and len(partitions) == 0:
+        # searching a partition never inserted returns nothing, skip the request
+        return []
     
+    return get_backend().hybrid_search(collection, partitions, reqs, top_k)
 
-    if is_partition_exist(collection, partition) == False:
-        create_partition(collection, partition)
+async def query_async(collection: str, partitions:Optional[List[str]] ,top_k:int = 10, query_text: str = "", query_text_embed = None, query_clip_text_embed =  None, query_clip_image_embed =  None, 
+                  use_text_embed = True, use_bm25 = True, use_joint_embed = True, use_image_embed = False
+                  ):
+    '''`query` without blocking the event loop on the vector db'''
+    reqs = search_requests(top_k, query_text, query_text_embed, query_clip_text_embed, query_clip_image_embed,
+                           use_text_embed, use_bm25, use_joint_embed, use_image_embed)
+    if len(reqs) == 0:
+        return []
 
-    if id is None:
-        return False
+    # the partition registry lists the partitions from the vector db on a miss
+    partitions = await asyncio.to_thread(existing_partitions, collection, partitions)
+    if partitions is not None and len(partitions) == 0:
+        return []
+
+    return await get_backend().hybrid_search_async(collection, partitions, reqs, top_k)
+
+def make_row(id = None, text = None, text_dense = None, image_dense = None, partition: str = DEFAULT_PARTITION,
+             text_model: Optional[str] = None, image_model: Optional[str] = None) -> dict:
+    '''
+    build one row for `insert_many`, missing fields are filled with empty values.
+    A missing embedding is stored as zeros with its presence flag unset, so searches of that field skip the row.
+    The models of the embeddings default to the current ones.
+    '''
     if text is None:
         text = ""
+
+    has_text = text_dense is not None
+    has_image = image_dense is not None
+    models = current_models()
+    text_model = (text_model or models[FIELD_TEXT_DENSE]) if has_text else ""
+    image_model = (image_model or models[FIELD_IMAGE_DENSE]) if has_image else ""
     if text_dense is None:
         text_dense = np.zeros(TEXT_FEATURE_DIM).tolist()
     if image_dense is None:
         image_dense = np.zeros(IMAGE_FEATURE_DIM).tolist()
 
-    data=[
-        {
-            FIELD_ID: id,
-            FIELD_TEXT: text,
-            FIELD_CN_TEXT: text,
-            FIELD_TEXT_DENSE: text_dense,
-            FIELD_IMAGE_DENSE: image_dense
-        }
-    ]
+    return {
+        FIELD_ID: id,
+        FIELD_TEXT: text,
+        FIELD_CN_TEXT: cn_text_of(text),
+        FIELD_TEXT_DENSE: text_dense,
+        FIELD_IMAGE_DENSE: image_dense,
+        FIELD_HAS_TEXT: has_text,
+        FIELD_HAS_IMAGE: has_image,
+        FIELD_TEXT_MODEL: text_model,
+        FIELD_IMAGE_MODEL: image_model,
+        FIELD_PARTITION: partition
+    }
 
-    try:
-        with getClient() as client:
-            res = client.upsert(
-                collection_name=collection,
-                partition_name=partition,
-                data=data
-            )
-        return True
-    except Exception as e:
-        print(e)
+def insert_many(collection: str, rows: List[dict]) -> List[bool]:
+    '''
+    upsert rows built by `make_row`, one upsert call per partition
+    return success flag of each row in the same order
+    '''
+    results = [False] * len(rows)
+
+    # group row index by partition
+    partitions: Dict[str, List[int]] = {}
+    for idx, row in enumerate(rows):
+        if row.get(FIELD_ID) is None:
+            continue
+        partitions.setdefault(row.get(FIELD_PARTITION, DEFAULT_PARTITION), []).append(idx)
+
+    for partition, indices in partitions.items():
+        try:
+            if is_partition_exist(collection, partition) == False:
+                create_partition(collection, partition)
+
+            data = [{k: v for k, v in rows[idx].items() if k != FIELD_PARTITION} for idx in indices]
+            get_backend().upsert(collection, partition, data)
+            write_generations.bump(collection, [partition])
+        except Exception as e:
+            print(e)
+            # the partition may be dropped outside this process
+            partition_registry.invalidate(collection)
+            continue
+
+        for idx in indices:
+            results[idx] = True
+
+    return results
+
+def insert_one(collection: str, partition:str, id = None, text= None, text_dense= None, image_dense= None) -> bool:
+    if id is None:
         return False
 
+    return insert_many(collection, [make_row(id, text, text_dense, image_dense, partition)])[0]
+
 def delete_by_list(collection: str, ids: List[int]):
     
     if len(ids) == 0:
         return True
     
     try:
-        with getClient() as client:
-            res = client.delete(
-                collection_name=collection,
-                ids=ids
-            )
+        get_backend().delete(collection, ids)
+        write_generations.bump(collection)
+        return True
+    except Exception as e:
+        print(e)
+        return False
+
+def drop_partition(collection: str, partition: str) -> bool:
+    '''delete all rows of a partition by dropping it, much faster than deleting by ids'''
+    if partition == DEFAULT_PARTITION:
+        # default partition cannot be dropped
+        return delete_by_filter(collection, "", [partition])
+
+    if is_partition_exist(collection, partition) == False:
+        return True
+
+    try:
+        with partition_registry.lock:
+            get_backend().drop_partition(collection, partition)
+            partition_registry.remove(collection, partition)
+            write_generations.bump(collection, [partition])
+        return True
+    except Exception as e:
+        print(e)
+        partition_registry.invalidate(collection)
+        return False
+
+def delete_by_filter(collection: str, filter: str, partitions: Optional[List[str]] = None) -> bool:
+    try:
+        for batch in iter_data(collection, partitions, output_fields=[FIELD_ID], filter=filter):
+            if delete_by_list(collection, [row[FIELD_ID] for row in batch]) == False:
+                return False
+        return True
+    except Exception as e:
+        print(e)
+        return False
+
+def truncate_collection(collection: str) -> bool:
+    '''delete all rows by recreating the collection'''
+    try:
+        create_embed_db(collection)
         return True
     except Exception as e:
         print(e)
         return False
 
+def migrate_collection(collection: str, batch_size: int = LIST_BATCH_SIZE) -> bool:
+    '''
+    copy the rows into a new collection created with the current settings (`VECTOR_DTYPE`, `VECTOR_INDEX_CONFIG`,
+    text analyzers) and swap it in. Writes to the collection during the migration are lost, stop the watcher first.
+    The old collection is renamed aside and dropped once the new one is in place, failures are logged.
+    '''
+    backend = get_backend()
+    target = collection + "_migration"
+    previous = collection + "_previous"
+    if backend.has_collection(previous):
+        logger.error("Cannot migrate %s, %s is left by an earlier migration", collection, previous)
+        return False
+
+    try:
+        fields = [field for field in backend.fields(collection) if field in STORED_FIELDS]
+        backend.create_collection(target)
+        for partition in backend.list_partitions(collection):
+            if partition != DEFAULT_PARTITION:
+                backend.create_partition(target, partition)
+            for batch in backend.iterate(collection, [partition], fields, batch_size):
+                for row in batch:
+                    row[FIELD_CN_TEXT] = cn_text_of(row[FIELD_TEXT])
+                    for field, flag in PRESENCE_FIELDS.items():
+                        # collections created before the presence flags
+                        row.setdefault(flag, bool(np.any(row[field])))
+                    for field, model_field in MODEL_FIELDS.items():
+                        # collections created before the model fields
+                        row.setdefault(model_field, LEGACY_MODELS[field] if row[PRESENCE_FIELDS[field]] else "")
+                backend.upsert(target, partition, batch)
+        backend.rename_collection(collection, previous)
+    except Exception:
+        logger.exception("Cannot migrate %s", collection)
+        backend.drop_collection(target)
+        return False
+
+    try:
+        try:
+            backend.rename_collection(target, collection)
+        except Exception:
+            logger.exception("Cannot swap in the migrated %s, restoring it", collection)
+            try:
+                backend.rename_collection(previous, collection)
+                backend.drop_collection(target)
+            except Exception:
+                logger.exception("Cannot restore %s, its rows are kept in %s and %s", collection, previous, target)
+            return False
+
+        try:
+            backend.drop_collection(previous)
+        except Exception:
+            logger.exception("Cannot drop %s after the migration", previous)
+        return True
+    finally:
+        partition_registry.invalidate(collection)
+        model_versions.invalidate(collection)
+        write_generations.bump(collection)
+
+def is_schema_current(collection: str) -> bool:
+    '''
+    the collection has all `STORED_FIELDS`, otherwise inserts fail until `migrate_collection`,
+    and the text analyzers of new collections, otherwise english captions are not stemmed
+    '''
+    backend = get_backend()
+    return set(STORED_FIELDS) <= set(backend.fields(collection)) and backend.analyzers_current(collection)
+
 def delete_one(collection: str, id):
     return delete_by_list(collection, [id])
 
     
-def list_data(collection: str, partitions: Optional[List[str]] = None):
-    '''return { id : text, ...}'''
+def iter_data(collection: str, partitions: Optional[List[str]] = None, output_fields: Optional[List[str]] = None, 
+              batch_size: int = LIST_BATCH_SIZE, filter: str = "") -> Iterator[List[dict]]:
+    '''
+    yield all rows matching `filter` in batches of `batch_size` with a query iterator,
+    memory is bounded by the batch size.
+    '''
+    if output_fields is None:
+        output_fields = [FIELD_ID, FIELD_TEXT]
 
-    with getClient() as client:
-        results = client.query(
-            collection_name=collection,  # empty expr returns all data
-            filter="",  # empty expr returns all data
-            output_fields=[FIELD_ID, FIELD_TEXT],  # list all text fields you want to extract
-            limit=100,
-            partition_names=partitions
-        )
+    partitions = existing_partitions(collection, partitions)
+    if partitions is not None and len(partitions) == 0:
+        return
 
-    return {tag[FIELD_ID]: tag[FIELD_TEXT] for tag in results} 
-            
+    yield from get_backend().iterate(collection, partitions, output_fields, batch_size, filter)
 
-def get_images_by_ids(collection: str, ids: List[int]):
+def list_data(collection: str, partitions: Optional[List[str]] = None):
     '''return { id : text, ...}'''
+    return {tag[FIELD_ID]: tag[FIELD_TEXT] for batch in iter_data(collection, partitions) for tag in batch}
+            
 
-    with getClient() as client:
-        results = client.query(
-            collection_name=collection,
-            ids=ids,
-            output_fields=[FIELD_ID, FIELD_TEXT])
-        
-    return {tag[FIELD_ID]: tag[FIELD_TEXT] for tag in results} 
-
-def dump_json_data(collection: str, output_path: str = "data.json"):
-    connections.connect(alias="default", host=milvus_host, port=mulvus_port)
-
-    collection = Collection(COLLECTION_NAME)
-    collection.load()
-
-    # Replace 'text_field' with the actual name of the field storing text
-    results = collection.query(
-        expr="",  # empty expr returns all data
-        output_fields=[FIELD_ID, FIELD_TEXT],  # list all text fields you want to extract
-        limit=100
+def near_duplicate_pairs(collection: str, partitions: Optional[List[str]], after_id: int, threshold: float,
+                         neighbors: int = 10, batch_size: int = 64,
+                         updated_ids: Optional[List[int]] = None) -> Iterator[Tuple[int, List[Tuple[int, int, float]]]]:
+    '''
+    probe images in `updated_ids` then images with id > `after_id` in batches,
+    yield (largest probed id > `after_id` or `after_id`, [(id, id, cosine similarity), ...]) of each batch.
+    Candidates are the top `neighbors` by inner product, CLIP embeddings are not normalized so they are rescored by cosine.
+    Images are only compared with images embedded by the same model.
+    '''
+    # larger updated ids are probed with the new images
+    probed = sorted(id for id in updated_ids or [] if id <= after_id)
+    filters = [f"{FIELD_ID} in {probed}"] if len(probed) != 0 else []
+    filters.append(f"{FIELD_ID} > {after_id}")
+    backend = get_backend()
+    batches = chain.from_iterable(
+        iter_data(collection, partitions, [FIELD_ID, FIELD_IMAGE_DENSE, FIELD_IMAGE_MODEL], batch_size,
+                  f"{filter} and {present(FIELD_IMAGE_DENSE)}")
+        for filter in filters
     )
+    for batch in batches:
+        vectors = np.array([row[FIELD_IMAGE_DENSE] for row in batch], dtype=np.float32)
+        hits = [None] * len(batch)
+        for model in {row[FIELD_IMAGE_MODEL] for row in batch}:
+            indices = [idx for idx, row in enumerate(batch) if row[FIELD_IMAGE_MODEL] == model]
+            results = backend.search(collection, existing_partitions(collection, partitions), FIELD_IMAGE_DENSE, vectors[indices].tolist(),
+                                     neighbors + 1, search_params(FIELD_IMAGE_DENSE, neighbors + 1),
+                                     f"{present(FIELD_IMAGE_DENSE)} and {model_filter(FIELD_IMAGE_DENSE, model)}", [FIELD_IMAGE_DENSE])
+            for idx, candidates in zip(indices, results):
+                hits[idx] = candidates
+
+        pairs = {}
+        for row, vector, candidates in zip(batch, vectors, hits):
+            candidates = [hit for hit in candidates if hit[FIELD_ID] != row[FIELD_ID]]
+            if len(candidates) == 0:
+                continue
+            others = np.array([hit[FIELD_IMAGE_DENSE] for hit in candidates], dtype=np.float32)
+            similarity = others @ vector / (np.linalg.norm(others, axis=1) * np.linalg.norm(vector) + 1e-12)
+            for hit, score in zip(candidates, similarity):
+                if score >= threshold:
+                    # both images of a pair may be probed in the same batch
+                    pairs[(min(row[FIELD_ID], hit[FIELD_ID]), max(row[FIELD_ID], hit[FIELD_ID]))] = float(score)
+
+        yield max(after_id, max(row[FIELD_ID] for row in batch)), [(a, b, score) for (a, b), score in pairs.items()]
 
-    print(len(results))
-    r = {result[FIELD_ID]: result[FIELD_TEXT] for result in results}
-    
-    with open(output_path, "w") as f:
-        json.dump(r, f, indent=4)  # optional: indent for readability
+def get_images_by_ids(collection: str, ids: List[int]):
+    '''return { id : text, ...}'''
 
-def insert_json_data(file_path: str = "data.json"):
-    import requests
-    with open(file_path, "r") as f:
-        data = json.load(f)
+    results = get_backend().get(collection, ids, [FIELD_ID, FIELD_TEXT])
         
-    for k, v in data.items():
-        print(k)
-        requests.post('http://127.0.0.1:5000/insert', data = {FIELD_ID : k})
+    return {tag[FIELD_ID]: tag[FIELD_TEXT] for tag in results} 
 
 def change_partition(collection: str, id: int, new_partition: str):
     '''
     change partition of a given id
     '''
     try:
-        with getClient() as client:
-            image = client.get(
-                collection_name=collection,
-                ids=id,
-                output_fields=[FIELD_ID, FIELD_TEXT, FIELD_TEXT_DENSE, FIELD_IMAGE_DENSE]
-            )[0]
+        image = get_backend().get(collection, [id], STORED_FIELDS)[0]
+
+        # make sure the target partition exists before removing the row
+        create_partition(collection, new_partition)
 
         if delete_one(collection, id) == False:
             print(f"Error deleting image {id}  during partition change")
             return False
         
-        if insert_one(collection, new_partition, id, image[FIELD_TEXT], image[FIELD_TEXT_DENSE], image[FIELD_IMAGE_DENSE]) == False:
+        text_dense = image[FIELD_TEXT_DENSE] if image[FIELD_HAS_TEXT] else None
+        image_dense = image[FIELD_IMAGE_DENSE] if image[FIELD_HAS_IMAGE] else None
+        row = make_row(id, image[FIELD_TEXT], text_dense, image_dense, new_partition, image[FIELD_TEXT_MODEL], image[FIELD_IMAGE_MODEL])
+        if insert_many(collection, [row])[0] == False:
             print(f"Error inserting image {id} to partition {new_partition} during partition change")
             return False
         
@@ -418,35 +563,380 @@ def change_partition(collection: str, id: int, new_partition: str):
         return False
 
 
-def insert_image(collection: str, id: int, filename:str, image: ImageFile, partition_id: Optional[int] = None, use_cache: bool = True) -> bool:
+class CaptionedImage:
+    '''an image captioned by `caption_content`, waiting for `embed_captioned`'''
+    def __init__(self, id: int, digest: str, partition: str, text: str, stored: Optional[StoredContent], models: Dict[str, str],
+                 text_features, image_features, image_future: Optional[Future]):
+        self.id = id
+        self.digest = digest
+        self.partition = partition
+        self.text = text
+        self.stored = stored
+        self.models = models
+        self.text_features = text_features
+        self.image_features = image_features
+        self.image_future = image_future
+
+def caption_content(id: int, digest: str, image_format: str, read_data: Callable[[], bytes],
+                    submit_image: Callable[[], Future], partition_id: Optional[int] = None, use_cache: bool = True,
+                    filename: Optional[str] = None) -> CaptionedImage:
+    '''
+    caption an image and submit its embedding, the rest is done by `embed_captioned`.
+    The caption and the vectors of the current models are taken from `content_store` by the hash of the file,
+    only the missing ones are computed. `use_cache=False` captions the image again.
+    `filename` finds captions cached by file name, see `genai_api.explainImage`.
+    '''
+    models = current_models()
+    stored = content_store.get(digest)
+    def stored_vector(field: str):
+        if stored is None or stored.vectors[field] is None or stored.models[field] != models[field]:
+            return None
+        return stored.vectors[field].tolist()
+
+    # embedded in a batch with the images of other threads while the caption is generated
+    image_features = stored_vector(FIELD_IMAGE_DENSE)
+    image_future = submit_image() if image_features is None else None
+
+    if use_cache and stored is not None and stored.text != "":
+        text = stored.text
+    else:
+        # keyed by the hash too, images of different folders may share a file name
+        text = genai_api.explainImage(digest, image_format, BytesIO(read_data()), use_cache, filename)
+
+    text_features = stored_vector(FIELD_TEXT_DENSE) if stored is not None and stored.text == text else None
+    partition = str(partition_id) if partition_id is not None else DEFAULT_PARTITION
+    return CaptionedImage(id, digest, partition, text, stored, models, text_features, image_features, image_future)
+
+def embed_captioned(images: List[Optional[CaptionedImage]]) -> List[dict]:
+    '''
+    embed the captions of `images` in one batch, wait for their image embeddings and store the results
+    in `content_store`. return a row for `insert_many` of each image, an empty row for None or a failed image
+    '''
+    # captioning failed, do not index the embedding of an empty text
+    missing = [image for image in images if image is not None and image.text_features is None and image.text != ""]
+    if len(missing) != 0:
+        for image, vector in zip(missing, text_embed.get_text_embed_docs([image.text for image in missing])):
+            image.text_features = vector.tolist()
+
+    rows = []
+    for image in images:
+        if image is None:
+            rows.append(make_row(None))
+            continue
+        try:
+            if image.image_future is not None:
+                image.image_features = image.image_future.result()
+        except Exception as e:
+            print(e)
+            rows.append(make_row(None))
+            continue
+
+        stored = image.stored
+        computed = image.image_future is not None or image in missing or stored.text != image.text
+        # a failed caption does not replace a stored one
+        if computed and (stored is None or image.text != ""):
+            vectors = {FIELD_TEXT_DENSE: image.text_features, FIELD_IMAGE_DENSE: image.image_features}
+            content_store.put(image.digest, StoredContent(image.text, vectors, image.models))
+        rows.append(make_row(image.id, image.text, image.text_features, image.image_features, image.partition))
+    return rows
+
+def caption_image(id: int, filename:str, image: ImageFile, partition_id: Optional[int] = None, use_cache: bool = True) -> CaptionedImage:
+    '''`caption_content` of an image, an image opened from a file is hashed and captioned as the file'''
     image_format = image.format.lower()
 
-    # Convert to BytesIO
-    buffer = BytesIO()
-    image.save(buffer, format=image_format) 
-    buffer.seek(0)  # rewind to the start of the stream
+    path = getattr(image, "filename", "")
+    if path and os.path.isfile(path):
+        with open(path, "rb") as f:
+            data = f.read()
+    else:
+        buffer = BytesIO()
+        image.save(buffer, format=image_format)
+        data = buffer.getvalue()
+
+    return caption_content(id, content_hash(data), image_format, lambda: data,
+                           lambda: clip_embed.image_embedder.submit(image), partition_id, use_cache, filename)
+
+def caption_decoded(id: int, filename: str, path: str, image: DecodedImage, partition_id: Optional[int] = None,
+                    use_cache: bool = True) -> CaptionedImage:
+    '''`caption_content` of a file decoded by `preprocess_pool`, the file is captioned as it is without encoding it again'''
+    def read_data() -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    return caption_content(id, image.digest, image.format.lower(), read_data,
+                           lambda: clip_embed.image_embedder.submit_tensor(image.tensor), partition_id, use_cache, filename)
+
+def embed_image(id: int, filename:str, image: ImageFile, partition_id: Optional[int] = None, use_cache: bool = True) -> dict:
+    '''caption and embed an image, return a row for `insert_many`'''
+    return embed_captioned([caption_image(id, filename, image, partition_id, use_cache)])[0]
+
+def embed_decoded(id: int, filename: str, path: str, image: DecodedImage, partition_id: Optional[int] = None, use_cache: bool = True) -> dict:
+    '''`embed_image` of a file decoded by `preprocess_pool`'''
+    return embed_captioned([caption_decoded(id, filename, path, image, partition_id, use_cache)])[0]
+
+def insert_decoded(collection: str, id: int, filename: str, path: str, image: DecodedImage, partition_id: Optional[int] = None,
+                   use_cache: bool = True) -> bool:
+    try:
+        row = embed_decoded(id, filename, path, image, partition_id, use_cache)
+    except Exception as e:
+        print(e)
+        return False
+    return insert_many(collection, [row])[0]
+
+def insert_image(collection: str, id: int, filename:str, image: ImageFile, partition_id: Optional[int] = None, use_cache: bool = True) -> bool:
+    return insert_images(collection, [(id, filename, image, partition_id)], use_cache)[0]
 
-    text = genai_api.explainImage(filename, image_format, buffer, use_cache)
-    text_features = text_embed.get_text_embed_doc(text)
-    image_features = clip_embed.get_image_embed(image)
+def insert_images(collection: str, images: List[Tuple[int, str, ImageFile, Optional[int]]], use_cache: bool = True) -> List[bool]:
+    '''
+    insert a batch of (id, filename, image, partition_id)
+    return success flag of each image in the same order
+    '''
+    captioned = []
+    for id, filename, image, partition_id in images:
+        try:
+            captioned.append(caption_image(id, filename, image, partition_id, use_cache))
+        except Exception as e:
+            print(e)
+            captioned.append(None)
 
-    partition = str(partition_id) if partition_id is not None else "_default"
-    successed = insert_one(collection, partition, id, text, text_features, image_features)
-    return successed
+    try:
+        rows = embed_captioned(captioned)
+    except Exception as e:
+        print(e)
+        return [False] * len(images)
+    return insert_many(collection, rows)
+
+def stale_rows(collection: str, partition: str, field: str, batch_size: int = LIST_BATCH_SIZE) -> Iterator[List[dict]]:
+    '''batches of rows of a partition whose dense `field` is embedded with another model than the current one'''
+    filter = f"{present(field)} and {MODEL_FIELDS[field]} != {json.dumps(current_models()[field])}"
+    yield from iter_data(collection, [partition], STORED_FIELDS, batch_size, filter)
+
+def reembed_rows(collection: str, partition: str, field: str, rows: List[dict],
+                 load_image: Callable[[int], Optional[ImageFile]]) -> List[bool]:
+    '''
+    embed `field` of rows read by `stale_rows` with the current model and upsert them, the caption and the
+    other embedding are kept. Text is embedded from the stored caption, images are opened by `load_image`
+    which returns None for an image not found, and closed once preprocessed.
+    Rows indexed again or deleted since they were read are left as they are and count as done.
+    return success flag of each row in the same order
+    raise ValueError if the current model does not fit the dimension of the field
+    '''
+    def embed(row: dict):
+        image = load_image(row[FIELD_ID])
+        if image is None:
+            return None
+        # the images of the rows are embedded in batches too, the file is only read by the preprocessing
+        with image:
+            return clip_embed.image_embedder.submit(image)
+
+    pending = []
+    if field == FIELD_TEXT_DENSE:
+        # the stored captions are embedded in one batch
+        pending = [vector.tolist() for vector in text_embed.get_text_embed_docs([row[FIELD_TEXT] for row in rows])]
+    else:
+        for row in rows:
+            try:
+                pending.append(embed(row))
+            except Exception as e:
+                print(e)
+                pending.append(None)
+
+    new_rows = []
+    for row, vector in zip(rows, pending):
+        try:
+            if isinstance(vector, Future):
+                vector = vector.result()
+        except Exception as e:
+            print(e)
+            vector = None
+
+        if vector is None:
+            new_rows.append(make_row(None))
+            continue
+        if len(vector) != DENSE_FIELDS[field]:
+            raise ValueError(f"{current_models()[field]} embeds {len(vector)} dimensions, {field} has {DENSE_FIELDS[field]}")
+
+        vectors = {dense: row[dense] if row[PRESENCE_FIELDS[dense]] else None for dense in DENSE_FIELDS}
+        models = {dense: row[MODEL_FIELDS[dense]] for dense in DENSE_FIELDS}
+        vectors[field] = vector
+        models[field] = current_models()[field]
+        new_rows.append(make_row(row[FIELD_ID], row[FIELD_TEXT], vectors[FIELD_TEXT_DENSE], vectors[FIELD_IMAGE_DENSE], partition,
+                                 models[FIELD_TEXT_DENSE], models[FIELD_IMAGE_DENSE]))
+
+    # the watcher may index an image again while its row is embedded, its caption and vectors are newer
+    keys = [FIELD_TEXT, *MODEL_FIELDS.values()]
+    latest = {row[FIELD_ID]: row for row in get_backend().get(collection, [row[FIELD_ID] for row in rows], [FIELD_ID, *keys])}
+    changed = [row[FIELD_ID] not in latest or any(latest[row[FIELD_ID]][key] != row[key] for key in keys) for row in rows]
+    results = insert_many(collection, [make_row(None) if skip else new_row for new_row, skip in zip(new_rows, changed)])
+    return [skip or result for skip, result in zip(changed, results)]
+
+def query_embed(collection: str, field: str, key: str, encode: Callable[[str, str], List[float]], memo_suffix: str = ""):
+    '''
+    query embedding of `key` for `dense_requests`, by each model stored in `field`.
+    `encode(key, model id)` is memoized by model id + `memo_suffix`.
+    '''
+    models = model_versions.get(collection, field)
+    embeds = {model: query_embed_memo.get(model + memo_suffix, key, lambda key, model=model: encode(key, model)) for model in models}
+    return embeds[models[0]] if len(models) == 1 else embeds
+
+async def query_embed_async(collection: str, field: str, key: str, encode: Callable[[str, str], List[float]]):
+    '''`query_embed` in worker threads, the models are encoded concurrently'''
+    models = await asyncio.to_thread(model_versions.get, collection, field)
+    vectors = await asyncio.gather(*[
+        asyncio.to_thread(query_embed_memo.get, model, key, lambda key, model=model: encode(key, model)) for model in models
+    ])
+    return vectors[0] if len(models) == 1 else dict(zip(models, vectors))
 
 def query_images_by_text(collection: str, top_k:int, text: str, use_text_embed: bool, use_bm25: bool, use_joint_embed: bool, partition_id: Optional[int] = None):
     '''return [{"id":int, "distance":float}, ...]'''
-    clip_text_features = clip_embed.get_text_embed(text)
-    text_features = text_embed.get_text_embed_query(text)
+    partitions = [str(partition_id)] if partition_id is not None else None
+
+    key = ("text", collection, normalize_text(text), use_text_embed, use_bm25, use_joint_embed, partition_id, top_k,
+           write_generations.snapshot(collection, partitions))
+    results = search_cache.get(key)
+    if results is not None:
+        return results
+
+    clip_text_features = query_embed(collection, FIELD_IMAGE_DENSE, text, clip_embed.get_text_embed)
+    text_features = query_embed(collection, FIELD_TEXT_DENSE, text, text_embed.get_text_embed_query)
     use_image_embed = False
     clip_image_features = None
 
-    partitions = [str(partition_id)] if partition_id is not None else None
     results = query(collection, partitions, top_k, text, text_features, clip_text_features, clip_image_features, 
                                 use_text_embed, use_bm25, use_joint_embed, use_image_embed )
 
+    if write_generations.settled():
+        search_cache.put(key, results)
     return results
 
+async def embed_query_text(collection: str, text: str, use_text_embed: bool, use_joint_embed: bool):
+    '''
+    return (clip text embedding, text embedding) as given by `query_embed`, None if not used.
+    The encoders run concurrently in worker threads, at most `QUERY_EMBED_CONCURRENCY` queries at once.
+    '''
+    async def none():
+        return None
+
+    async with query_embed_limiter.semaphore():
+        return await asyncio.gather(
+            query_embed_async(collection, FIELD_IMAGE_DENSE, text, clip_embed.get_text_embed) if use_joint_embed else none(),
+            query_embed_async(collection, FIELD_TEXT_DENSE, text, text_embed.get_text_embed_query) if use_text_embed else none()
+        )
+
+async def query_images_by_text_async(collection: str, top_k:int, text: str, use_text_embed: bool, use_bm25: bool, use_joint_embed: bool, partition_id: Optional[int] = None):
+    '''`query_images_by_text` for the event loop, return [{"id":int, "distance":float}, ...]'''
+    partitions = [str(partition_id)] if partition_id is not None else None
+
+    key = ("text", collection, normalize_text(text), use_text_embed, use_bm25, use_joint_embed, partition_id, top_k,
+           write_generations.snapshot(collection, partitions))
+    results = search_cache.get(key)
+    if results is not None:
+        return results
+
+    clip_text_features, text_features = await embed_query_text(collection, text, use_text_embed, use_joint_embed)
+
+    results = await query_async(collection, partitions, top_k, text, text_features, clip_text_features, None, 
+                                use_text_embed, use_bm25, use_joint_embed, False)
+
+    if write_generations.settled():
+        search_cache.put(key, results)
+    return results
+
+def query_images_by_image_id(collection: str, top_k: int, id: int, partition_id: Optional[int] = None) -> Optional[List[dict]]:
+    '''
+    images similar to a stored image, searched with its stored image embedding
+    return [{"id":int, "distance":float}, ...] without the image itself, None if the image is not found
+    '''
+    partitions = [str(partition_id)] if partition_id is not None else None
+
+    key = ("image_id", collection, id, partition_id, top_k, write_generations.snapshot(collection, partitions))
+    results = search_cache.get(key)
+    if results is not None:
+        return results
+
+    rows = get_backend().get(collection, [id], [FIELD_IMAGE_DENSE, FIELD_HAS_IMAGE, FIELD_IMAGE_MODEL])
+    if len(rows) == 0:
+        return None
+
+    results = []
+    if rows[0][FIELD_HAS_IMAGE]:
+        # only images embedded by the same model are comparable
+        image_features = rows[0][FIELD_IMAGE_DENSE]
+        if model_versions.get(collection, FIELD_IMAGE_DENSE) != [rows[0][FIELD_IMAGE_MODEL]]:
+            image_features = {rows[0][FIELD_IMAGE_MODEL]: image_features}
+        results = query(collection, partitions, top_k + 1, query_clip_image_embed=image_features,
+                        use_text_embed=False, use_bm25=False, use_joint_embed=False, use_image_embed=True)
+        results = [result for result in results if result[FIELD_ID] != id][:top_k]
+
+    if write_generations.settled():
+        search_cache.put(key, results)
+    return results
+
+def query_images_by_image(collection: str, top_k: int, data: bytes, partition_id: Optional[int] = None) -> List[dict]:
+    '''
+    images similar to an encoded image, it is decoded at the model resolution and embedded once
+    return [{"id":int, "distance":float}, ...]
+    '''
+    partitions = [str(partition_id)] if partition_id is not None else None
+    digest = hashlib.sha256(data).hexdigest()
+
+    key = ("image", collection, digest, partition_id, top_k, write_generations.snapshot(collection, partitions))
+    results = search_cache.get(key)
+    if results is not None:
+        return results
+
+    image_features = query_embed(collection, FIELD_IMAGE_DENSE, digest,
+                                 lambda _, model: clip_embed.get_image_embed(clip_embed.open_reduced(data), model), "/image")
+    results = query(collection, partitions, top_k, query_clip_image_embed=image_features,
+                    use_text_embed=False, use_bm25=False, use_joint_embed=False, use_image_embed=True)
+
+    if write_generations.settled():
+        search_cache.put(key, results)
+    return results
+
+async def query_images_page(collection: str, top_k: int, offset: int, text: str, use_text_embed: bool, use_bm25: bool, use_joint_embed: bool,
+                      partition_id: Optional[int] = None, candidate_multiplier: int = SEARCH_CANDIDATE_MULTIPLIER, cursor: Optional[str] = None):
+    '''
+    return ([{"id":int, "distance":float}, ...] of fused results [offset, offset + top_k), cursor or None if no more results)
+
+    A search fuses (offset + top_k) * candidate_multiplier candidates and keeps them under a cursor,
+    pages of the same query given the cursor are sliced from it without searching again.
+    raise CursorExpired if the cursor is expired, CursorMismatch if it was returned for another query
+    '''
+    end = offset + top_k
+    key = (collection, normalize_text(text), use_text_embed, use_bm25, use_joint_embed, partition_id)
+    pool = None
+    if cursor is not None:
+        pool = search_cursors.get(cursor)
+        if pool is None:
+            raise CursorExpired(cursor)
+        cursor_key, limit, candidates = pool
+        if cursor_key != key:
+            raise CursorMismatch(cursor)
+        if end > limit and len(candidates) == limit and limit < MAX_SEARCH_CANDIDATES:
+            # page is out of the candidate list and more results may exist
+            pool = None
+
+    if pool is None:
+        limit = min(end * candidate_multiplier, MAX_SEARCH_CANDIDATES)
+        candidates = await query_images_by_text_async(collection, limit, text, use_text_embed, use_bm25, use_joint_embed, partition_id)
+        cursor = uuid.uuid4().hex
+        search_cursors.put(cursor, (key, limit, candidates))
+
+    # a full candidate list may be cut by its limit, no page is searched past MAX_SEARCH_CANDIDATES
+    more = end < MAX_SEARCH_CANDIDATES and (len(candidates) > end or len(candidates) == limit)
+    next_cursor = cursor if more else None
+    return candidates[offset:end], next_cursor
+
+def search_cache_stats():
+    return search_cache.stats()
+
+def embed_cache_stats():
+    return query_embed_memo.stats()
+
+def content_store_stats():
+    return content_store.stats()
+
 
 
     
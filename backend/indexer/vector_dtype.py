@@ -0,0 +1,56 @@
+import os
+from typing import List, Union
+
+import numpy as np
+
+VECTOR_DTYPES = ("float32", "float16", "bfloat16")
+# storage type of the dense fields of new collections, see `vector_db.migrate_collection` for existing ones
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32").lower()
+
+if VECTOR_DTYPE not in VECTOR_DTYPES:
+    raise ValueError(f"Unknown VECTOR_DTYPE: {VECTOR_DTYPE}, expected one of {VECTOR_DTYPES}")
+
+def float_to_bfloat16_bits(vector) -> np.ndarray:
+    '''upper 16 bits of float32, rounded to nearest even'''
+    bits = np.asarray(vector, dtype=np.float32).view(np.uint32)
+    rounding = ((bits >> 16) & 1) + 0x7FFF
+    return ((bits + rounding) >> 16).astype(np.uint16)
+
+def bfloat16_bits_to_float(bits: np.ndarray) -> np.ndarray:
+    return (bits.astype(np.uint32) << 16).view(np.float32)
+
+def bfloat16_dtype():
+    try:
+        import ml_dtypes
+    except ImportError as e:
+        raise ImportError("VECTOR_DTYPE=bfloat16 requires the ml-dtypes package, install it with `uv pip install ml-dtypes`") from e
+    return ml_dtypes.bfloat16
+
+if VECTOR_DTYPE == "bfloat16":
+    bfloat16_dtype() # fail at startup rather than at the first search
+
+def encode(vector, dtype: str) -> Union[List[float], bytes]:
+    '''float vector to the value inserted to a field of `dtype`'''
+    if dtype == "float16":
+        return np.asarray(vector, dtype=np.float16).tobytes()
+    if dtype == "bfloat16":
+        return float_to_bfloat16_bits(vector).tobytes()
+    return vector.tolist() if isinstance(vector, np.ndarray) else vector
+
+def encode_query(vector, dtype: str):
+    '''float vector to the query vector of a field of `dtype`'''
+    if dtype == "float16":
+        return np.asarray(vector, dtype=np.float16)
+    if dtype == "bfloat16":
+        return np.frombuffer(float_to_bfloat16_bits(vector).tobytes(), dtype=bfloat16_dtype())
+    return vector
+
+def decode(value, dtype: str) -> List[float]:
+    '''value read from a field of `dtype` to a float vector'''
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], bytes):
+        value = value[0] # Milvus returns [bytes] for half precision vectors
+    if dtype == "float16":
+        return np.frombuffer(value, dtype=np.float16).astype(np.float32).tolist()
+    if dtype == "bfloat16":
+        return bfloat16_bits_to_float(np.frombuffer(value, dtype=np.uint16)).tolist()
+    return value
@@ -1,4 +1,4 @@
-from router import vector_db_api, file_api, sqlite_api, watcher_api, ws_router, watcher_sse
+from router import vector_db_api, file_api, sqlite_api, watcher_api, ws_router, watcher_sse, duplicates_api, reembed_api
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import signal
@@ -18,12 +18,23 @@ async def lifespan(app: FastAPI):
 
     if indexer.is_collection_exist(indexer.COLLECTION_NAME) == False:
         indexer.create_embed_db(indexer.COLLECTION_NAME)
+    elif indexer.is_schema_current(indexer.COLLECTION_NAME) == False:
+        print("Migrating vector db to the current schema")
+        indexer.migrate_collection(indexer.COLLECTION_NAME)
+    indexer.load_partitions(indexer.COLLECTION_NAME)
+    if len(indexer.legacy_models(indexer.COLLECTION_NAME)) != 0:
+        print("Re-embedding vectors of previous models")
+        reembed_api.reembed_job.start(indexer.COLLECTION_NAME)
 
     watcher.fs_watcher.start()
     signal.signal(signal.SIGINT, stop_server)
     yield
 
     watcher.fs_watcher.stop()
+    reembed_api.reembed_job.stop()
+    reembed_api.reembed_job.join()
+    indexer.preprocess_pool.close_pool()
+    await indexer.close_backend_async()
 
 origins = [
     "http://localhost:5173",   # Vite
@@ -42,6 +53,8 @@ app.include_router(sqlite_api.router)
 app.include_router(watcher_api.router)
 app.include_router(ws_router.router)
 app.include_router(watcher_sse.router)
+app.include_router(duplicates_api.router)
+app.include_router(reembed_api.router)
 
 app.add_middleware(
     CORSMiddleware,
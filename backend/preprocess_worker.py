@@ -0,0 +1,54 @@
+'''
+Code run by the worker processes of `indexer.preprocess_pool`.
+Spawned workers import the module of the functions they run, this one is outside the indexer package
+so a worker does not run `indexer/__init__`, which starts the Gemini client, opens the caption and content stores
+and imports pymilvus.
+'''
+import hashlib
+from io import BytesIO
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+def content_hash(data: bytes) -> str:
+    '''key of a file in the content store, a 128 bit BLAKE2b of its bytes'''
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# state of a worker process, set by `init_worker`
+worker_memory: Optional[SharedMemory] = None
+worker_preprocess = None
+worker_shape: Tuple[int, ...] = ()
+worker_draft_size = 0
+worker_preview_size = 0
+
+def init_worker(memory_name: str, preprocess, shape: Tuple[int, ...], draft_size: int, preview_size: int):
+    global worker_memory, worker_preprocess, worker_shape, worker_draft_size, worker_preview_size
+    torch.set_num_threads(1) # one worker per core
+    worker_memory = SharedMemory(memory_name)
+    worker_preprocess = preprocess
+    worker_shape = shape
+    worker_draft_size = draft_size
+    worker_preview_size = preview_size
+
+def decode(path: str, slot: int) -> Tuple[int, int, str, Image.Image, str]:
+    '''hash the file and decode it at a reduced scale, write the model input to `slot` of the shared memory'''
+    with open(path, "rb") as f:
+        data = f.read()
+    image = Image.open(BytesIO(data))
+    width, height, format = image.width, image.height, image.format
+    # JPEG is decoded at the smallest scale keeping the short side above `draft_size`
+    image.draft("RGB", (worker_draft_size, worker_draft_size))
+    image.load()
+
+    tensor = np.ndarray(worker_shape, dtype=np.float32, buffer=worker_memory.buf, offset=slot * tensor_bytes(worker_shape))
+    tensor[:] = worker_preprocess(image).numpy()
+
+    image.thumbnail((worker_preview_size, worker_preview_size))
+    return width, height, format, image, content_hash(data)
+
+def tensor_bytes(shape: Tuple[int, ...]) -> int:
+    '''size of a float32 tensor slot of the shared memory'''
+    return int(np.prod(shape)) * 4
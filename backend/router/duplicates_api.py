@@ -0,0 +1,154 @@
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query
+from sqlmodel import Session, delete, select
+
+import database.database
+from database.models import DuplicateImage, DuplicateScan, Image, ImageUpdate
+import indexer
+from router.vector_db_api import get_partition_id
+
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.95")) # cosine similarity of image embeddings
+DUPLICATE_NEIGHBORS = int(os.getenv("DUPLICATE_NEIGHBORS", "10")) # candidates searched per image
+
+GLOBAL_SCOPE = "global"
+
+router = APIRouter(
+    prefix="/duplicates",
+    tags=["duplicates"],
+)
+
+def scope_of(partition_id: Optional[int]) -> str:
+    return GLOBAL_SCOPE if partition_id is None else str(partition_id)
+
+def merge_pairs(session: Session, scope: str, pairs: List[Tuple[int, int, float]]):
+    '''union the clusters of each pair, the merged cluster keeps the smaller id'''
+    for a, b, similarity in pairs:
+        members = {member.image_id: member for member in session.exec(
+            select(DuplicateImage).where(DuplicateImage.scope == scope, DuplicateImage.image_id.in_([a, b]))
+        )}
+        clusters = {members[id].cluster_id if id in members else id for id in (a, b)}
+        root = min(clusters)
+
+        for member in session.exec(
+            select(DuplicateImage).where(DuplicateImage.scope == scope, DuplicateImage.cluster_id.in_(clusters))
+        ):
+            member.cluster_id = root
+            session.add(member)
+
+        for id in (a, b):
+            member = members.get(id) or DuplicateImage(scope=scope, image_id=id, cluster_id=root)
+            member.cluster_id = root
+            member.similarity = max(member.similarity, similarity)
+            session.add(member)
+        session.flush()
+
+def scan_duplicates(partition_id: Optional[int] = None, threshold: float = DUPLICATE_THRESHOLD) -> int:
+    '''
+    probe images inserted or modified since the last scan of the scope, return the number of pairs found.
+    The first scan of a scope, or a scan with another threshold, probes all images.
+    '''
+    scope = scope_of(partition_id)
+    partitions = [str(partition_id)] if partition_id is not None else None
+    found = 0
+    # images modified during the scan are probed again by the next one
+    started = datetime.now()
+
+    with Session(database.database.engine) as session:
+        state = session.get(DuplicateScan, scope)
+        if state is None or state.threshold != threshold:
+            session.exec(delete(DuplicateImage).where(DuplicateImage.scope == scope))
+            if state is not None:
+                session.delete(state)
+                session.flush()
+            state = DuplicateScan(scope=scope, threshold=threshold)
+            session.add(state)
+            session.commit()
+
+        updated = []
+        if state.last_scan is not None:
+            # a modified image keeps its id, it leaves its cluster and is probed again
+            updated = list(session.exec(select(ImageUpdate.image_id).where(ImageUpdate.updated >= state.last_scan)))
+            session.exec(delete(DuplicateImage).where(DuplicateImage.scope == scope, DuplicateImage.image_id.in_(updated)))
+            session.commit()
+
+        for last_id, pairs in indexer.near_duplicate_pairs(indexer.COLLECTION_NAME, partitions, state.last_probed_id,
+                                                           threshold, DUPLICATE_NEIGHBORS, updated_ids=updated):
+            merge_pairs(session, scope, pairs)
+            # progress is committed with the clusters, an interrupted scan resumes from here
+            state.last_probed_id = last_id
+            session.add(state)
+            session.commit()
+            found += len(pairs)
+
+        state.last_scan = started
+        session.add(state)
+        session.commit()
+    return found
+
+class DuplicateJob:
+    '''runs one scan at a time in a background thread'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.status: Dict = {"running": False}
+
+    def start(self, partition_id: Optional[int], threshold: float) -> bool:
+        '''return False if a scan is running'''
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.status = {"running": True, "scope": scope_of(partition_id), "threshold": threshold}
+            self.thread = threading.Thread(target=self.run, args=(partition_id, threshold), daemon=True)
+            self.thread.start()
+            return True
+
+    def run(self, partition_id: Optional[int], threshold: float):
+        status = dict(self.status)
+        try:
+            status["pairs"] = scan_duplicates(partition_id, threshold)
+        except Exception as e:
+            print(e)
+            status["error"] = str(e)
+        status["running"] = False
+        self.status = status
+
+    def join(self, timeout: Optional[float] = None):
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+duplicate_job = DuplicateJob()
+
+@router.post("/scan")
+def start_scan(path: Optional[str] = None, threshold: float = Query(DUPLICATE_THRESHOLD, gt=0, le=1)):
+    partition_id = get_partition_id(path)
+    if duplicate_job.start(partition_id, threshold) == False:
+        raise HTTPException(status_code=409, detail="A scan is running")
+    return duplicate_job.status
+
+@router.get("/scan")
+def scan_status():
+    return duplicate_job.status
+
+@router.get("/")
+def list_duplicates(path: Optional[str] = None):
+    '''clusters found by the scans of the scope, [{"cluster_id": int, "images": [image, ...]}, ...] largest first'''
+    scope = scope_of(get_partition_id(path))
+
+    with Session(database.database.engine) as session:
+        rows = session.exec(
+            select(DuplicateImage, Image).join(Image, Image.id == DuplicateImage.image_id).where(DuplicateImage.scope == scope)
+        ).all()
+
+    clusters: Dict[int, List[dict]] = {}
+    for member, image in rows:
+        clusters.setdefault(member.cluster_id, []).append({**dict(image), "similarity": member.similarity})
+
+    # members deleted since the scan are dropped by the join
+    results = [{"cluster_id": cluster_id, "images": sorted(images, key=lambda x: x["id"])}
+               for cluster_id, images in clusters.items() if len(images) > 1]
+    return sorted(results, key=lambda x: (-len(x["images"]), x["cluster_id"]))
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from fastapi import APIRouter, HTTPException
+from PIL import Image as ImageLoader
+
+import indexer
+from database.utils import query_images_by_id_list
+
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "32")) # rows embedded per upsert
+REEMBED_INTERVAL = float(os.getenv("REEMBED_INTERVAL", "0.5")) # seconds of sleep between batches, leaves the models to the watcher and queries
+
+router = APIRouter(
+    prefix="/reembed",
+    tags=["reembed"],
+)
+
+class ReembedJob:
+    '''
+    Re-embeds the vectors of models other than the current ones in a background thread, batch by batch.
+    Searches keep working during the migration, see `indexer.vector_db.ModelVersions`.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.status: Dict = {"running": False}
+
+    def start(self, collection: str) -> bool:
+        '''return False if a migration is running'''
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.stop_event.clear()
+            self.status = {"running": True, "models": indexer.current_models(), "legacy": indexer.legacy_models(collection),
+                           "done": 0, "failed": 0}
+            self.thread = threading.Thread(target=self.run, args=(collection,), daemon=True)
+            self.thread.start()
+            return True
+
+    def run(self, collection: str):
+        try:
+            for field in self.status["legacy"]:
+                for partition in indexer.list_partitions(collection):
+                    self.reembed(collection, partition, field)
+                    if self.stop_event.is_set():
+                        return
+        except Exception as e:
+            print(e)
+            self.status["error"] = str(e)
+        finally:
+            self.status["legacy"] = indexer.legacy_models(collection)
+            self.status["running"] = False
+
+    def reembed(self, collection: str, partition: str, field: str):
+        for rows in indexer.stale_rows(collection, partition, field, REEMBED_BATCH_SIZE):
+            paths = {image.id: image.full_path for image in query_images_by_id_list([row[indexer.FIELD_ID] for row in rows])}
+
+            def load_image(id: int):
+                # closed by `reembed_rows` once preprocessed
+                return ImageLoader.open(paths[id]) if id in paths else None
+
+            results = indexer.reembed_rows(collection, partition, field, rows, load_image)
+            self.status["done"] += sum(results)
+            self.status["failed"] += len(results) - sum(results)
+
+            if self.stop_event.wait(REEMBED_INTERVAL):
+                return
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout: Optional[float] = None):
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+reembed_job = ReembedJob()
+
+@router.post("/")
+def start_reembed():
+    if reembed_job.start(indexer.COLLECTION_NAME) == False:
+        raise HTTPException(status_code=409, detail="A migration is running")
+    return reembed_job.status
+
+@router.get("/")
+def reembed_status():
+    return reembed_job.status
+
+@router.delete("/")
+def stop_reembed():
+    '''stop after the current batch, a later start resumes with the rows not migrated'''
+    reembed_job.stop()
+    return reembed_job.status
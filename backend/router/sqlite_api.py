@@ -1,5 +1,6 @@
 import threading
 import time
+from concurrent.futures import Future
 from fastapi import APIRouter, HTTPException
 from pathlib import Path
 from os import stat_result
@@ -8,9 +9,10 @@ from sqlmodel import Session, select, text
 from typing import List, Optional
 from PIL import Image as ImageLoader
 from PIL.ImageFile import ImageFile
-from database.models import Image, Directory
+from database.models import Image, Directory, ImageUpdate
 from database.database import get_session
 from database import database
+from database.utils import forget_deleted_images, mark_images_unindexed
 
 import indexer
 
@@ -35,19 +37,15 @@ def read_images(session: Session = Depends(get_session)):
 @router.delete("/delete_all")
 def delete_all_images(session: Session = Depends(get_session)):
     session.exec(text("DELETE FROM image"))  # or session.query(Image).delete()
+    forget_deleted_images(session)
     session.commit()
     
     # Delete all images from vector db
-    while True:
-        ids = list(indexer.list_data(indexer.COLLECTION_NAME).keys())
-        if len(ids) == 0:
-            break
-        delete = indexer.delete_by_list(indexer.COLLECTION_NAME, ids)
-        if delete == False:
-            raise HTTPException(
-                status_code=500,
-                detail="Vector db delete failed"
-            )
+    if indexer.truncate_collection(indexer.COLLECTION_NAME) == False:
+        raise HTTPException(
+            status_code=500,
+            detail="Vector db delete failed"
+        )
     delete_all_thumbnails()
     return {"detail": "All images deleted"}
 
@@ -59,7 +57,17 @@ def loadImage(file: Path) -> ImageFile:
     except Exception as e:
         raise HTTPException(status_code=400, detail="Cannot open the image")
 
-def inesrt_or_update_image(file: str, session: Session):
+def decodeImage(file: Path, decoded: Optional[Future] = None) -> indexer.preprocess_pool.DecodedImage:
+    '''decode by the preprocess pool, `decoded` is the Future of a file submitted earlier'''
+    try:
+        if decoded is None:
+            decoded = indexer.preprocess_pool.get_pool().submit(file)
+        return decoded.result()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Cannot open the image")
+
+def inesrt_or_update_image(file: str, session: Session, inserter: Optional[indexer.BatchInserter] = None,
+                           decoded: Optional[Future] = None):
     file:Path = getPathOfImageFile(file)
 
     if file is None:
@@ -80,8 +88,8 @@ def inesrt_or_update_image(file: str, session: Session):
     image = session.exec(select(Image).where(Image.full_path == file.as_posix())).first()
 
     if image is None:
-        pil_image = loadImage(file)
-        thumbnail_path = create_thumbnail(pil_image, ext=file.suffix)
+        pil_image = decodeImage(file, decoded)
+        thumbnail_path = create_thumbnail(pil_image.preview, ext=file.suffix)
         image = Image(directory_id=directory.id, filename=name, 
                   width=pil_image.width, height=pil_image.height, 
                   last_modified=datetime.fromtimestamp(file_stat.st_mtime,),
@@ -95,8 +103,8 @@ def inesrt_or_update_image(file: str, session: Session):
             # file not modified
             return None
         
-        pil_image = loadImage(file)
-        thumbnail_path = create_thumbnail(pil_image, ext=file.suffix)
+        pil_image = decodeImage(file, decoded)
+        thumbnail_path = create_thumbnail(pil_image.preview, ext=file.suffix)
         image.width=pil_image.width
         image.height=pil_image.height
         image.last_modified = datetime.fromtimestamp(file_stat.st_mtime)
@@ -104,6 +112,7 @@ def inesrt_or_update_image(file: str, session: Session):
             Path(file_api.THUMBNAIL_DIR / image.thumbnail_path).unlink(missing_ok=True)
         image.thumbnail_path = thumbnail_path.name
         image.file_size = file_stat.st_size
+        session.merge(ImageUpdate(image_id=image.id, updated=datetime.now()))
 
     try:
         session.commit()
@@ -116,7 +125,24 @@ def inesrt_or_update_image(file: str, session: Session):
             detail=f"Cannot insert image: {e}"
         )
     
-    if indexer.insert_image(indexer.COLLECTION_NAME, image.id, name, pil_image, image.directory_id) == False:
+    if inserter is not None:
+        # insert with other images in batch, report the result later
+        image_id = image.id
+        try:
+            row = indexer.embed_decoded(image_id, name, file.as_posix(), pil_image, image.directory_id)
+        except Exception as e:
+            print(e)
+            mark_images_unindexed([image_id])
+            raise HTTPException(
+                status_code=500,
+                detail="Vector db insert failed"
+            )
+        future = inserter.add(indexer.COLLECTION_NAME, row)
+        future.add_done_callback(lambda f: on_image_inserted(f.result(), image_id, file))
+        return image
+
+    if indexer.insert_decoded(indexer.COLLECTION_NAME, image.id, name, file.as_posix(), pil_image, image.directory_id) == False:
+        mark_images_unindexed([image.id])
         raise HTTPException(
             status_code=500,
             detail="Vector db insert failed"
@@ -126,6 +152,14 @@ def inesrt_or_update_image(file: str, session: Session):
 
     return image
 
+def on_image_inserted(successed: bool, id: int, file: Path):
+    if successed == False:
+        print(f"Vector db insert failed: {file.as_posix()}")
+        mark_images_unindexed([id])
+        return
+    
+    watcher_sse.broadcast_event("update", {"path": file.as_posix()})
+
 
 @router.post("/create", response_model=Optional[Image])
 def create_image(file: str, session: Session = Depends(get_session)):
@@ -148,6 +182,7 @@ def delete_image(file: Path, session: Session):
         if image.thumbnail_path is not None:
             (file_api.THUMBNAIL_DIR / image.thumbnail_path).unlink(missing_ok=True)
         session.delete(image)
+        forget_deleted_images(session, [id])
         session.commit()
 
         watcher_sse.broadcast_event("delete", {"path": file.as_posix()})
@@ -1,7 +1,10 @@
-from typing import Optional
+import asyncio
+import json
+from typing import Iterator, List, Optional
 import indexer
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
 import indexer.vector_db
 from router.file_api import getFolderPath
 from database.utils import get_directory_id, query_images_by_id_list
@@ -15,18 +18,34 @@ router = APIRouter(
 
 
 @router.get('/query')
-def query_text(text: str, use_text_embed: bool, use_bm25: bool, use_joint_embed: bool, path: Optional[str] = None):
+async def query_text(response: Response, text: str, use_text_embed: bool, use_bm25: bool, use_joint_embed: bool, path: Optional[str] = None,
+               top_k: int = Query(10, ge=1, le=indexer.MAX_SEARCH_CANDIDATES),
+               offset: int = Query(0, ge=0, le=indexer.MAX_SEARCH_CANDIDATES),
+               candidate_multiplier: int = Query(indexer.SEARCH_CANDIDATE_MULTIPLIER, ge=1, le=10),
+               cursor: Optional[str] = None):
+    '''
+    return one page of results, the `X-Next-Cursor` header is set if more results exist.
+    Pass it back with the next offset to page through the same candidates without searching again.
+    '''
 
-    top_k = 10
+    # the folder is looked up in sqlite
+    partition_id = await asyncio.to_thread(get_partition_id, path)
 
-    path = getFolderPath(path)
-    partition_id = get_directory_id(path.as_posix()) if path is not None else None
-    
-    if partition_id is None and path is not None:
-        # given path is not found
-        raise HTTPException(status_code=404, detail="Path is not in database")
-    
-    results = indexer.query_images_by_text(indexer.COLLECTION_NAME, top_k, text, use_text_embed, use_bm25, use_joint_embed, partition_id )
+    try:
+        results, next_cursor = await indexer.query_images_page(indexer.COLLECTION_NAME, top_k, offset, text, use_text_embed, use_bm25, use_joint_embed,
+                                                         partition_id, candidate_multiplier, cursor)
+    except indexer.CursorExpired:
+        raise HTTPException(status_code=410, detail="Cursor expired")
+    except indexer.CursorMismatch:
+        raise HTTPException(status_code=400, detail="Cursor of another query")
+
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return await asyncio.to_thread(to_images, results)
+
+def to_images(results: List[dict]) -> List[dict]:
+    '''images of search results with their distance, best first'''
     images = query_images_by_id_list([result[indexer.vector_db.FIELD_ID] for result in results])
 
     distances = {result[indexer.vector_db.FIELD_ID]: result["distance"] for result in results}
@@ -38,20 +57,82 @@ def query_text(text: str, use_text_embed: bool, use_bm25: bool, use_joint_embed:
     
     return sorted(map(convert, images), key=lambda x: x['distance'], reverse=True)
 
-@router.get('/list')
-def query_all(path: Optional[str] = None):
-
+def get_partition_id(path: Optional[str]) -> Optional[int]:
+    '''directory id of a folder path, None for all folders'''
     path = getFolderPath(path)
     partition_id = get_directory_id(path.as_posix()) if path is not None else None
-    
+
     if partition_id is None and path is not None:
         # given path is not found
         raise HTTPException(status_code=404, detail="Path is not in database")
-    
+    return partition_id
+
+@router.get('/similar')
+def query_similar(id: int, path: Optional[str] = None, top_k: int = Query(10, ge=1, le=indexer.MAX_SEARCH_CANDIDATES - 1)):
+    '''images similar to a stored image, searched with its stored embedding'''
+    partition_id = get_partition_id(path)
+
+    results = indexer.query_images_by_image_id(indexer.COLLECTION_NAME, top_k, id, partition_id)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return to_images(results)
+
+@router.post('/query/image')
+async def query_image(file: UploadFile, path: Optional[str] = None, top_k: int = Query(10, ge=1, le=indexer.MAX_SEARCH_CANDIDATES)):
+    '''images similar to an uploaded image'''
+    partition_id = await asyncio.to_thread(get_partition_id, path)
+    data = await file.read()
+
+    try:
+        async with indexer.vector_db.query_embed_limiter.semaphore():
+            results = await asyncio.to_thread(indexer.query_images_by_image, indexer.COLLECTION_NAME, top_k, data, partition_id)
+    except OSError:
+        # not an image or truncated, UnidentifiedImageError is an OSError too
+        raise HTTPException(status_code=400, detail="Invalid image file")
+
+    return await asyncio.to_thread(to_images, results)
+
+@router.get('/query/cache')
+def query_cache_stats():
+    return indexer.search_cache_stats()
+
+@router.get('/query/embed_cache')
+def query_embed_cache_stats():
+    return indexer.embed_cache_stats()
+
+@router.get('/content_store')
+def content_store_stats():
+    return indexer.content_store_stats()
+
+@router.get('/caption_cache')
+def caption_cache_stats():
+    return indexer.genai_api.caption_cache_stats()
+
+@router.get('/caption_limiter')
+def caption_limiter_stats():
+    return indexer.genai_api.rate_limiter_stats()
+
+@router.get('/list')
+def query_all(path: Optional[str] = None):
+
+    partition_id = get_partition_id(path)
+
     partitions = [str(partition_id)] if partition_id is not None else None
-    results = indexer.list_data(indexer.COLLECTION_NAME, partitions)
+    batches = indexer.iter_data(indexer.COLLECTION_NAME, partitions)
+
+    return StreamingResponse(stream_json_object(batches), media_type="application/json")
 
-    return results
+def stream_json_object(batches: Iterator[List[dict]]):
+    '''stream { id : text, ...} one batch at a time'''
+    yield "{"
+    first = True
+    for batch in batches:
+        if len(batch) == 0:
+            continue
+        items = ",".join(f"{json.dumps(str(row[indexer.FIELD_ID]))}:{json.dumps(row[indexer.FIELD_TEXT])}" for row in batch)
+        yield items if first else "," + items
+        first = False
+    yield "}"
 
 @router.get('/text')
 def query_by_id(id: int):
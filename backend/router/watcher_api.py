@@ -1,11 +1,12 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from fastapi import APIRouter, HTTPException
 from pathlib import Path
 from fastapi import Depends
 from sqlmodel import Session, delete, select, text
 from typing import Callable, List, Optional
-from PIL import Image as ImageLoader
-from database.models import Image, Directory
+from database.models import Image, Directory, ImageUpdate
 from database.database import get_session
+from database.utils import forget_deleted_images, mark_images_unindexed
 from fastapi import WebSocket, WebSocketDisconnect
 import router.watcher_sse as watcher_sse
 
@@ -49,6 +50,8 @@ async def process_folder(path: Path,
         session.commit()
     
     images = []
+    pending = [] # [(id, image json, future of insert result), ...]
+    inserter = indexer.BatchInserter()
     files = [getPathOfImageFile(file) for file in path.iterdir()]
     files = [file for file in files if file is not None]
     total_files = len(files)
@@ -56,26 +59,57 @@ async def process_folder(path: Path,
     if progress_cb is not None:
         await progress_cb(0, total_files)
 
-    for idx, file in enumerate(files, start=1):
-        name = file.name
-
+    # unmodified files are skipped before decoding
+    changed = [] # [(file, stat, image or None), ...]
+    for file in files:
         file_stat: stat_result = file.stat()
 
         image = session.exec(select(Image).where(
             Image.directory_id == directory.id,
-            Image.filename == name)
+            Image.filename == file.name)
         ).first()
-        
+
+        if image is not None and image.last_modified is not None and image.last_modified == datetime.fromtimestamp(file_stat.st_mtime) \
+            and image.file_size is not None and image.file_size == file_stat.st_size:
+            continue # file not modified
+        changed.append((file, file_stat, image))
+
+    idx = total_files - len(changed)
+    if progress_cb is not None and idx != 0:
+        await progress_cb(idx, total_files)
+
+    # images are captioned concurrently up to the limit of the Gemini API,
+    # their captions are embedded in batches of the inserter size
+    captioner = ThreadPoolExecutor(indexer.genai_api.GENAI_CONCURRENCY)
+    captioned = [] # [(image json, future of captioned image), ...]
+    failed = []
+    def caption_result(future: Future):
+        try:
+            return future.result()
+        except Exception as e:
+            print(e)
+            return None
+
+    def embed_batch():
         try:
+            rows = indexer.embed_captioned([caption_result(future) for _, future in captioned])
+            for (image, _), row in zip(captioned, rows):
+                pending.append((image["id"], image, inserter.add(indexer.COLLECTION_NAME, row)))
+        except Exception as e:
+            print(e)
+            failed.extend(image["id"] for image, _ in captioned)
+        captioned.clear()
+
+    # the changed files are decoded ahead by the preprocess pool while the previous ones are captioned
+    decoder = indexer.preprocess_pool.get_pool()
+    for (file, file_stat, image), (_, decoded) in zip(changed, decoder.imap([file for file, _, _ in changed])):
+        idx += 1
+        name = file.name
+
+        try:
+            pil_image = decoded.result()
+            thumbnail_path = create_thumbnail(pil_image.preview, ext=file.suffix)
             if image is not None: # image already exists
-                if image.last_modified is not None and image.last_modified == datetime.fromtimestamp(file_stat.st_mtime) \
-                    and image.file_size is not None and image.file_size == file_stat.st_size:
-                    if progress_cb is not None:
-                        await progress_cb(idx, total_files)
-                    continue # file not modified
-
-                pil_image = ImageLoader.open(file)
-                thumbnail_path = create_thumbnail(pil_image, ext=file.suffix)
                 image.last_modified = datetime.fromtimestamp(file_stat.st_mtime)
                 image.width=pil_image.width
                 image.height=pil_image.height
@@ -83,10 +117,9 @@ async def process_folder(path: Path,
                     (file_api.THUMBNAIL_DIR / image.thumbnail_path).unlink(missing_ok=True)
                 image.thumbnail_path = thumbnail_path.name
                 image.file_size = file_stat.st_size
+                session.merge(ImageUpdate(image_id=image.id, updated=datetime.now()))
 
             else:
-                pil_image = ImageLoader.open(file)
-                thumbnail_path = create_thumbnail(pil_image, ext=file.suffix)
                 image = Image(directory_id=directory.id, filename=name, 
                             width=pil_image.width, height=pil_image.height, 
                             last_modified=datetime.fromtimestamp(file_stat.st_mtime),
@@ -97,13 +130,12 @@ async def process_folder(path: Path,
 
             session.commit()
             session.refresh(image)
-            if indexer.insert_image(indexer.COLLECTION_NAME, image.id, name, pil_image, image.directory_id) == False:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Cannot insert image to vector db."
-                )
-            
-            images.append(image.model_dump(mode="json"))
+
+            future = captioner.submit(indexer.caption_decoded, image.id, name, file.as_posix(), pil_image, image.directory_id)
+            captioned.append((image.model_dump(mode="json"), future))
+            if len(captioned) >= inserter.max_rows:
+                embed_batch()
+
             if progress_cb is not None:
                 await progress_cb(idx, total_files)
 
@@ -111,6 +143,20 @@ async def process_folder(path: Path,
             print(e)
             continue
 
+    embed_batch()
+    captioner.shutdown()
+    inserter.flush()
+
+    for id, image, future in pending:
+        if future.result():
+            images.append(image)
+        else:
+            failed.append(id)
+
+    if len(failed) != 0:
+        print(f"Cannot insert {len(failed)} images to vector db.")
+        mark_images_unindexed(failed)
+
     watcher.fs_watcher.add(path)
     await watcher_sse._broadcast_event("create", {"dir": path.as_posix()})
     return images
@@ -137,19 +183,30 @@ def remove_path_from_listener(path: str, delete_images: bool = False, session: S
     if directory is None:
         raise HTTPException(status_code=404, detail="Directory not found")
     
+    thumbnails = []
     try:
         directory.is_watching = False
         if delete_images:
-            indexer.delete_by_list(indexer.COLLECTION_NAME, [image.id for image in directory.images])
-            images = session.exec(select(Image).where(Image.directory_id == directory.id))
-            for image in images:
-                if image.thumbnail_path is not None:
-                    (file_api.THUMBNAIL_DIR / image.thumbnail_path).unlink(missing_ok=True)
-                session.delete(image)
+            # images of a directory are stored in the partition named by directory id
+            if indexer.drop_partition(indexer.COLLECTION_NAME, str(directory.id)) == False:
+                raise Exception("Vector db delete failed")
+            
+            thumbnails = session.exec(select(Image.thumbnail_path).where(
+                Image.directory_id == directory.id, 
+                Image.thumbnail_path != None)
+            ).all()
+            ids = session.exec(select(Image.id).where(Image.directory_id == directory.id)).all()
+            session.exec(delete(Image).where(Image.directory_id == directory.id))
+            forget_deleted_images(session, ids)
         session.commit()
     except Exception as e:
+        print(e)
+        session.rollback()
         raise HTTPException(status_code=500, detail="Cannot delete images")
 
+    for thumbnail_path in thumbnails:
+        (file_api.THUMBNAIL_DIR / thumbnail_path).unlink(missing_ok=True)
+
     if delete_images:
         watcher_sse.broadcast_event("remove", {"dir": path.as_posix()})
 
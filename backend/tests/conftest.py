@@ -47,6 +47,19 @@ def vector_db_fixture(monkeypatch):
     else:
         clear_vector_db()
 
+@pytest.fixture(name="single_client")
+def single_client_fixture(monkeypatch, db_session):
+    '''one pooled Milvus client, code holding a client while it calls the backend again times out'''
+    backend = indexer.vector_db.get_backend()
+    if not hasattr(backend, "client_pool"):
+        yield
+        return
+    from indexer.milvus_pool import MilvusClientPool
+    pool = MilvusClientPool(backend.uri, backend.token, size=1, timeout=10)
+    monkeypatch.setattr(backend, "client_pool", pool)
+    yield
+    pool.close()
+
 @pytest.fixture(name="client")  
 def client_fixture(session: Session, db_session):  
     def get_session_override():  
@@ -96,6 +109,23 @@ def fs_watcher_fixture(monkeypatch,session: Session):
     yield fs_watcher
     fs_watcher.stop()
 
+@pytest.fixture(autouse=True)
+def tmp_content_store(monkeypatch):
+    '''files seen by earlier tests or runs are captioned and embedded again'''
+    store = indexer.content_store.ContentStore(":memory:")
+    monkeypatch.setattr(indexer.vector_db, "content_store", store)
+    yield store
+    store.close()
+
+@pytest.fixture(autouse=True)
+def tmp_caption_cache(monkeypatch):
+    '''captions of data.json imported like at startup, captions of earlier tests are not reused'''
+    cache = indexer.caption_cache.CaptionCache(":memory:")
+    cache.import_json(Path(indexer.genai_api.__file__).parent / "data.json")
+    monkeypatch.setattr(indexer.genai_api, "caption_cache", cache)
+    yield cache
+    cache.close()
+
 @pytest.fixture(autouse=True)
 def tmp_thumbnail(tmp_path: Path):
     original = router.file_api.THUMBNAIL_DIR
@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeGemini:
+    '''
+    Local stand-in of the Gemini API endpoints used by `genai_api.explainImage`, for `GENAI_BASE_URL`.
+    Files are never found, uploads succeed and each generate request takes `delay` seconds.
+    Records the requests in flight at once.
+    '''
+    def __init__(self, delay: float = 0.2, caption: str = "A fake caption.", tokens: int = 300):
+        self.delay = delay
+        self.caption = caption
+        self.tokens = tokens
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.generated = 0
+
+        fake = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status: int, body: dict, headers: dict = {}):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.reply(404, {"error": {"code": 404, "message": "File not found", "status": "NOT_FOUND"}})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("X-Goog-Upload-Command") == "start":
+                    self.reply(200, {}, {"X-Goog-Upload-URL": f"{fake.url}/upload-session"})
+                elif self.path == "/upload-session":
+                    self.reply(200, {"file": {"name": "files/fake", "uri": f"{fake.url}/files/fake",
+                                              "mimeType": self.headers.get("X-Goog-Upload-Header-Content-Type"), "state": "ACTIVE"}},
+                               {"X-Goog-Upload-Status": "final"})
+                else:
+                    fake.generate()
+                    self.reply(200, {
+                        "candidates": [{"content": {"role": "model", "parts": [{"text": fake.caption}]}}],
+                        "usageMetadata": {"totalTokenCount": fake.tokens},
+                    })
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def generate(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+            self.generated += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+
+from indexer.caption_cache import CaptionCache
+
+def test_caption_cache_persistent(tmp_path: Path):
+    path = (tmp_path / "captions.db").as_posix()
+    cache = CaptionCache(path, max_size=2)
+    for i in range(5):
+        cache.put(f"{i}.jpg", f"caption {i}")
+    assert cache.stats()["memory_size"] == 2 # bounded in memory
+
+    assert cache.get("4.jpg") == "caption 4"
+    assert cache.get("0.jpg") == "caption 0" # read from disk
+    assert cache.get("missing.jpg") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"], stats["size"]) == (1, 1, 1, 5)
+    cache.close()
+
+    # kept across restarts
+    cache = CaptionCache(path)
+    assert cache.get("3.jpg") == "caption 3"
+    cache.close()
+
+def test_caption_cache_import(tmp_path: Path):
+    data = tmp_path / "data.json"
+    data.write_text(json.dumps({"a.jpg": "imported a", "b.jpg": "imported b"}))
+
+    cache = CaptionCache(":memory:")
+    cache.put("a.jpg", "generated a")
+    assert cache.import_json(data) == 1 # captions already cached are kept
+    assert cache.get("a.jpg") == "generated a"
+    assert cache.get("b.jpg") == "imported b"
+
+    # imported once
+    data.write_text(json.dumps({"c.jpg": "imported c"}))
+    assert cache.import_json(data) == 0
+    assert cache.get("c.jpg") is None
+    cache.close()
@@ -0,0 +1,105 @@
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from indexer import clip_embed
+from indexer.schema import IMAGE_FEATURE_DIM
+
+def test_batched_image_embed():
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)) for _ in range(8)]
+
+    _, preprocess, _ = clip_embed.getModel()
+    expected = [clip_embed.encode_images(preprocess(image).unsqueeze(0))[0] for image in images]
+
+    embedder = clip_embed.ImageEmbedder(max_batch=4, max_wait=0.05)
+    with ThreadPoolExecutor(8) as pool:
+        vectors = list(pool.map(lambda image: embedder.submit(image).result(), images))
+
+    for vector, single in zip(vectors, expected):
+        assert len(vector) == IMAGE_FEATURE_DIM
+        assert np.allclose(vector, single, atol=1e-4)
+
+@pytest.mark.parametrize("quantization", ["none", "int8"])
+def test_onnx_backend(tmp_path: Path, monkeypatch, quantization: str):
+    pytest.importorskip("onnxruntime")
+    from indexer import clip_onnx
+    monkeypatch.setattr(clip_onnx, "CLIP_ONNX_DIR", tmp_path.as_posix())
+
+    model, preprocess, tokenizer = clip_embed.getModel()
+    onnx_model = clip_onnx.load("test/model", lambda: model, tokenizer, clip_embed.IMAGE_SIZE, quantization)
+
+    rng = np.random.default_rng(0)
+    images = torch.stack([preprocess(Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8))) for _ in range(4)])
+    tokens = tokenizer(["a husky in the snow", "a robot with blue eyes"])
+
+    with torch.inference_mode():
+        pairs = [(onnx_model.encode_image(images), model.encode_image(images.to(clip_embed.device)).cpu()),
+                 (onnx_model.encode_text(tokens), model.encode_text(tokens.to(clip_embed.device)).cpu())]
+    # int8 weights move the embeddings slightly, not their direction
+    min_cosine = 0.999 if quantization == "none" else 0.95
+    for actual, expected in pairs:
+        assert torch.nn.functional.cosine_similarity(actual, expected).min() > min_cosine
+
+def test_onnx_model_id():
+    model = "ViT-B-32/laion2b_s34b_b79k"
+    assert clip_embed.embedding_model_id(model) == model
+    assert clip_embed.parse_model_id(model) == ("ViT-B-32", "laion2b_s34b_b79k", "torch", "none")
+    # the vectors of each backend and quantization are re-embedded when it changes
+    onnx_id = clip_embed.embedding_model_id(model, "onnx", "int8")
+    assert onnx_id not in (model, clip_embed.embedding_model_id(model, "onnx", "none"))
+    assert clip_embed.parse_model_id(onnx_id) == ("ViT-B-32", "laion2b_s34b_b79k", "onnx", "int8")
+
+def test_onnx_preprocess():
+    # the ONNX backend preprocesses like the pretrained torch model without loading its weights
+    _, preprocess, _ = clip_embed.getModel(clip_embed.CLIP_MODEL)
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8))
+    assert torch.equal(clip_embed.eval_transform(clip_embed.MODEL_NAME, clip_embed.PRETRAINED)(image), preprocess(image))
+
+def test_preprocess_pool(tmp_path: Path):
+    from indexer import preprocess_pool
+
+    rng = np.random.default_rng(0)
+    path = tmp_path / "image.jpg"
+    image = Image.fromarray(rng.integers(0, 256, (30, 40, 3), dtype=np.uint8)).resize((1600, 1200))
+    image.save(path)
+
+    pool = preprocess_pool.get_pool()
+    (_, future), (_, missing) = pool.imap([path, tmp_path / "missing.jpg"])
+    decoded = future.result()
+    assert (decoded.width, decoded.height, decoded.format) == (1600, 1200, "JPEG")
+    assert max(decoded.preview.size) == preprocess_pool.PREVIEW_SIZE
+    with pytest.raises(FileNotFoundError):
+        missing.result()
+
+    # decoded at a reduced scale, close to the embedding of the full image
+    vector = clip_embed.image_embedder.submit_tensor(decoded.tensor).result()
+    expected = clip_embed.get_image_embed(Image.open(path))
+    assert np.dot(vector, expected) / (np.linalg.norm(vector) * np.linalg.norm(expected)) > 0.98
+
+def test_preprocess_worker_imports():
+    # what a spawned worker of the pool imports, the indexer package would start the Gemini client and open the stores
+    script = "import sys, preprocess_worker; print([name for name in ('indexer', 'pymilvus', 'google.genai') if name in sys.modules])"
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+def test_open_reduced():
+    rng = np.random.default_rng(0)
+    buffer = BytesIO()
+    Image.fromarray(rng.integers(0, 256, (40, 200, 3), dtype=np.uint8)).resize((4000, 800)).save(buffer, "JPEG")
+    data = buffer.getvalue()
+
+    # the short side is kept at the model resolution whatever the aspect ratio
+    image = clip_embed.open_reduced(data)
+    assert image.size == (5 * clip_embed.IMAGE_SIZE, clip_embed.IMAGE_SIZE)
+
+    with pytest.raises(OSError):
+        clip_embed.open_reduced(data[:len(data) // 2])
@@ -5,6 +5,7 @@ from tests.constants import *
 from datetime import datetime
 from pathlib import Path
 from fastapi.testclient import TestClient
+import numpy as np
 import pytest
 
 from router.file_api import getPathOfImageFile, BASE_DIR
@@ -402,3 +403,161 @@ def test_regenerate_description(client: TestClient, session: Session, monkeypatc
     assert fakeDesc == texts[str(id)]
 
 
+
+def test_insert_images_batch(client: TestClient):
+    husky = ImageLoader.open(getPathOfImageFile(PATH_HUSKY_IMAGE))
+    robot = ImageLoader.open(getPathOfImageFile(PATH_ROBOT_IMAGE))
+
+    results = indexer.insert_images(indexer.COLLECTION_NAME, [
+        (1, HUSKY_IMAGE, husky, 1),
+        (2, ROBOT_IMAGE, robot, 1),
+        (None, ROBOT_IMAGE, robot, 2), # invalid id
+    ])
+    assert results == [True, True, False]
+
+    wait_before_read_vecdb()
+
+    data = client.get("/api/list").json()
+    assert len(data) == 2
+    assert "husky" in data['1']
+    assert "robot" in data['2']
+
+def test_list_vecdb_unbounded(client: TestClient):
+    # more rows than one query page used to return
+    n = 250
+    rows = [indexer.make_row(id, f"caption {id}", partition="1") for id in range(1, n + 1)]
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+
+    wait_before_read_vecdb()
+
+    response = client.get("/api/list")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == n
+    assert data[str(n)] == f"caption {n}"
+
+    assert sum(len(batch) for batch in indexer.iter_data(indexer.COLLECTION_NAME, ["1"], batch_size=100)) == n
+
+def test_migrate_collection(client: TestClient, single_client, monkeypatch):
+    backend = indexer.vector_db.get_backend()
+    if not hasattr(backend, "vectorDtypes"):
+        pytest.skip("the flat backend stores float32 only")
+
+    image_dense = np.linspace(-1, 1, indexer.vector_db.IMAGE_FEATURE_DIM).tolist()
+    rows = [indexer.make_row(1, "husky", image_dense=image_dense, partition="1"),
+            indexer.make_row(2, "robot", image_dense=image_dense)]
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+    wait_before_read_vecdb()
+    assert set(backend.vectorDtypes(indexer.COLLECTION_NAME).values()) == {"float32"}
+
+    # float32 to float16, the rows are read and written with one client
+    monkeypatch.setattr(indexer.milvus_backend, "VECTOR_DTYPE", "float16")
+    assert indexer.migrate_collection(indexer.COLLECTION_NAME)
+    wait_before_read_vecdb()
+    assert set(backend.vectorDtypes(indexer.COLLECTION_NAME).values()) == {"float16"}
+
+    assert client.get("/api/list").json() == {"1": "husky", "2": "robot"}
+    batches = list(indexer.iter_data(indexer.COLLECTION_NAME, ["1"]))
+    assert [row[indexer.FIELD_ID] for batch in batches for row in batch] == [1]
+
+    row = backend.get(indexer.COLLECTION_NAME, [1], [indexer.vector_db.FIELD_IMAGE_DENSE])[0]
+    assert np.allclose(row[indexer.vector_db.FIELD_IMAGE_DENSE], image_dense, atol=1e-2)
+    hits = indexer.query_images_by_image_id(indexer.COLLECTION_NAME, 2, 1)
+    assert [hit[indexer.FIELD_ID] for hit in hits] == [2]
+
+def test_migrate_collection_swap_failure(client: TestClient, monkeypatch):
+    rows = [indexer.make_row(1, "husky", partition="1"), indexer.make_row(2, "robot")]
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+    wait_before_read_vecdb()
+
+    # the old collection is restored if the migrated one cannot be swapped in
+    backend = indexer.vector_db.get_backend()
+    rename_collection = backend.rename_collection
+
+    def rename_failing(collection: str, new_name: str):
+        if collection.endswith("_migration"):
+            raise RuntimeError("rename failed")
+        rename_collection(collection, new_name)
+
+    monkeypatch.setattr(backend, "rename_collection", rename_failing)
+    assert indexer.migrate_collection(indexer.COLLECTION_NAME) == False
+    assert not backend.has_collection(indexer.COLLECTION_NAME + "_migration")
+    assert not backend.has_collection(indexer.COLLECTION_NAME + "_previous")
+    assert client.get("/api/list").json() == {"1": "husky", "2": "robot"}
+
+def test_snapshot(client: TestClient, tmp_path: Path):
+    image_dense = np.linspace(-1, 1, indexer.vector_db.IMAGE_FEATURE_DIM).tolist()
+    text_dense = np.linspace(1, -1, indexer.vector_db.TEXT_FEATURE_DIM).tolist()
+    rows = [indexer.make_row(1, "husky", text_dense, image_dense, partition="1"),
+            indexer.make_row(2, "白色的花", image_dense=image_dense),
+            indexer.make_row(3, "")]
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+    wait_before_read_vecdb()
+
+    path = (tmp_path / "snapshot.npz").as_posix()
+    assert indexer.export_snapshot(indexer.COLLECTION_NAME, path) == 3
+
+    assert indexer.truncate_collection(indexer.COLLECTION_NAME)
+    assert indexer.import_snapshot(indexer.COLLECTION_NAME, path) == 3
+    wait_before_read_vecdb()
+
+    assert client.get("/api/list").json() == {"1": "husky", "2": "白色的花", "3": ""}
+    assert [row[indexer.FIELD_ID] for batch in indexer.iter_data(indexer.COLLECTION_NAME, ["1"]) for row in batch] == [1]
+
+    vector_db = indexer.vector_db
+    fields = [vector_db.FIELD_TEXT_DENSE, vector_db.FIELD_IMAGE_DENSE, vector_db.FIELD_HAS_TEXT, vector_db.FIELD_HAS_IMAGE]
+    restored = {row[indexer.FIELD_ID]: row for row in vector_db.get_backend().get(indexer.COLLECTION_NAME, [1, 2, 3], fields)}
+    assert np.allclose(restored[1][vector_db.FIELD_TEXT_DENSE], text_dense, atol=1e-2)
+    assert np.allclose(restored[2][vector_db.FIELD_IMAGE_DENSE], image_dense, atol=1e-2)
+    assert [restored[id][vector_db.FIELD_HAS_TEXT] for id in (1, 2, 3)] == [True, False, False]
+    assert [restored[id][vector_db.FIELD_HAS_IMAGE] for id in (1, 2, 3)] == [True, True, False]
+
+def test_content_store(client: TestClient, tmp_content_store, tmp_path: Path, monkeypatch):
+    # the same file under another name is not captioned or embedded again
+    calls = []
+    def explain(*args, **kwargs):
+        calls.append(args[0])
+        return "A husky in the snow."
+    monkeypatch.setattr(indexer.genai_api, 'explainImage', explain)
+
+    husky = getPathOfImageFile(PATH_HUSKY_IMAGE)
+    copy = tmp_path / "copy.jpg"
+    copy.write_bytes(husky.read_bytes())
+
+    first = indexer.embed_image(1, HUSKY_IMAGE, ImageLoader.open(husky), 1)
+    monkeypatch.setattr(indexer.clip_embed.image_embedder, 'submit', lambda *args, **kwargs: pytest.fail("embedded again"))
+    second = indexer.embed_image(2, "copy.jpg", ImageLoader.open(copy), 2)
+
+    assert calls == [indexer.vector_db.content_hash(husky.read_bytes())]
+    assert second[indexer.FIELD_TEXT] == first[indexer.FIELD_TEXT]
+    for field in (indexer.vector_db.FIELD_TEXT_DENSE, indexer.vector_db.FIELD_IMAGE_DENSE):
+        assert np.allclose(second[field], first[field], atol=1e-6)
+    assert tmp_content_store.stats()["hits"] == 1
+
+    # regenerating the caption replaces the stored one and keeps the image vector
+    monkeypatch.setattr(indexer.genai_api, 'explainImage', lambda *args, **kwargs: "A dog.")
+    third = indexer.embed_image(2, "copy.jpg", ImageLoader.open(copy), 2, use_cache=False)
+    assert third[indexer.FIELD_TEXT] == "A dog."
+    assert indexer.embed_image(3, "other.jpg", ImageLoader.open(copy), 2)[indexer.FIELD_TEXT] == "A dog."
+
+    # another image under the same file name is captioned by its own hash
+    other = tmp_path / "folder" / HUSKY_IMAGE
+    other.parent.mkdir()
+    other.write_bytes(getPathOfImageFile(PATH_ROBOT_IMAGE).read_bytes())
+    monkeypatch.setattr(indexer.genai_api, 'explainImage', explain)
+    assert indexer.embed_image(4, HUSKY_IMAGE, ImageLoader.open(other), 3)[indexer.FIELD_TEXT] == "A husky in the snow."
+    assert calls[-1] == indexer.vector_db.content_hash(other.read_bytes()) != calls[0]
+
+def test_delete_while_iterating(client: TestClient, single_client):
+    # deletes run between the batches of the listing, with one client for both
+    rows = [indexer.make_row(id, "" if id % 2 == 0 else f"caption {id}", partition="1") for id in range(1, 31)]
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+    wait_before_read_vecdb()
+
+    indexer.vector_db.delete_empty_data(indexer.COLLECTION_NAME)
+    wait_before_read_vecdb()
+    assert sorted(int(id) for id in client.get("/api/list").json()) == list(range(1, 31, 2))
+
+    assert indexer.vector_db.delete_by_filter(indexer.COLLECTION_NAME, f"{indexer.FIELD_ID} > 20", ["1"])
+    wait_before_read_vecdb()
+    assert sorted(int(id) for id in client.get("/api/list").json()) == list(range(1, 21, 2))
@@ -0,0 +1,68 @@
+from fastapi.testclient import TestClient
+from pathlib import Path
+from sqlmodel import Session
+from tests.constants import *
+from tests.utils import *
+
+from router.duplicates_api import duplicate_job
+from router.sqlite_api import inesrt_or_update_image
+
+
+def test_duplicates(client: TestClient, session: Session, tmp_path: Path, single_client):
+    def scan(path: str = None):
+        params = {"path": path} if path is not None else {}
+        response = client.post("/duplicates/scan", params=params)
+        assert response.status_code == 200
+        duplicate_job.join(60)
+        status = client.get("/duplicates/scan").json()
+        assert status["running"] == False and "error" not in status
+        return status
+
+    def clusters(path: str = None):
+        params = {"path": path} if path is not None else {}
+        response = client.get("/duplicates/", params=params)
+        assert response.status_code == 200
+        return [sorted(image["filename"] for image in cluster["images"]) for cluster in response.json()]
+
+    # a re-export of the same picture in another folder
+    copy_file(BASE_DIR, tmp_path, HUSKY_IMAGE)
+    inesrt_or_update_image(PATH_HUSKY_IMAGE, session)
+    inesrt_or_update_image((tmp_path / HUSKY_IMAGE).as_posix(), session)
+    inesrt_or_update_image(PATH_ROBOT_IMAGE, session)
+    wait_before_read_vecdb()
+
+    assert scan()["pairs"] == 1
+    assert clusters() == [[HUSKY_IMAGE, HUSKY_IMAGE]]
+
+    # only images inserted since the last scan are probed
+    copy_file(BASE_DIR, tmp_path, ROBOT_IMAGE)
+    inesrt_or_update_image((tmp_path / ROBOT_IMAGE).as_posix(), session)
+    wait_before_read_vecdb()
+
+    assert scan()["pairs"] == 1
+    assert clusters() == [[HUSKY_IMAGE, HUSKY_IMAGE], [ROBOT_IMAGE, ROBOT_IMAGE]]
+
+    # a modified image keeps its id, it is probed again and moves to the cluster of its new content
+    (tmp_path / ROBOT_IMAGE).write_bytes((tmp_path / HUSKY_IMAGE).read_bytes())
+    inesrt_or_update_image((tmp_path / ROBOT_IMAGE).as_posix(), session)
+    wait_before_read_vecdb()
+
+    assert scan()["pairs"] == 2
+    assert clusters() == [[HUSKY_IMAGE, HUSKY_IMAGE, ROBOT_IMAGE]]
+
+    # scoped to one folder, the copies are in another one
+    scan(tmp_path.as_posix())
+    assert clusters(tmp_path.as_posix()) == []
+
+    # the id of a deleted image is reused by the next insert, which is probed and does not join the old cluster
+    deleted = client.get("/image/lookup", params={"file": (tmp_path / ROBOT_IMAGE).as_posix()}).json()["id"]
+    assert client.delete(f"/image/{deleted}").status_code == 200
+    copy_file(BASE_DIR, tmp_path, ROBOT_IMAGE)
+    assert inesrt_or_update_image((tmp_path / ROBOT_IMAGE).as_posix(), session).id == deleted
+    wait_before_read_vecdb()
+
+    assert scan()["pairs"] == 1
+    assert clusters() == [[HUSKY_IMAGE, HUSKY_IMAGE], [ROBOT_IMAGE, ROBOT_IMAGE]]
+
+    assert client.delete("/image/delete_all").status_code == 200
+    assert clusters() == []
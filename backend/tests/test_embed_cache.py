@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import numpy as np
+
+from indexer.embed_cache import EmbeddingMemo
+
+def test_embedding_memo_per_model():
+    memo = EmbeddingMemo(max_size=2, path="")
+    calls = []
+
+    def embed(model_id: str):
+        def encode(text: str):
+            calls.append((model_id, text))
+            return np.array([len(calls), 0.5], dtype=np.float32)
+        return encode
+
+    first = memo.get("model/a", "husky", embed("model/a"))
+    assert memo.get("model/a", "husky", embed("model/a")) == first
+    # the same text of another model is encoded again
+    assert memo.get("model/b", "husky", embed("model/b")) != first
+    assert calls == [("model/a", "husky"), ("model/b", "husky")]
+
+    stats = memo.stats()
+    assert (stats["hits"], stats["misses"], stats["size"], stats["persistent"]) == (1, 2, 2, False)
+
+    # bounded in memory, the least recently used text is evicted
+    memo.get("model/a", "robot", embed("model/a"))
+    memo.get("model/a", "husky", embed("model/a"))
+    assert calls[-1] == ("model/a", "husky")
+
+def test_embedding_memo_normalizes_text():
+    memo = EmbeddingMemo(path="")
+    calls = []
+
+    def encode(text: str):
+        calls.append(text)
+        return [1.0, 2.0]
+
+    assert memo.get("model/a", "  A Husky\tin the SNOW ", encode) == [1.0, 2.0]
+    assert memo.get("model/a", "a husky in the snow", encode) == [1.0, 2.0]
+    assert calls == ["a husky in the snow"]
+
+def test_embedding_memo_persistent(tmp_path: Path):
+    path = (tmp_path / "embeddings.db").as_posix()
+    memo = EmbeddingMemo(path=path)
+    assert memo.get("model/a", "husky", lambda text: [0.25, 0.5]) == [0.25, 0.5]
+    assert memo.stats()["persistent"]
+
+    # reloaded from the sqlite file by a new process
+    memo = EmbeddingMemo(path=path)
+
+    def encode(text: str):
+        raise AssertionError("embedded again")
+
+    assert memo.get("model/a", "HUSKY", encode) == [0.25, 0.5]
+    assert memo.get("model/b", "husky", lambda text: [1.0, 1.0]) == [1.0, 1.0]
+    stats = memo.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
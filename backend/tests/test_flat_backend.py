@@ -0,0 +1,91 @@
+from pathlib import Path
+import numpy as np
+
+from indexer.backend import SearchRequest
+from indexer.flat_backend import FlatBackend, compile_filter
+from indexer.schema import *
+
+def make_row(id: int, text: str, seed: int):
+    rng = np.random.default_rng(seed)
+    return {
+        FIELD_ID: id,
+        FIELD_TEXT: text,
+        FIELD_CN_TEXT: text,
+        FIELD_TEXT_DENSE: rng.normal(size=TEXT_FEATURE_DIM).tolist(),
+        FIELD_IMAGE_DENSE: rng.normal(size=IMAGE_FEATURE_DIM).tolist(),
+    }
+
+def test_flat_backend(tmp_path: Path):
+    backend = FlatBackend((tmp_path / "vectors.db").as_posix())
+    collection = "test_collection"
+
+    assert backend.has_collection(collection) == False
+    backend.create_collection(collection)
+    assert backend.list_partitions(collection) == [DEFAULT_PARTITION]
+
+    backend.create_partition(collection, "1")
+    husky = make_row(1, "a husky pulling a sled in the snow", 1)
+    robot = make_row(2, "a small robot on a desk", 2)
+    flower = make_row(3, "白色的花 flower", 3)
+    backend.upsert(collection, "1", [husky, robot])
+    backend.upsert(collection, DEFAULT_PARTITION, [flower])
+
+    # BM25
+    hits = backend.hybrid_search(collection, None, [SearchRequest(FIELD_TEXT_SPARSE, "husky snow")], 10)
+    assert [hit[FIELD_ID] for hit in hits] == [1]
+    hits = backend.hybrid_search(collection, None, [SearchRequest(FIELD_CN_TEXT_SPARSE, "花")], 10)
+    assert [hit[FIELD_ID] for hit in hits] == [3]
+
+    # dense search within partition
+    hits = backend.hybrid_search(collection, ["1"], [SearchRequest(FIELD_IMAGE_DENSE, robot[FIELD_IMAGE_DENSE])], 10)
+    assert [hit[FIELD_ID] for hit in hits][0] == 2
+    assert all(hit[FIELD_ID] != 3 for hit in hits)
+
+    batches = list(backend.iterate(collection, None, [FIELD_TEXT], batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert list(backend.iterate(collection, None, [FIELD_ID], 10, f'{FIELD_TEXT} == "{robot[FIELD_TEXT]}"')) == [[{FIELD_ID: 2}]]
+
+    backend.drop_partition(collection, "1")
+    assert backend.get(collection, [1, 2, 3], [FIELD_TEXT]) == [{FIELD_ID: 3, FIELD_TEXT: flower[FIELD_TEXT]}]
+
+    backend.delete(collection, [3])
+    assert list(backend.iterate(collection, None, [FIELD_ID], 10)) == []
+    backend.close()
+
+def test_flat_filter_quoted_values():
+    row = {FIELD_TEXT: "True and False == x", FIELD_ID: 1}
+    assert compile_filter(f'{FIELD_TEXT} == "True and False == x"')(row)
+    assert compile_filter(f"{FIELD_TEXT} == 'True and False == x' and {FIELD_ID} in [1, 2]")(row)
+    assert not compile_filter(f'{FIELD_TEXT} == "true and false == x"')(row)
+    assert compile_filter(f'{FIELD_ID} >= 1 and {FIELD_ID} != 2')(row)
+
+def test_flat_index_updated_in_place(tmp_path: Path):
+    backend = FlatBackend((tmp_path / "vectors.db").as_posix())
+    collection = "test_collection"
+    backend.create_collection(collection)
+    backend.create_partition(collection, "1")
+    backend.upsert(collection, DEFAULT_PARTITION, [make_row(id, f"husky {id}", id) for id in range(1, 5)])
+
+    request = SearchRequest(FIELD_TEXT_SPARSE, "husky robot")
+    backend.hybrid_search(collection, None, [request], 10)
+    index = backend.indexes[collection]
+
+    # writes after the index is loaded update it instead of dropping it
+    backend.upsert(collection, "1", [make_row(2, "a small robot", 20), make_row(5, "a robot and a husky", 5)])
+    backend.delete(collection, [3])
+    assert backend.indexes[collection] is index
+
+    def searches():
+        return [backend.hybrid_search(collection, partitions, [request], 10) for partitions in (None, ["1"])] + \
+            [backend.search(collection, None, FIELD_IMAGE_DENSE, [make_row(2, "", 20)[FIELD_IMAGE_DENSE]], 3, {})]
+
+    updated = searches()
+    backend.indexes.clear()
+    assert searches() == updated
+
+    # compacted once most slots are empty
+    backend.drop_partition(collection, "1")
+    backend.delete(collection, [1])
+    assert backend.indexes[collection].empty_slots() == 0
+    assert [hit[FIELD_ID] for hit in backend.hybrid_search(collection, None, [request], 10)] == [4]
+    backend.close()
@@ -4,11 +4,17 @@ from tests.constants import *
 from PIL import Image as ImageLoader
 from PIL.ImageFile import ImageFile
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+
 import indexer
+from indexer.limiter import RateLimiter
+from tests.fake_gemini import FakeGemini
 
 def test_genai_api():
-    from io import BytesIO
-
     id1 = "test-image"
     image: ImageFile = ImageLoader.open(BASE_DIR / PATH_FLOWER_IMAGE)
     image_format = image.format.lower()
@@ -18,7 +24,6 @@ def test_genai_api():
     image.save(buffer, format=image_format) 
     buffer.seek(0)  # rewind to the start of the stream
 
-    firstRequestTime = time.time()
     text = indexer.genai_api.explainImage(id1, image_format, buffer, use_cache=False)
 
     assert text is not None
@@ -34,15 +39,99 @@ def test_genai_api():
     buffer.seek(0) 
 
     text = indexer.genai_api.explainImage(id2, image_format, buffer, use_cache=False)
-    secondResponseTime = time.time()
 
     assert text is not None
     assert len(text) > 0
     assert any((keywork in text) for keywork in ["husky", "dog", "snow"])
 
-    assert secondResponseTime - firstRequestTime > indexer.genai_api.COOLDOWN_PERIOD
+    # both requests went through the rate limiter
+    assert indexer.genai_api.rate_limiter.stats()["requests"] >= 2
 
 
     indexer.genai_api.delete_uploaded_file(id1)
     indexer.genai_api.delete_uploaded_file(id2)
 
+def test_explain_image_file_name_caption(tmp_caption_cache, monkeypatch):
+    # captions imported from data.json are keyed by file name, found on a miss of the hash and cached under it
+    monkeypatch.setattr(indexer.genai_api, "get_client", lambda: pytest.fail("captioned again"))
+    caption = tmp_caption_cache.get(HUSKY_IMAGE)
+    assert caption is not None
+    assert indexer.genai_api.explainImage("0123abcd", "jpeg", BytesIO(b""), filename=HUSKY_IMAGE) == caption
+    assert tmp_caption_cache.get("0123abcd") == caption
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    fake = FakeGemini(delay=0.3)
+    fake.start()
+    monkeypatch.setattr(indexer.genai_api, "GENAI_BASE_URL", fake.url)
+    yield fake
+    fake.stop()
+
+def test_explain_image_concurrent(fake_gemini: FakeGemini, monkeypatch):
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_in_flight=3)
+    monkeypatch.setattr(indexer.genai_api, "rate_limiter", limiter)
+
+    data = (BASE_DIR / PATH_FLOWER_IMAGE).read_bytes()
+    def explain(i: int):
+        return indexer.genai_api.explainImage(f"fake-{i}", "jpeg", BytesIO(data), use_cache=False)
+
+    start = time.time()
+    with ThreadPoolExecutor(9) as pool:
+        texts = list(pool.map(explain, range(9)))
+    elapsed = time.time() - start
+
+    assert texts == [fake_gemini.caption] * 9
+    assert fake_gemini.max_in_flight == 3
+    assert elapsed < 9 * fake_gemini.delay # not one at a time
+    stats = limiter.stats()
+    assert (stats["requests"], stats["in_flight"], stats["queued"]) == (9, 0, 0)
+    assert stats["tokens_used"] == 9 * fake_gemini.tokens # reported by the responses
+
+def test_rate_limiter_max_in_flight():
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_in_flight=0)
+
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_in_flight=1)
+    limiter.acquire()
+    # a second request waits for the first one
+    second = threading.Thread(target=lambda: (limiter.acquire(), limiter.release()))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive() and limiter.stats()["queued"] == 1
+    limiter.release()
+    second.join(5)
+    assert not second.is_alive() and limiter.stats()["requests"] == 2
+
+def test_rate_limiter_requests_per_minute():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=0, max_in_flight=100)
+    for _ in range(60): # a minute of budget at once
+        assert limiter.acquire() < 0.1
+        limiter.release()
+
+    waited = limiter.acquire()
+    limiter.release()
+    assert 0.8 < waited < 1.5
+
+def test_rate_limiter_fifo():
+    # 100 tokens per second
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=6000, max_in_flight=10)
+    limiter.acquire(6000)
+    limiter.release(6000)
+
+    order = []
+    def request(name: str, tokens: int):
+        with limiter.request(tokens):
+            order.append(name)
+
+    large = threading.Thread(target=request, args=("large", 50))
+    large.start()
+    time.sleep(0.1)
+    small = [threading.Thread(target=request, args=(f"small-{i}", 1)) for i in range(3)]
+    for thread in small:
+        thread.start()
+    for thread in [large] + small:
+        thread.join()
+
+    # the small requests fit the bucket first but do not pass the large one
+    assert order[0] == "large"
+    assert limiter.stats()["max_wait"] > 0.3
@@ -0,0 +1,24 @@
+import pytest
+
+from indexer.index_config import IndexConfig, load_index_configs
+from indexer.schema import *
+
+def test_index_config():
+    configs = load_index_configs('{"image_dense": {"index_type": "hnsw", "M": 32, "ef": 32}}')
+    assert configs[FIELD_TEXT_DENSE].index_type == "AUTOINDEX"
+    assert configs[FIELD_TEXT_DENSE].search_params(10) == {}
+
+    image = configs[FIELD_IMAGE_DENSE]
+    assert image.index_type == "HNSW"
+    assert image.build == {"M": 32, "efConstruction": 200}
+    assert image.search_params(10) == {"ef": 32}
+    assert image.search_params(100) == {"ef": 100} # ef must not be smaller than top k
+
+    assert IndexConfig.parse({"index_type": "IVF_PQ", "nprobe": 8}).search_params(10) == {"nprobe": 8}
+
+    with pytest.raises(ValueError):
+        IndexConfig.parse({"index_type": "HNSW", "nprobe": 8})
+    with pytest.raises(ValueError):
+        IndexConfig.parse({"index_type": "SCANN"})
+    with pytest.raises(ValueError):
+        load_index_configs('{"text": {"index_type": "HNSW"}}')
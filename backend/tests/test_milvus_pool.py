@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from indexer.milvus_pool import MilvusClientPool
+
+class FakeClient:
+    def __init__(self):
+        self.healthy = True
+        self.pings = 0
+        self.closed = False
+
+    def get_server_version(self):
+        self.pings += 1
+        if not self.healthy:
+            raise ConnectionError("server gone")
+        return "v2.5"
+
+    def close(self):
+        self.closed = True
+
+class FakePool(MilvusClientPool):
+    '''creates fake clients instead of connecting to a server'''
+    def __init__(self, *args, **kwargs):
+        super().__init__("http://localhost:19530", "", *args, **kwargs)
+        self.clients = []
+
+    def _connect(self):
+        client = FakeClient()
+        self.clients.append(client)
+        return client
+
+def test_pool_blocks_when_full():
+    pool = FakePool(size=2, timeout=0.1)
+    first, second = pool.acquire(), pool.acquire()
+    assert first is not second
+
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+    # a waiting acquire gets the released client
+    pool.timeout = 5
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    thread.start()
+    time.sleep(0.1)
+    assert acquired == []
+    pool.release(first)
+    thread.join(5)
+    assert acquired == [first]
+    assert len(pool.clients) == 2
+
+def test_pool_replaces_broken_client():
+    pool = FakePool(size=1, timeout=1)
+    client = pool.acquire()
+    pool.release(client, broken=True)
+    assert client.closed
+
+    replacement = pool.acquire()
+    assert replacement is not client and not replacement.closed
+    assert len(pool.clients) == 2
+
+def test_pool_health_check_after_idle():
+    pool = FakePool(size=1, health_check_interval=0.05, timeout=1)
+    client = pool.acquire()
+    pool.release(client)
+
+    # reused without a ping within the interval
+    assert pool.acquire() is client
+    assert client.pings == 0
+    pool.release(client)
+
+    time.sleep(0.1)
+    assert pool.acquire() is client
+    assert client.pings == 1
+    pool.release(client)
+
+    # reconnected if the server does not answer
+    client.healthy = False
+    time.sleep(0.1)
+    replacement = pool.acquire()
+    assert replacement is not client and client.closed
+
+def test_pool_closed():
+    pool = FakePool(size=2, timeout=1)
+    idle, used = pool.acquire(), pool.acquire()
+    pool.release(idle)
+
+    pool.close()
+    assert idle.closed and not used.closed
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+    # clients in use are closed when released
+    pool.release(used)
+    assert used.closed
@@ -1,6 +1,11 @@
 from tests.utils import *
 from tests.constants import *
 
+import asyncio
+import httpx
+import indexer
+import numpy as np
+import pytest
 from pathlib import Path
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
@@ -137,3 +142,182 @@ def test_query_images_within_folder(client: TestClient, session: Session, tmp_pa
 
 
 
+
+def test_query_cache(client: TestClient, session: Session):
+    params = {"text": "husky", "use_text_embed": True, "use_bm25": True, "use_joint_embed": True}
+
+    inesrt_or_update_image(PATH_HUSKY_IMAGE, session)
+    wait_before_read_vecdb(3)
+
+    stats = client.get("/api/query/cache").json()
+    first = client.get("/api/query", params=params).json()
+    second = client.get("/api/query", params={**params, "text": "  HUSKY "}).json()
+    assert first == second
+
+    new_stats = client.get("/api/query/cache").json()
+    assert new_stats["hits"] == stats["hits"] + 1
+    assert new_stats["misses"] == stats["misses"] + 1
+
+    # insert invalidates the cached result
+    inesrt_or_update_image(PATH_HUSKY_IMAGE_2, session)
+    wait_before_read_vecdb(3)
+
+    data = client.get("/api/query", params=params).json()
+    assert len(data) == 2
+    assert client.get("/api/query/cache").json()["misses"] == stats["misses"] + 2
+
+def test_query_pagination(client: TestClient, session: Session):
+    params = {"text": "husky", "use_text_embed": True, "use_bm25": True, "use_joint_embed": True}
+
+    inesrt_or_update_image(PATH_HUSKY_IMAGE, session)
+    inesrt_or_update_image(PATH_HUSKY_IMAGE_2, session)
+    inesrt_or_update_image(PATH_ROBOT_IMAGE, session)
+    inesrt_or_update_image(PATH_ROBOT_IMAGE_2, session)
+    wait_before_read_vecdb()
+
+    full = client.get("/api/query", params=params).json()
+    assert len(full) == 4
+
+    response = client.get("/api/query", params={**params, "top_k": 2})
+    assert response.status_code == 200
+    first = response.json()
+    assert len(first) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/api/query", params={**params, "top_k": 2, "offset": 2, "cursor": cursor})
+    assert response.status_code == 200
+    second = response.json()
+    assert [item["id"] for item in first + second] == [item["id"] for item in full]
+
+    # past the candidate list, searched again with more candidates
+    response = client.get("/api/query", params={**params, "top_k": 2, "offset": 4, "cursor": response.headers["X-Next-Cursor"]})
+    assert response.status_code == 200
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get("/api/query", params={**params, "top_k": 2, "cursor": "expired"})
+    assert response.status_code == 410
+
+    # a cursor only pages through the query it was returned for
+    response = client.get("/api/query", params={**params, "text": "robot", "top_k": 2, "offset": 2, "cursor": cursor})
+    assert response.status_code == 400
+    response = client.get("/api/query", params={**params, "use_bm25": not params["use_bm25"], "top_k": 2, "offset": 2, "cursor": cursor})
+    assert response.status_code == 400
+    response = client.get("/api/query", params={**params, "text": params["text"].upper(), "top_k": 2, "offset": 2, "cursor": cursor})
+    assert response.status_code == 200
+
+def test_query_page_candidate_cap(monkeypatch):
+    # candidate lists are capped by MAX_SEARCH_CANDIDATES, the page reaching the cap is the last one
+    searches = []
+
+    async def search(collection, limit, *args):
+        searches.append(limit)
+        return [{"id": id, "distance": 1.0} for id in range(limit)]
+
+    monkeypatch.setattr(indexer.vector_db, "query_images_by_text_async", search)
+    monkeypatch.setattr(indexer.vector_db, "MAX_SEARCH_CANDIDATES", 6)
+
+    def page(offset: int, cursor = None):
+        return asyncio.run(indexer.query_images_page("collection", 2, offset, "husky", True, False, False, cursor=cursor))
+
+    results, cursor = page(0)
+    assert len(results) == 2 and cursor is not None
+    results, cursor = page(2, cursor)
+    assert [item["id"] for item in results] == [2, 3] and cursor is not None
+    results, cursor = page(4, cursor)
+    assert [item["id"] for item in results] == [4, 5] and cursor is None
+    assert searches == [4, 6]
+
+    with pytest.raises(indexer.CursorExpired):
+        page(2, "expired")
+
+@pytest.mark.asyncio
+async def test_query_concurrent(async_client: httpx.AsyncClient, session: Session):
+    inesrt_or_update_image(PATH_HUSKY_IMAGE, session)
+    inesrt_or_update_image(PATH_ROBOT_IMAGE, session)
+    wait_before_read_vecdb()
+
+    texts = ["husky", "robot", "a dog in the snow", "a robot on a desk"]
+    responses = await asyncio.gather(*[
+        async_client.get("/api/query", params={"text": text, "use_text_embed": True, "use_bm25": True, "use_joint_embed": True})
+        for text in texts
+    ])
+
+    for text, response in zip(texts, responses):
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+    assert "husky" in responses[0].json()[0]["filename"]
+    assert "robot" in responses[1].json()[0]["filename"]
+
+def test_query_skips_missing_embeddings(client: TestClient):
+    vector_db = indexer.vector_db
+    image_dense = np.ones(vector_db.IMAGE_FEATURE_DIM).tolist()
+    text_dense = np.ones(vector_db.TEXT_FEATURE_DIM).tolist()
+    rows = [indexer.make_row(1, "husky", image_dense=image_dense),
+            indexer.make_row(2, "")] # captioning and embedding failed
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+    wait_before_read_vecdb()
+
+    def query(use_text_embed: bool, use_joint_embed: bool):
+        results = vector_db.query(indexer.COLLECTION_NAME, None, 10, "husky", text_dense, image_dense, None,
+                                  use_text_embed, False, use_joint_embed)
+        return [result[indexer.FIELD_ID] for result in results]
+
+    assert query(False, True) == [1]
+    assert query(True, False) == [] # no row has a text embedding
+
+def test_query_bm25_routing(client: TestClient):
+    from indexer.text_route import bm25_fields, cn_text_of
+
+    assert cn_text_of("a husky in the snow") == ""
+    assert cn_text_of("白色的花 flower") == "白色的花 flower"
+    assert bm25_fields("husky") == [indexer.vector_db.FIELD_TEXT_SPARSE]
+    assert bm25_fields("花") == [indexer.vector_db.FIELD_CN_TEXT_SPARSE]
+    assert len(bm25_fields("white 花")) == 2
+
+    rows = [indexer.make_row(1, "a husky in the snow"), indexer.make_row(2, "白色的花 white flower")]
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+    wait_before_read_vecdb()
+
+    def query(text: str):
+        results = indexer.vector_db.query(indexer.COLLECTION_NAME, None, 10, text, use_text_embed=False, use_joint_embed=False)
+        return [result[indexer.FIELD_ID] for result in results]
+
+    assert query("husky") == [1]
+    assert query("huskies") == [1] # english captions are stemmed
+    assert query("flower") == [2] # english words of a chinese caption
+    assert query("花") == [2]
+
+def test_query_similar_images(client: TestClient, session: Session):
+    inesrt_or_update_image(PATH_HUSKY_IMAGE, session)
+    inesrt_or_update_image(PATH_HUSKY_IMAGE_2, session)
+    inesrt_or_update_image(PATH_ROBOT_IMAGE, session)
+    wait_before_read_vecdb()
+
+    images = {image["filename"]: image["id"] for image in client.get("/image").json()}
+    husky = images[Path(PATH_HUSKY_IMAGE).name]
+
+    response = client.get("/api/similar", params={"id": husky})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 2
+    assert all(item["id"] != husky for item in data)
+    assert "husky" in data[0]["filename"]
+
+    assert client.get("/api/similar", params={"id": 12345}).status_code == 404
+
+    with open(getPathOfImageFile(PATH_HUSKY_IMAGE), "rb") as f:
+        response = client.post("/api/query/image", files={"file": ("husky.jpg", f, "image/jpeg")})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 3
+    assert data[0]["id"] == husky
+
+    response = client.post("/api/query/image", files={"file": ("husky.jpg", b"not an image", "image/jpeg")})
+    assert response.status_code == 400
+
+    # an upload cut in the middle of the image data
+    with open(getPathOfImageFile(PATH_HUSKY_IMAGE), "rb") as f:
+        truncated = f.read()[:4096]
+    response = client.post("/api/query/image", files={"file": ("husky.jpg", truncated, "image/jpeg")})
+    assert response.status_code == 400
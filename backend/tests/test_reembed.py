@@ -0,0 +1,75 @@
+from fastapi.testclient import TestClient
+from pathlib import Path
+from PIL import Image as ImageLoader
+from sqlmodel import Session
+from tests.constants import *
+from tests.utils import *
+
+import indexer
+from indexer import clip_embed, text_embed
+from indexer.schema import DENSE_FIELDS, FIELD_IMAGE_DENSE, FIELD_IMAGE_MODEL, FIELD_TEXT_DENSE, STORED_FIELDS
+from router.reembed_api import reembed_job
+from router.sqlite_api import inesrt_or_update_image
+
+LEGACY_MODEL = "legacy/model"
+
+def test_reembed(client: TestClient, session: Session, monkeypatch, single_client):
+    # an older model with the same weights, so the searches of both models are comparable
+    monkeypatch.setitem(clip_embed.models, LEGACY_MODEL, clip_embed.getModel())
+    monkeypatch.setitem(text_embed.models, LEGACY_MODEL, text_embed.getModel())
+
+    inesrt_or_update_image(PATH_HUSKY_IMAGE, session)
+    inesrt_or_update_image(PATH_ROBOT_IMAGE, session)
+    wait_before_read_vecdb()
+
+    # label the stored vectors as embedded by the older model
+    for partition in indexer.list_partitions(indexer.COLLECTION_NAME):
+        for batch in indexer.iter_data(indexer.COLLECTION_NAME, [partition], STORED_FIELDS):
+            rows = [indexer.make_row(row[indexer.FIELD_ID], row[indexer.FIELD_TEXT], row[FIELD_TEXT_DENSE], row[FIELD_IMAGE_DENSE],
+                                     partition, LEGACY_MODEL, LEGACY_MODEL) for row in batch]
+            assert all(indexer.insert_many(indexer.COLLECTION_NAME, rows))
+    wait_before_read_vecdb()
+
+    assert indexer.legacy_models(indexer.COLLECTION_NAME) == {field: [LEGACY_MODEL] for field in DENSE_FIELDS}
+
+    def query(text: str):
+        response = client.get("/api/query", params={"text": text, "top_k": 1, "use_text_embed": True, "use_bm25": False, "use_joint_embed": True})
+        assert response.status_code == 200
+        return [item["filename"] for item in response.json()]
+
+    # searched with the query embedding of each model during the migration
+    assert "husky" in query("husky")[0]
+
+    response = client.post("/reembed/")
+    assert response.status_code == 200
+    reembed_job.join(60)
+    status = client.get("/reembed/").json()
+    assert status["running"] == False and "error" not in status
+    assert status["done"] == 4 and status["failed"] == 0
+    assert status["legacy"] == {}
+
+    assert "husky" in query("husky")[0]
+    assert "robot" in query("robot")[0]
+
+def test_reembed_indexed_again(client: TestClient, session: Session):
+    inesrt_or_update_image(PATH_HUSKY_IMAGE, session)
+    wait_before_read_vecdb()
+
+    partition = indexer.list_partitions(indexer.COLLECTION_NAME)[-1]
+    rows = next(indexer.iter_data(indexer.COLLECTION_NAME, [partition], STORED_FIELDS))
+    stale = [{**row, FIELD_IMAGE_MODEL: LEGACY_MODEL} for row in rows]
+
+    # the watcher indexes the image again after the migration read its row
+    assert all(indexer.insert_many(indexer.COLLECTION_NAME, [
+        indexer.make_row(row[indexer.FIELD_ID], "a newer caption", row[FIELD_TEXT_DENSE], row[FIELD_IMAGE_DENSE], partition)
+        for row in rows
+    ]))
+    wait_before_read_vecdb()
+
+    results = indexer.reembed_rows(indexer.COLLECTION_NAME, partition, FIELD_IMAGE_DENSE, stale,
+                                   lambda id: ImageLoader.open(BASE_DIR / PATH_HUSKY_IMAGE))
+    assert results == [True]
+    wait_before_read_vecdb()
+
+    rows = next(indexer.iter_data(indexer.COLLECTION_NAME, [partition], STORED_FIELDS))
+    assert [row[indexer.FIELD_TEXT] for row in rows] == ["a newer caption"]
@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from indexer import text_embed
+from indexer.schema import TEXT_FEATURE_DIM
+
+def test_batched_doc_embed():
+    texts = ["A husky in the snow.", "A robot on a table.", "White carnations in a vase."]
+    vectors = text_embed.get_text_embed_docs(texts)
+    assert vectors.shape == (len(texts), TEXT_FEATURE_DIM)
+    assert vectors.dtype == np.float32
+    for text, vector in zip(texts, vectors):
+        assert np.allclose(vector, text_embed.get_text_embed_doc(text), atol=1e-6)
+
+    assert text_embed.get_text_embed_docs([]).shape == (0, TEXT_FEATURE_DIM)
+
+def test_model_loaded_once(monkeypatch):
+    monkeypatch.setattr(text_embed, "models", {})
+    built = []
+    class FakeModel:
+        def __init__(self, model_source):
+            built.append(model_source)
+    monkeypatch.setattr(text_embed.model.dense, "Model2VecEmbeddingFunction", FakeModel)
+
+    with ThreadPoolExecutor(8) as pool:
+        loaded = list(pool.map(lambda _: text_embed.getModel(), range(32)))
+    assert built == [text_embed.MODEL_ID]
+    assert all(model is loaded[0] for model in loaded)
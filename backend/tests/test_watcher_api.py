@@ -121,4 +121,9 @@ def test_watchdog_remove_and_clear(client: TestClient, session: Session, fs_watc
     assert response.status_code == 200
     assert len(response.json()) == 0, "Expected no images in the base folder after removal"
 
+    wait_before_read_vecdb()
+    response = client.get("/api/list", params={"path": base.as_posix()})
+    assert response.status_code == 200
+    assert len(response.json()) == 0, "Expected no vectors in the base folder after removal"
+
     assert not (router.file_api.THUMBNAIL_DIR / thumbnail_path).exists(), "Thumbnail should be deleted after removing images"
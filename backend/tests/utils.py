@@ -55,13 +55,8 @@ def wait_before_read_vecdb(level: int = 1):
 def clear_vector_db():
     """Clear the vector database for testing purposes.""" 
     wait_before_read_vecdb(3)
-    while True:
-        ids = list(indexer.list_data(indexer.COLLECTION_NAME).keys())
-        if len(ids) == 0:
-            break
-        delete = indexer.delete_by_list(indexer.COLLECTION_NAME, ids)
-        if delete == False:
-            raise RuntimeError("Failed to clear vector database collection")
+    if indexer.truncate_collection(indexer.COLLECTION_NAME) == False:
+        raise RuntimeError("Failed to clear vector database collection")
 
 def wait_watchdog_done():
     """Waits for the watchdog service to process all pending file events.
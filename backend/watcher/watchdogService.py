@@ -18,6 +18,7 @@ import router.file_api
 from router.sqlite_api import inesrt_or_update_image, delete_image, move_image_path
 from database.utils import get_all_listening_paths, query_images_by_path
 import router.watcher_sse as watcher_sse
+from indexer import BatchInserter
 
 class ListItem:
     def __init__(self):
@@ -35,6 +36,9 @@ waitting_list: Dict[str, ListItem] = dict()
 condition = threading.Condition(lock=list_lock)
 DELAY = 1
 
+# images from all worker threads are inserted into vector db in batch
+image_inserter = BatchInserter()
+
 last_add_time = 0
 
 def is_file_ready(path, timeout=2):
@@ -162,7 +166,7 @@ def process_file(file: ChangedFile, id):
     with Session(db.engine) as session:
         if file.type == FileChangeType.CREATED or file.type == FileChangeType.MODIFIED:
             try:
-                if inesrt_or_update_image(file_path, session) is not None:
+                if inesrt_or_update_image(file_path, session, image_inserter) is not None:
                     print(f"[watchdog - Result - {id}] {file.type} image: {file_path}")
                 else:
                     if file.type == FileChangeType.MODIFIED:
@@ -173,12 +177,14 @@ def process_file(file: ChangedFile, id):
                 print(f'[watchdog - Result - {id}] Error during {file.type}: {e}')
 
         elif file.type == FileChangeType.DELETED:
+            image_inserter.flush() # pending insert must not overwrite the deletion
             if delete_image(file.src, session):
                 print(f"[watchdog - Result - {id}] File deleted: {file_path}")
             else:
                 print(f"[watchdog - Result - {id}] Error deleting file: {file_path}")
 
         elif file.type == FileChangeType.MOVED:
+            image_inserter.flush()
             if move_image_path(file.src, file.dst, False, session):
                 print(f"[watchdog - Result - {id}] Move image: {file.src} -> {file.dst}")
             else:
@@ -247,6 +253,12 @@ def process_waitting_list(id):
                 file = item.files.pop(0)
 
             process_file(file, id)
+
+            with list_lock:
+                is_last = len(item.files) == 0 and len(waitting_list) == 1
+            if is_last:
+                # all changes are processed, make the pending images visible before idle
+                image_inserter.flush()
             
             with list_lock:
                 if len(item.files) == 0:
@@ -379,6 +391,7 @@ class WatchdogService:
         for path in paths:
             self.add(Path(path))
         run_thread = True
+        image_inserter.start()
         for process_thread in self.process_threads:
             process_thread.start()
         self.observer.start()
@@ -394,5 +407,6 @@ class WatchdogService:
                 process_thread.join()
             if not any(thread.is_alive() for thread in self.process_threads):
                 break
+        image_inserter.stop()
         self.observer.stop()
         self.observer.join()